@@ -0,0 +1,182 @@
+import argparse
+import asyncio
+import json
+import os
+import sys
+import time
+import typing
+from google import genai
+from aiotieba import ThreadSortType
+import core_logic as core
+
+SORT_CHOICES = {"reply": ThreadSortType.REPLY, "create": ThreadSortType.CREATE, "hot": ThreadSortType.HOT}
+
+def parse_args(argv: typing.Optional[list[str]] = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(prog="tiebagpt-batch", description="无界面批量分析贴吧帖子，结果以 JSONL 格式逐行输出。")
+    source = parser.add_mutually_exclusive_group(required=True)
+    source.add_argument("--forum", help="要批量分析的贴吧名称")
+    source.add_argument("--tids", nargs="+", type=int, help="要分析的帖子 TID 列表")
+    source.add_argument("--tids-file", help="每行一个 TID 的文本文件")
+    parser.add_argument("--forum-pages", type=int, default=1, help="从贴吧获取帖子列表的页数 (默认: 1)")
+    parser.add_argument("--sort", choices=SORT_CHOICES.keys(), default="reply", help="贴吧帖子列表排序方式 (默认: reply)")
+    parser.add_argument("--query", help="在贴吧内按关键词搜索帖子，而不是按排序浏览")
+    parser.add_argument("-o", "--output", default="-", help="JSONL 输出文件，'-' 表示标准输出 (默认: -)")
+    parser.add_argument("--resume", action="store_true", help="跳过输出文件中已完整分析的帖子，并以追加方式写入；部分失败的帖子从已保存的分块继续")
+    parser.add_argument("--concurrency", type=int, default=4, help="同时分析的帖子数量上限 (默认: 4)")
+    parser.add_argument("--reply-mode", action="append", default=[], metavar="MODE_ID", help="分析完成后使用该回复模式生成回复，可重复指定")
+    parser.add_argument("--custom-input", help="自定义回复模式所需的输入内容")
+    parser.add_argument("--api-key", help="Gemini API Key (默认读取配置文件或 GEMINI_API_KEY 环境变量)")
+    parser.add_argument("--analyzer-model", help="分析模型 (默认读取配置文件)")
+    parser.add_argument("--generator-model", help="生成模型 (默认读取配置文件)")
+    parser.add_argument("--metrics", help="运行结束后将各阶段性能统计写入该文件 (.prom 为 Prometheus 文本格式，其余为 JSON)")
+    parser.add_argument("-v", "--verbose", action="store_true", help="将详细日志输出到标准错误")
+    args = parser.parse_args(argv)
+    if args.query and not args.forum:
+        parser.error("--query 只能与 --forum 一起使用")
+    return args
+
+def load_finished_tids(output_path: str) -> set[int]:
+    finished = set()
+    if output_path == "-" or not os.path.exists(output_path):
+        return finished
+    with open(output_path, 'r', encoding='utf-8') as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                continue
+            # 有缺失页面或分块的结果不算完成，再次运行时从检查点继续
+            if "summary" in record and "tid" in record and not record.get("failed_pages") and not record.get("failed_chunks"):
+                finished.add(int(record["tid"]))
+    return finished
+
+def make_logger(verbose: bool, prefix: str = "") -> typing.Callable:
+    if not verbose:
+        return lambda message: None
+    return lambda message: print(f"{prefix}{message}", file=sys.stderr, flush=True)
+
+async def collect_tids(args: argparse.Namespace, tieba_clients: core.TiebaClientManager, log_callback: typing.Callable) -> list[int]:
+    if args.tids:
+        return list(args.tids)
+    if args.tids_file:
+        with open(args.tids_file, 'r', encoding='utf-8') as f:
+            return [int(line.strip()) for line in f if line.strip()]
+    tids, seen = [], set()
+    async with tieba_clients.session() as client:
+        for page_num in range(1, args.forum_pages + 1):
+            if args.query:
+                threads = await core.search_threads_by_page(client, args.forum, args.query, page_num, log_callback)
+            else:
+                threads = await core.fetch_threads_by_page(client, args.forum, page_num, SORT_CHOICES[args.sort], log_callback)
+            if not tieba_clients.report_result(client, threads):
+                break
+            for thread in threads:
+                if thread.tid not in seen:
+                    seen.add(thread.tid); tids.append(thread.tid)
+    return tids
+
+async def analyze_one_thread(tid: int, args: argparse.Namespace, settings: dict, gemini_client: genai.Client, repository: core.ThreadPageRepository, chunk_store) -> dict:
+    log_callback = make_logger(args.verbose, prefix=f"[{tid}] ")
+    started = time.perf_counter()
+    record: dict = {"tid": tid}
+    # 首页经由页面仓库获取，分析流程随后直接复用，不会重复请求
+    thread_obj, posts_obj, all_comments, _ = await repository.get_page(tid, 1, log_callback)
+    if not thread_obj or not posts_obj:
+        record["error"] = "无法获取帖子内容。"
+        record["elapsed"] = round(time.perf_counter() - started, 3)
+        return record
+    total_pages = posts_obj.page.total_page
+    record.update({"title": thread_obj.title, "total_pages": total_pages})
+    result = await core.analyze_stance_by_page(
+        None, gemini_client, tid, total_pages, settings["analyzer_model"], log_callback, lambda *progress: None,
+        chunk_char_budget=settings.get("chunk_char_budget", core.DEFAULT_CHUNK_CHAR_BUDGET),
+        fetch_concurrency=settings.get("fetch_concurrency", core.DEFAULT_FETCH_CONCURRENCY),
+        analysis_concurrency=settings.get("analysis_concurrency", core.DEFAULT_ANALYSIS_CONCURRENCY),
+        chunk_store=chunk_store,
+        reduce_fan_in=settings.get("reduce_fan_in", core.DEFAULT_REDUCE_FAN_IN),
+        reduce_max_depth=settings.get("reduce_max_depth", core.DEFAULT_REDUCE_MAX_DEPTH),
+        repository=repository)
+    record.update(result)
+    if "summary" in result and args.reply_mode:
+        discussion_text = f"{core.format_main_post_text(thread_obj)}\n{core.format_discussion_text(thread_obj, posts_obj.objs, all_comments)}"
+        record["replies"] = {}
+        # 多个回复模式共用同一份讨论上下文，注册一次上下文缓存后各模式只发送各自的部分
+        context_cache = core.GeminiContextCache(gemini_client) if len(args.reply_mode) > 1 else None
+        try:
+            for mode_id in args.reply_mode:
+                record["replies"][mode_id] = await core.generate_reply(gemini_client, discussion_text, result["summary"], mode_id, settings["generator_model"], log_callback, args.custom_input, context_cache=context_cache)
+        finally:
+            if context_cache: await context_cache.close()
+    record["elapsed"] = round(time.perf_counter() - started, 3)
+    return record
+
+async def run_batch(args: argparse.Namespace) -> int:
+    log_callback = make_logger(args.verbose)
+    success, msg = core.ensure_default_prompts_exist_sync()
+    if not success:
+        print(msg, file=sys.stderr); return 1
+    success, msg = core.load_prompts()
+    if not success:
+        print(msg, file=sys.stderr); return 1
+    settings = core.load_settings()
+    if args.analyzer_model: settings["analyzer_model"] = args.analyzer_model
+    if args.generator_model: settings["generator_model"] = args.generator_model
+    api_key = args.api_key or settings.get("api_key") or os.getenv("GEMINI_API_KEY", "")
+    if not api_key:
+        print("未找到 Gemini API Key，请通过 --api-key、配置文件或 GEMINI_API_KEY 环境变量提供。", file=sys.stderr); return 1
+    gemini_client = genai.Client(api_key=api_key)
+    tieba_clients = core.TiebaClientManager(log_callback=log_callback)
+    page_cache = core.create_page_cache(settings)
+    chunk_store = core.create_chunk_store()
+    core.configure_response_cache(settings, log_callback)
+    repository = core.ThreadPageRepository(tieba_clients, page_cache, settings.get("comment_concurrency", core.DEFAULT_COMMENT_CONCURRENCY))
+
+    try:
+        tids = await collect_tids(args, tieba_clients, log_callback)
+        finished = load_finished_tids(args.output) if args.resume else set()
+        pending = [tid for tid in tids if tid not in finished]
+        print(f"共 {len(tids)} 个帖子，跳过已完成 {len(tids) - len(pending)} 个，待分析 {len(pending)} 个。", file=sys.stderr)
+
+        output = sys.stdout if args.output == "-" else open(args.output, 'a' if args.resume else 'w', encoding='utf-8')
+        semaphore = asyncio.Semaphore(max(1, args.concurrency))
+        write_lock = asyncio.Lock()
+        stats = {"ok": 0, "failed": 0, "pages": 0}
+        started = time.perf_counter()
+
+        async def _worker(tid: int):
+            async with semaphore:
+                try:
+                    record = await analyze_one_thread(tid, args, settings, gemini_client, repository, chunk_store)
+                except Exception as e:
+                    record = {"tid": tid, "error": f"分析时发生未知错误: {e}"}
+            async with write_lock:
+                stats["ok" if "summary" in record else "failed"] += 1
+                stats["pages"] += record.get("total_pages", 0)
+                output.write(json.dumps(record, ensure_ascii=False) + "\n"); output.flush()
+                print(f"[{stats['ok'] + stats['failed']}/{len(pending)}] TID {tid}: {'完成' if 'summary' in record else '失败'}", file=sys.stderr, flush=True)
+
+        try:
+            await asyncio.gather(*[_worker(tid) for tid in pending])
+        finally:
+            if output is not sys.stdout:
+                output.close()
+
+        elapsed = time.perf_counter() - started
+        done = stats["ok"] + stats["failed"]
+        per_hour = done / elapsed * 3600 if elapsed > 0 else 0.0
+        print(f"--- 批量分析完成: 成功 {stats['ok']}，失败 {stats['failed']}，共 {stats['pages']} 页，耗时 {elapsed:.1f} 秒，吞吐 {per_hour:.1f} 帖/小时 ---", file=sys.stderr)
+        return 0 if stats["failed"] == 0 else 2
+    finally:
+        await tieba_clients.close()
+        page_cache.close(); chunk_store.close()
+        if core.RESPONSE_CACHE is not None:
+            core.RESPONSE_CACHE.close(); core.RESPONSE_CACHE = None
+        if args.metrics:
+            with open(args.metrics, 'w', encoding='utf-8') as f:
+                f.write(core.PERF.export_prometheus() if args.metrics.endswith(".prom") else core.PERF.export_json(include_spans=False))
+
+def main(argv: typing.Optional[list[str]] = None) -> int:
+    return asyncio.run(run_batch(parse_args(argv)))
+
+if __name__ == "__main__":
+    sys.exit(main())
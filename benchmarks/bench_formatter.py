@@ -0,0 +1,142 @@
+import argparse
+import asyncio
+import os
+import sys
+import time
+import typing
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import core_logic as core
+from cache_store import dump_thread_page, load_thread_page
+from benchmarks.fakes import FakeTiebaClient, FakeTiebaConfig
+
+BENCH_TID = 1
+
+# 旧版格式化实现，作为输出一致性与速度对比的基准
+
+def legacy_format_contents(contents) -> str:
+    if not contents or not contents.objs: return ""
+    parts = []
+    for frag in contents.objs:
+        type_name = type(frag).__name__
+        if type_name == 'FragText': parts.append(frag.text)
+        elif type_name == 'FragEmoji': parts.append(f"[表情:{frag.desc}]")
+        elif type_name in ['FragImage_p', 'FragImage_c', 'FragImage_t']: parts.append("[图片]")
+        elif type_name == 'FragAt': parts.append(frag.text)
+        elif type_name == 'FragLink': parts.append(f"[链接:{frag.text}]")
+        elif type_name in ['FragVoice_p', 'FragVoice_c']: parts.append("[语音]")
+    return " ".join(parts).strip()
+
+def legacy_format_user_info(user, lz_user_name: str = "") -> str:
+    if not user:
+        return "(用户: 未知用户)"
+    parts = []
+    user_name = getattr(user, 'user_name', '未知用户')
+    parts.append(f"用户: {user_name}")
+    nick_name = getattr(user, 'nick_name', '无昵称')
+    parts.append(f"昵称: {nick_name}")
+    if lz_user_name and user_name == lz_user_name:
+        parts.append("楼主")
+    if getattr(user, 'is_bawu', False):
+        parts.append("吧务")
+    level = getattr(user, 'level', None)
+    if level is not None and level > 0:
+        parts.append(f"Lv.{level}")
+    ip_addr = getattr(user, 'ip', None)
+    if ip_addr:
+        parts.append(f"IP:{ip_addr}")
+    return f"({', '.join(parts)})"
+
+def legacy_format_discussion_text(thread, posts, all_comments) -> str:
+    discussion_lines = []
+    lz_user_name = getattr(thread.user, 'user_name', '未知用户')
+    for post in posts:
+        if post.floor == 1:
+            continue
+        post_text = legacy_format_contents(post.contents).strip()
+        if not post_text:
+            continue
+        user_info_str = legacy_format_user_info(post.user, lz_user_name)
+        discussion_lines.append(f"\n[回复 {post.floor}楼] {user_info_str}")
+        discussion_lines.append(post_text)
+        if post.pid in all_comments:
+            for j, comment in enumerate(all_comments[post.pid]):
+                comment_text = legacy_format_contents(comment.contents).strip()
+                if not comment_text:
+                    continue
+                comment_user_info_str = legacy_format_user_info(comment.user, lz_user_name)
+                discussion_lines.append(f"  [楼中楼 to {post.floor}楼, #{j+1}] {comment_user_info_str}")
+                discussion_lines.append(f"  > {comment_text}")
+    if posts:
+        discussion_lines.insert(0, "---\n[讨论区]")
+    return "\n".join(discussion_lines)
+
+def parse_args(argv: typing.Optional[list[str]] = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="对比新旧帖子格式化实现的输出与耗时。")
+    parser.add_argument("--pages", type=int, default=200, help="生成的帖子页数 (默认: 200)")
+    parser.add_argument("--comment-density", type=float, default=0.5, help="带楼中楼的楼层比例 (0~1)")
+    parser.add_argument("--repeat", type=int, default=5, help="每种实现重复格式化的次数，取最快一次 (默认: 5)")
+    parser.add_argument("--cached", action="store_true", help="使用经页面缓存序列化/反序列化后的对象进行测试")
+    return parser.parse_args(argv)
+
+def make_client(args: argparse.Namespace) -> FakeTiebaClient:
+    return FakeTiebaClient(FakeTiebaConfig(total_pages=args.pages, comment_density=args.comment_density, latency=0.0))
+
+async def build_pages(args: argparse.Namespace) -> tuple[typing.Any, list[tuple]]:
+    client = make_client(args)
+    pages = []
+    for page_num in range(1, args.pages + 1):
+        posts = await client.get_posts(BENCH_TID, pn=page_num, with_comments=True, comment_rn=core.EMBEDDED_COMMENTS_PER_POST)
+        comments = {post.pid: await client.get_comments(BENCH_TID, post.pid) for post in posts.objs if post.reply_num}
+        if args.cached:
+            _, posts, comments = load_thread_page(dump_thread_page(posts, comments))
+        pages.append((posts, comments))
+    return pages[0][0].thread, pages
+
+async def embedded_comment_texts(args: argparse.Namespace) -> list[str]:
+    # 经由 fetch_full_thread_data 获取：楼中楼不超过内嵌条数的楼层直接复用随楼层返回的楼中楼
+    client = make_client(args)
+    texts = []
+    for page_num in range(1, args.pages + 1):
+        thread, posts, comments = await core.fetch_full_thread_data(client, BENCH_TID, lambda message: None, page_num=page_num)
+        texts.append(core.format_discussion_text(thread, posts.objs, comments))
+    return texts
+
+def best_of(repeat: int, func: typing.Callable) -> tuple[float, typing.Any]:
+    best, result = float("inf"), None
+    for _ in range(repeat):
+        started = time.perf_counter()
+        result = func()
+        best = min(best, time.perf_counter() - started)
+    return best, result
+
+def main(argv: typing.Optional[list[str]] = None) -> int:
+    args = parse_args(argv)
+    thread, pages = asyncio.run(build_pages(args))
+
+    def run_legacy() -> list[str]:
+        return [legacy_format_discussion_text(thread, posts.objs, comments) for posts, comments in pages]
+
+    def run_current() -> list[str]:
+        # 与分析流程一致：整个帖子共用一个用户信息缓存
+        memo = core.UserInfoMemo(getattr(thread.user, 'user_name', '未知用户'))
+        texts = []
+        for posts, comments in pages:
+            blocks = core.format_post_blocks(thread, posts.objs, comments, memo)
+            texts.append("\n".join([core.DISCUSSION_HEADER] + blocks) if posts.objs else "")
+        return texts
+
+    legacy_time, legacy_texts = best_of(args.repeat, run_legacy)
+    current_time, current_texts = best_of(args.repeat, run_current)
+    standalone_texts = [core.format_discussion_text(thread, posts.objs, comments) for posts, comments in pages]
+    identical = legacy_texts == current_texts == standalone_texts
+    embedded_identical = asyncio.run(embedded_comment_texts(args)) == standalone_texts
+    total_chars = sum(map(len, current_texts))
+    print(f"页数 {args.pages}，输出 {total_chars} 字符，输出一致: {'是' if identical else '否'}，复用内嵌楼中楼后输出一致: {'是' if embedded_identical else '否'}")
+    print(f"旧实现: {legacy_time * 1000:.1f} ms  ({args.pages / legacy_time:.0f} 页/秒)")
+    print(f"新实现: {current_time * 1000:.1f} ms  ({args.pages / current_time:.0f} 页/秒)")
+    print(f"加速比: {legacy_time / current_time:.2f}x")
+    return 0 if identical and embedded_identical else 1
+
+if __name__ == "__main__":
+    sys.exit(main())
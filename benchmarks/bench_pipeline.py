@@ -0,0 +1,163 @@
+import argparse
+import asyncio
+import json
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+import typing
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import core_logic as core
+from benchmarks.fakes import FakeGeminiClient, FakeGeminiConfig, FakeTiebaClient, FakeTiebaConfig
+
+BENCH_TID = 8000000001
+SCENARIOS = ("fetch", "analyze", "stream")
+
+def parse_args(argv: typing.Optional[list[str]] = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="使用本地替身后端离线测量抓取、分析与流式回复的性能。")
+    parser.add_argument("--scenario", choices=SCENARIOS, action="append", help="要运行的场景，可重复指定 (默认: 全部)")
+    parser.add_argument("--pages", default="1,10,100,1000", help="逗号分隔的帖子页数列表 (默认: 1,10,100,1000)")
+    parser.add_argument("--posts-per-page", type=int, default=core.POSTS_PER_PAGE, help="每页楼层数")
+    parser.add_argument("--comment-density", type=float, default=0.3, help="带楼中楼的楼层比例 (0~1)")
+    parser.add_argument("--comments-per-floor", type=int, default=6, help="单个楼层楼中楼数量上限")
+    parser.add_argument("--text-length", type=int, default=120, help="每个楼层的正文长度 (字符)")
+    parser.add_argument("--tieba-latency", type=float, default=0.05, help="贴吧接口单次延迟 (秒)")
+    parser.add_argument("--tieba-jitter", type=float, default=0.0, help="贴吧接口额外随机延迟上限 (秒)")
+    parser.add_argument("--tieba-error-rate", type=float, default=0.0, help="贴吧接口随机失败的概率 (0~1)，用于测试重试与恢复")
+    parser.add_argument("--gemini-latency", type=float, default=0.5, help="Gemini 单次调用基础延迟 (秒)")
+    parser.add_argument("--gemini-seconds-per-kchar", type=float, default=0.0, help="Gemini 每千字符 Prompt 的额外延迟 (秒)")
+    parser.add_argument("--gemini-error-rate", type=float, default=0.0, help="Gemini 调用随机失败的概率 (0~1)")
+    parser.add_argument("--stream-chunks", type=int, default=20, help="流式回复切分的片段数")
+    parser.add_argument("--reply-modes", type=int, default=1, help="流式场景中依次生成回复的模式数量 (默认: 1)")
+    parser.add_argument("--context-cache", action="store_true", help="流式场景中为共享的讨论上下文注册显式上下文缓存")
+    parser.add_argument("--fetch-concurrency", type=int, default=core.DEFAULT_FETCH_CONCURRENCY)
+    parser.add_argument("--analysis-concurrency", type=int, default=core.DEFAULT_ANALYSIS_CONCURRENCY)
+    parser.add_argument("--comment-concurrency", type=int, default=core.DEFAULT_COMMENT_CONCURRENCY)
+    parser.add_argument("--chunk-char-budget", type=int, default=core.DEFAULT_CHUNK_CHAR_BUDGET)
+    parser.add_argument("--reduce-fan-in", type=int, default=core.DEFAULT_REDUCE_FAN_IN)
+    parser.add_argument("--reduce-max-depth", type=int, default=core.DEFAULT_REDUCE_MAX_DEPTH)
+    parser.add_argument("--with-cache", action="store_true", help="启用临时目录中的页面缓存、分块摘要存储与AI响应缓存，并连续分析两次")
+    parser.add_argument("--no-memory", action="store_true", help="不使用 tracemalloc 统计峰值内存 (可减少测量开销)")
+    parser.add_argument("--json", dest="json_path", help="将结果以 JSON 写入该文件")
+    return parser.parse_args(argv)
+
+def load_bench_prompts():
+    prompts_path = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), core.DEFAULT_PROMPTS_FILENAME)
+    with open(prompts_path, 'r', encoding='utf-8') as f:
+        core.PROMPTS = json.load(f)
+
+def make_backends(args: argparse.Namespace, total_pages: int) -> tuple[FakeTiebaClient, FakeGeminiClient]:
+    tieba = FakeTiebaClient(FakeTiebaConfig(
+        total_pages=total_pages, posts_per_page=args.posts_per_page, comment_density=args.comment_density,
+        comments_per_floor=args.comments_per_floor, text_length=args.text_length, latency=args.tieba_latency, jitter=args.tieba_jitter, error_rate=args.tieba_error_rate))
+    gemini = FakeGeminiClient(FakeGeminiConfig(latency=args.gemini_latency, seconds_per_kchar=args.gemini_seconds_per_kchar, stream_chunks=args.stream_chunks, error_rate=args.gemini_error_rate))
+    return tieba, gemini
+
+async def bench_fetch(args: argparse.Namespace, tieba: FakeTiebaClient, gemini: FakeGeminiClient, total_pages: int, stores: dict) -> dict:
+    pages_ok = 0
+    async for page_num, posts, comments, _ in core.iter_thread_pages(tieba, BENCH_TID, range(1, total_pages + 1), lambda message: None, args.fetch_concurrency, stores.get("page_cache"), args.comment_concurrency):
+        if posts: pages_ok += 1
+    return {"pages_ok": pages_ok}
+
+async def bench_analyze(args: argparse.Namespace, tieba: FakeTiebaClient, gemini: FakeGeminiClient, total_pages: int, stores: dict) -> dict:
+    result = await core.analyze_stance_by_page(
+        tieba, gemini, BENCH_TID, total_pages, "bench-model", lambda message: None, lambda *progress: None,
+        chunk_char_budget=args.chunk_char_budget, fetch_concurrency=args.fetch_concurrency, analysis_concurrency=args.analysis_concurrency,
+        page_cache=stores.get("page_cache"), chunk_store=stores.get("chunk_store"),
+        reduce_fan_in=args.reduce_fan_in, reduce_max_depth=args.reduce_max_depth, comment_concurrency=args.comment_concurrency)
+    return {"ok": "summary" in result, "failed_pages": len(result.get("failed_pages", [])), "recovered_pages": len(result.get("recovered_pages", [])),
+            "failed_chunks": result.get("failed_chunks", 0), "reused_chunks": result.get("reused_chunks", 0)}
+
+async def bench_stream(args: argparse.Namespace, tieba: FakeTiebaClient, gemini: FakeGeminiClient, total_pages: int, stores: dict) -> dict:
+    thread, posts, comments = await core.fetch_full_thread_data(tieba, BENCH_TID, lambda message: None, page_num=1, page_cache=stores.get("page_cache"), comment_concurrency=args.comment_concurrency)
+    discussion_text = f"{core.format_main_post_text(thread)}\n{core.format_discussion_text(thread, posts.objs, comments)}"
+    modes = [mode_id for mode_id, mode in core.PROMPTS.get('reply_generator', {}).get('modes', {}).items() if not mode.get('is_custom')]
+    context_cache = core.GeminiContextCache(gemini) if args.context_cache else None
+    timings = {"first_chunk": [], "chunks": 0, "chars": 0}
+    # 模拟同一帖子下依次尝试多个回复模式
+    for mode_id in modes[:max(1, args.reply_modes)]:
+        started = time.perf_counter()
+        first_chunk = None
+        async for text in core.generate_reply_stream(gemini, discussion_text, "基准测试摘要", mode_id, "bench-model", lambda message: None, context_cache=context_cache):
+            if first_chunk is None:
+                first_chunk = round(time.perf_counter() - started, 4)
+            timings["chunks"] += 1
+            timings["chars"] += len(text)
+        timings["first_chunk"].append(first_chunk)
+    if context_cache:
+        await context_cache.close()
+    return timings
+
+BENCHES = {"fetch": bench_fetch, "analyze": bench_analyze, "stream": bench_stream}
+
+async def run_case(args: argparse.Namespace, scenario: str, total_pages: int, stores: dict, run: int = 1) -> dict:
+    tieba, gemini = make_backends(args, total_pages)
+    core.PERF.reset()
+    if not args.no_memory:
+        tracemalloc.start()
+    started = time.perf_counter()
+    details = await BENCHES[scenario](args, tieba, gemini, total_pages, stores)
+    elapsed = time.perf_counter() - started
+    peak = 0
+    if not args.no_memory:
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+    return {
+        "scenario": scenario, "pages": total_pages, "run": run,
+        "elapsed": round(elapsed, 4),
+        "pages_per_second": round(total_pages / elapsed, 2) if elapsed > 0 and scenario != "stream" else None,
+        "peak_memory_mb": round(peak / 1024 / 1024, 2) if not args.no_memory else None,
+        "tieba_calls": dict(tieba.calls), "tieba_peak_in_flight": tieba.peak_in_flight,
+        "gemini_calls": {k: v for k, v in gemini.calls.items() if not k.endswith("_chars")},
+        "gemini_prompt_chars": gemini.calls["prompt_chars"],
+        "gemini_cached_chars": gemini.calls["cached_chars"],
+        "details": details,
+        "stages": core.PERF.summary(),
+    }
+
+def format_row(record: dict) -> str:
+    tieba_calls = record["tieba_calls"]
+    gemini_calls = sum(record["gemini_calls"].values())
+    memory = f"{record['peak_memory_mb']:>8.2f}" if record["peak_memory_mb"] is not None else f"{'-':>8}"
+    throughput = f"{record['pages_per_second']:>9.1f}" if record["pages_per_second"] is not None else f"{'-':>9}"
+    return (f"{record['scenario']:<8} {record['pages']:>6} {record['run']:>3} {record['elapsed']:>9.3f} {throughput} "
+            f"{tieba_calls['get_posts']:>7} {tieba_calls['get_comments']:>9} {gemini_calls:>7} {memory}")
+
+async def run_benchmarks(args: argparse.Namespace) -> list[dict]:
+    load_bench_prompts()
+    scenarios = args.scenario or list(SCENARIOS)
+    page_counts = [int(p) for p in args.pages.split(",") if p.strip()]
+    records = []
+    print(f"{'场景':<6} {'页数':>4} {'轮':>2} {'耗时(s)':>7} {'页/秒':>7} {'posts':>7} {'comments':>9} {'gemini':>7} {'峰值MB':>6}")
+    for scenario in scenarios:
+        # 流式回复只依赖首页内容，与帖子总页数无关
+        for total_pages in (page_counts[:1] if scenario == "stream" else page_counts):
+            with tempfile.TemporaryDirectory() as tmp_dir:
+                stores = {}
+                if args.with_cache:
+                    stores["page_cache"] = core.ThreadPageCache(os.path.join(tmp_dir, "pages.sqlite3"), ttl_seconds=3600, max_bytes=1024 ** 3)
+                    stores["chunk_store"] = core.ChunkSummaryStore(os.path.join(tmp_dir, "chunks.sqlite3"), max_bytes=1024 ** 3)
+                    stores["response_cache"] = core.RESPONSE_CACHE = core.ResponseCache(os.path.join(tmp_dir, "responses.sqlite3"), max_bytes=1024 ** 3)
+                try:
+                    for run in range(1, 3 if args.with_cache else 2):
+                        record = await run_case(args, scenario, total_pages, stores, run)
+                        records.append(record)
+                        print(format_row(record), flush=True)
+                finally:
+                    core.RESPONSE_CACHE = None
+                    for store in stores.values():
+                        store.close()
+    return records
+
+def main(argv: typing.Optional[list[str]] = None) -> int:
+    args = parse_args(argv)
+    records = asyncio.run(run_benchmarks(args))
+    if args.json_path:
+        with open(args.json_path, 'w', encoding='utf-8') as f:
+            json.dump({"config": vars(args), "results": records}, f, ensure_ascii=False, indent=2)
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
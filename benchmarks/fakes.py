@@ -0,0 +1,279 @@
+import asyncio
+import random
+import typing
+from dataclasses import dataclass, field
+
+# 本地替身：只模拟 core_logic 实际用到的 aiotieba / google-genai 接口与对象字段，并统计调用次数
+
+class FakeAPIError(Exception):
+    # 与 google.genai.errors.APIError 字段一致：code 为 HTTP 状态码，details 为错误详情
+    def __init__(self, code: int, message: str, details: typing.Optional[dict] = None):
+        super().__init__(f"{code} {message}")
+        self.code = code
+        self.details = details
+
+def _injected_error(rng: random.Random, error_rate: float) -> typing.Optional[FakeAPIError]:
+    if error_rate <= 0 or rng.random() >= error_rate:
+        return None
+    if rng.random() < 0.5:
+        return FakeAPIError(429, "RESOURCE_EXHAUSTED", {"error": {"details": [{"@type": "type.googleapis.com/google.rpc.RetryInfo", "retryDelay": "0.2s"}]}})
+    return FakeAPIError(503, "UNAVAILABLE")
+
+class FragText:
+    def __init__(self, text: str): self.text = text
+
+class FragEmoji:
+    def __init__(self, desc: str): self.desc = desc
+
+class FragAt:
+    def __init__(self, text: str): self.text = text
+
+class FragLink:
+    def __init__(self, text: str): self.text = text
+
+class FragImage_p:
+    pass
+
+@dataclass
+class FakeContents:
+    objs: list = field(default_factory=list)
+
+@dataclass
+class FakeUser:
+    user_name: str
+    nick_name: str
+    level: int = 1
+    is_bawu: bool = False
+    ip: str = ""
+
+@dataclass
+class FakeComment:
+    pid: int
+    contents: FakeContents
+    user: FakeUser
+
+@dataclass
+class FakePost:
+    pid: int
+    floor: int
+    contents: FakeContents
+    user: FakeUser
+    reply_num: int = 0
+    comments: list = field(default_factory=list)
+
+@dataclass
+class FakeThread:
+    tid: int
+    title: str
+    contents: FakeContents
+    user: FakeUser
+    reply_num: int = 0
+    last_time: int = 0
+
+@dataclass
+class FakePage:
+    total_page: int
+    current_page: int = 1
+
+@dataclass
+class FakePosts:
+    objs: list
+    thread: FakeThread
+    page: FakePage
+    err: typing.Optional[Exception] = None
+
+    def __bool__(self) -> bool:
+        return bool(self.objs)
+
+@dataclass
+class FakeTiebaConfig:
+    total_pages: int = 10
+    posts_per_page: int = 30
+    comment_density: float = 0.3
+    comments_per_floor: int = 6
+    text_length: int = 120
+    latency: float = 0.05
+    jitter: float = 0.0
+    seed: int = 29
+    # 每次请求随机失败的概率，用于测试重试与部分失败恢复
+    error_rate: float = 0.0
+
+class FakeTiebaClient:
+    def __init__(self, config: FakeTiebaConfig):
+        self.config = config
+        self.calls = {"get_posts": 0, "get_comments": 0, "get_threads": 0}
+        self.in_flight = 0
+        self.peak_in_flight = 0
+        self._errors = random.Random(config.seed)
+        self._users = [FakeUser(f"user{i}", f"昵称{i}", level=i % 18 + 1, is_bawu=i == 0, ip="广东" if i % 3 else "") for i in range(50)]
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        return None
+
+    async def _wait(self):
+        self.in_flight += 1
+        self.peak_in_flight = max(self.peak_in_flight, self.in_flight)
+        try:
+            delay = self.config.latency + (random.random() * self.config.jitter if self.config.jitter else 0.0)
+            await asyncio.sleep(delay)
+        finally:
+            self.in_flight -= 1
+
+    def _contents(self, rng: random.Random, length: int) -> FakeContents:
+        text = "测试内容" * max(1, length // 4)
+        objs = [FragText(text)]
+        if rng.random() < 0.2: objs.append(FragEmoji("滑稽"))
+        if rng.random() < 0.1: objs.append(FragImage_p())
+        if rng.random() < 0.05: objs.append(FragAt(f"@{rng.choice(self._users).user_name}"))
+        if rng.random() < 0.05: objs.append(FragLink("https://tieba.baidu.com"))
+        return FakeContents(objs)
+
+    def _reply_num(self, pid: int) -> int:
+        rng = random.Random(pid * 7919 + self.config.seed)
+        return rng.randint(1, self.config.comments_per_floor) if rng.random() < self.config.comment_density else 0
+
+    def _comments(self, pid: int, count: int) -> list[FakeComment]:
+        rng = random.Random(pid + self.config.seed)
+        return [FakeComment(pid * 100 + i, self._contents(rng, self.config.text_length // 2), rng.choice(self._users)) for i in range(count)]
+
+    def _thread(self, tid: int) -> FakeThread:
+        rng = random.Random(tid + self.config.seed)
+        return FakeThread(tid, f"测试帖子 {tid}", self._contents(rng, self.config.text_length * 2), self._users[1], reply_num=self.config.total_pages * self.config.posts_per_page, last_time=tid)
+
+    async def get_posts(self, tid: int, pn: int = 1, rn: int = 30, with_comments: bool = False, comment_rn: int = 4, comment_sort_by_agree: bool = True, **kwargs) -> FakePosts:
+        self.calls["get_posts"] += 1
+        await self._wait()
+        thread = self._thread(tid)
+        # 与 aiotieba 一致：请求失败时不抛出异常，返回带 err 的空结果
+        error = _injected_error(self._errors, self.config.error_rate)
+        if error is not None:
+            return FakePosts([], thread, FakePage(self.config.total_pages, pn), err=error)
+        if pn > self.config.total_pages:
+            return FakePosts([], thread, FakePage(self.config.total_pages, pn))
+        rng = random.Random(tid * 100003 + pn + self.config.seed)
+        posts = []
+        for i in range(min(rn, self.config.posts_per_page)):
+            floor = (pn - 1) * self.config.posts_per_page + i + 1
+            pid = tid * 1000000 + floor
+            reply_num = self._reply_num(pid)
+            post = FakePost(pid, floor, self._contents(rng, self.config.text_length), rng.choice(self._users), reply_num)
+            if with_comments and reply_num:
+                # 与 aiotieba 一致：默认返回点赞最多的几条楼中楼（以 pid 的散列模拟点赞数）
+                comments = self._comments(pid, reply_num)
+                if comment_sort_by_agree:
+                    comments.sort(key=lambda comment: comment.pid * 2654435761 % 97, reverse=True)
+                post.comments = comments[:comment_rn]
+            posts.append(post)
+        return FakePosts(posts, thread, FakePage(self.config.total_pages, pn))
+
+    async def get_comments(self, tid: int, pid: int, pn: int = 1, **kwargs) -> list[FakeComment]:
+        self.calls["get_comments"] += 1
+        await self._wait()
+        error = _injected_error(self._errors, self.config.error_rate)
+        if error is not None:
+            raise error
+        return self._comments(pid, self._reply_num(pid))
+
+    async def get_threads(self, fname: str, pn: int = 1, **kwargs) -> list[FakeThread]:
+        self.calls["get_threads"] += 1
+        await self._wait()
+        return [self._thread(pn * 100 + i) for i in range(30)]
+
+@dataclass
+class FakeGeminiConfig:
+    latency: float = 0.5
+    seconds_per_kchar: float = 0.0
+    stream_chunks: int = 20
+    response_chars: int = 800
+    error_rate: float = 0.0
+    seed: int = 29
+    # 命中显式上下文缓存的字符按此比例计入延迟
+    cached_char_factor: float = 0.25
+
+class FakeResponse:
+    def __init__(self, text: str):
+        self.text = text
+        self.prompt_feedback = None
+        self.usage_metadata = None
+
+def _prompt_chars(contents) -> int:
+    total = 0
+    for content in contents if isinstance(contents, list) else [contents]:
+        for part in getattr(content, 'parts', None) or [content]:
+            total += len(getattr(part, 'text', None) or str(part))
+    return total
+
+class FakeCachedContent:
+    def __init__(self, name: str, chars: int):
+        self.name = name
+        self.chars = chars
+
+class FakeCaches:
+    # 显式上下文缓存的本地替身：只记录内容长度，生成时按 cached_char_factor 折算
+    def __init__(self, calls: dict):
+        self.calls = calls
+        self.entries: dict[str, FakeCachedContent] = {}
+
+    async def create(self, model: str, config=None) -> FakeCachedContent:
+        self.calls["caches_create"] += 1
+        name = f"cachedContents/fake-{len(self.entries) + self.calls['caches_delete']}"
+        self.entries[name] = FakeCachedContent(name, _prompt_chars((config or {}).get("contents", [])))
+        return self.entries[name]
+
+    async def delete(self, name: str, config=None):
+        self.calls["caches_delete"] += 1
+        self.entries.pop(name, None)
+
+class FakeModels:
+    def __init__(self, config: FakeGeminiConfig, calls: dict, caches: FakeCaches):
+        self.config = config
+        self.calls = calls
+        self.caches = caches
+        self._errors = random.Random(config.seed)
+
+    def _delay(self, contents, config=None) -> float:
+        error = _injected_error(self._errors, self.config.error_rate)
+        if error is not None:
+            raise error
+        chars = _prompt_chars(contents)
+        self.calls["prompt_chars"] += chars
+        cached_name = (config or {}).get("cached_content")
+        if cached_name:
+            cached = self.caches.entries.get(cached_name)
+            if cached is None:
+                raise FakeAPIError(404, f"NOT_FOUND: {cached_name}")
+            self.calls["cached_chars"] += cached.chars
+            chars += cached.chars * self.config.cached_char_factor
+        return self.config.latency + chars / 1000 * self.config.seconds_per_kchar
+
+    async def generate_content(self, model: str, contents, config=None) -> FakeResponse:
+        self.calls["generate_content"] += 1
+        await asyncio.sleep(self._delay(contents, config))
+        return FakeResponse("摘要" * (self.config.response_chars // 2))
+
+    async def generate_content_stream(self, model: str, contents, config=None) -> typing.AsyncIterator[FakeResponse]:
+        self.calls["generate_content_stream"] += 1
+        delay = self._delay(contents, config)
+        piece = "回复" * max(1, self.config.response_chars // (2 * self.config.stream_chunks))
+
+        async def _chunks():
+            for _ in range(self.config.stream_chunks):
+                await asyncio.sleep(delay / self.config.stream_chunks)
+                yield FakeResponse(piece)
+        return _chunks()
+
+class FakeAioClient:
+    def __init__(self, models: FakeModels, caches: FakeCaches):
+        self.models = models
+        self.caches = caches
+
+class FakeGeminiClient:
+    # 与 genai.Client 一致，异步接口位于 client.aio 下
+    def __init__(self, config: FakeGeminiConfig):
+        self.config = config
+        self.calls = {"generate_content": 0, "generate_content_stream": 0, "caches_create": 0, "caches_delete": 0, "prompt_chars": 0, "cached_chars": 0}
+        caches = FakeCaches(self.calls)
+        self.aio = FakeAioClient(FakeModels(config, self.calls, caches), caches)
@@ -0,0 +1,377 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+import typing
+import zlib
+from dataclasses import dataclass, field
+
+class SqliteStore:
+    # 所有本地缓存共用的 SQLite 基类：单连接 + 线程锁，可安全地在 asyncio.to_thread 中调用
+    SCHEMA = ""
+    # 结构变更脚本：在 SCHEMA 建表之后执行，第 i 项把数据库从版本 i 升级到 i + 1，因此 SCHEMA 中的表结构保持最初版本；
+    # 版本号记录在 PRAGMA user_version 中（按文件记录，同一文件只应有一个存储定义迁移）
+    MIGRATIONS: tuple[str, ...] = ()
+
+    def __init__(self, path: str):
+        self.path = path
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.executescript(self.SCHEMA)
+        version = self._conn.execute("PRAGMA user_version").fetchone()[0]
+        for target, script in enumerate(self.MIGRATIONS[version:], start=version + 1):
+            self._conn.executescript(f"BEGIN; {script}; PRAGMA user_version = {target}; COMMIT;")
+
+    def _execute(self, sql: str, params: tuple = ()) -> list[tuple]:
+        with self._lock:
+            return self._conn.execute(sql, params).fetchall()
+
+    def _evict_to_size(self, table: str, max_bytes: int, order_column: str = "accessed_at"):
+        if max_bytes <= 0:
+            return
+        with self._lock:
+            total = self._conn.execute(f"SELECT COALESCE(SUM(size), 0) FROM {table}").fetchone()[0]
+            if total <= max_bytes:
+                return
+            rows = self._conn.execute(f"SELECT rowid, size FROM {table} ORDER BY {order_column} ASC").fetchall()
+            to_delete = []
+            for rowid, size in rows:
+                if total <= max_bytes:
+                    break
+                to_delete.append((rowid,))
+                total -= size
+            self._conn.executemany(f"DELETE FROM {table} WHERE rowid = ?", to_delete)
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+def _pack(data) -> bytes:
+    return zlib.compress(json.dumps(data, ensure_ascii=False, separators=(",", ":")).encode("utf-8"))
+
+def _unpack(blob: bytes):
+    return json.loads(zlib.decompress(blob).decode("utf-8"))
+
+# --- 帖子页面快照 ---
+# 从缓存恢复的对象只保留格式化与界面展示用到的字段；片段类沿用 aiotieba 的类名，以便 format_contents 按类型名分派
+class CachedFrag:
+    __slots__ = ("text", "desc")
+
+    def __init__(self, value: str):
+        self.text = value
+        self.desc = value
+
+_FRAG_CLASSES: dict[str, type] = {}
+
+def _frag_class(type_name: str) -> type:
+    frag_cls = _FRAG_CLASSES.get(type_name)
+    if frag_cls is None:
+        frag_cls = _FRAG_CLASSES[type_name] = type(type_name, (CachedFrag,), {"__slots__": ()})
+    return frag_cls
+
+@dataclass
+class CachedContents:
+    objs: list = field(default_factory=list)
+
+@dataclass
+class CachedUser:
+    user_name: str = "未知用户"
+    nick_name: str = "无昵称"
+    is_bawu: bool = False
+    level: typing.Optional[int] = None
+    ip: typing.Optional[str] = None
+
+@dataclass
+class CachedThread:
+    tid: int = 0
+    title: str = ""
+    user: typing.Optional[CachedUser] = None
+    contents: CachedContents = field(default_factory=CachedContents)
+    reply_num: int = 0
+    last_time: int = 0
+
+@dataclass
+class CachedPost:
+    pid: int = 0
+    floor: int = 0
+    user: typing.Optional[CachedUser] = None
+    contents: CachedContents = field(default_factory=CachedContents)
+    reply_num: int = 0
+
+@dataclass
+class CachedComment:
+    pid: int = 0
+    user: typing.Optional[CachedUser] = None
+    contents: CachedContents = field(default_factory=CachedContents)
+
+@dataclass
+class CachedPage:
+    total_page: int = 1
+    current_page: int = 1
+
+@dataclass
+class CachedPosts:
+    thread: CachedThread
+    objs: list[CachedPost]
+    page: CachedPage
+
+    def __bool__(self) -> bool:
+        return bool(self.objs)
+
+def _dump_contents(contents) -> list:
+    objs = getattr(contents, 'objs', None) or []
+    return [[type(frag).__name__, getattr(frag, 'desc', '') if type(frag).__name__ == 'FragEmoji' else getattr(frag, 'text', '')] for frag in objs]
+
+def _load_contents(data: list) -> CachedContents:
+    return CachedContents([_frag_class(type_name)(value) for type_name, value in data])
+
+def _dump_user(user) -> typing.Optional[list]:
+    if not user:
+        return None
+    return [getattr(user, 'user_name', '未知用户'), getattr(user, 'nick_name', '无昵称'), bool(getattr(user, 'is_bawu', False)), getattr(user, 'level', None), getattr(user, 'ip', None) or None]
+
+def _load_user(data: typing.Optional[list]) -> typing.Optional[CachedUser]:
+    return CachedUser(*data) if data else None
+
+def dump_thread_page(posts_obj, comments: dict) -> dict:
+    thread = posts_obj.thread
+    return {
+        "thread": [getattr(thread, 'tid', 0), getattr(thread, 'title', ''), _dump_user(getattr(thread, 'user', None)), _dump_contents(getattr(thread, 'contents', None)), getattr(thread, 'reply_num', 0), getattr(thread, 'last_time', 0)],
+        "page": [posts_obj.page.total_page, getattr(posts_obj.page, 'current_page', 1)],
+        "posts": [[post.pid, post.floor, _dump_user(post.user), _dump_contents(post.contents), getattr(post, 'reply_num', 0)] for post in posts_obj.objs],
+        "comments": {str(pid): [[c.pid, _dump_user(c.user), _dump_contents(c.contents)] for c in comment_list] for pid, comment_list in comments.items()},
+    }
+
+def load_thread_page(data: dict) -> tuple[CachedThread, CachedPosts, dict[int, list[CachedComment]]]:
+    tid, title, user, contents, reply_num, last_time = data["thread"]
+    thread = CachedThread(tid, title, _load_user(user), _load_contents(contents), reply_num, last_time)
+    posts = [CachedPost(pid, floor, _load_user(u), _load_contents(c), rn) for pid, floor, u, c, rn in data["posts"]]
+    comments = {int(pid): [CachedComment(cpid, _load_user(u), _load_contents(c)) for cpid, u, c in comment_list] for pid, comment_list in data["comments"].items()}
+    return thread, CachedPosts(thread, posts, CachedPage(*data["page"])), comments
+
+class ThreadPageCache(SqliteStore):
+    # 以 (tid, page_num) 为键缓存帖子页面及其楼中楼；超过 TTL 的条目视为失效，总体积超限时按最近访问时间淘汰
+    SCHEMA = """
+    CREATE TABLE IF NOT EXISTS thread_pages (
+        tid INTEGER NOT NULL,
+        page_num INTEGER NOT NULL,
+        payload BLOB NOT NULL,
+        size INTEGER NOT NULL,
+        expires_at REAL NOT NULL,
+        accessed_at REAL NOT NULL,
+        PRIMARY KEY (tid, page_num)
+    );
+    """
+
+    def __init__(self, path: str, ttl_seconds: float = 3600, max_bytes: int = 200 * 1024 * 1024, tail_ttl_seconds: float = 120):
+        super().__init__(path)
+        self.ttl_seconds = ttl_seconds
+        self.tail_ttl_seconds = tail_ttl_seconds
+        self.max_bytes = max_bytes
+
+    def get(self, tid: int, page_num: int) -> typing.Optional[tuple[CachedThread, CachedPosts, dict[int, list[CachedComment]]]]:
+        now = time.time()
+        rows = self._execute("SELECT payload, expires_at FROM thread_pages WHERE tid = ? AND page_num = ?", (tid, page_num))
+        if not rows:
+            return None
+        payload, expires_at = rows[0]
+        if expires_at < now:
+            self._execute("DELETE FROM thread_pages WHERE tid = ? AND page_num = ?", (tid, page_num))
+            return None
+        self._execute("UPDATE thread_pages SET accessed_at = ? WHERE tid = ? AND page_num = ?", (now, tid, page_num))
+        return load_thread_page(_unpack(payload))
+
+    def put(self, tid: int, page_num: int, posts_obj, comments: dict):
+        if not posts_obj or not posts_obj.objs:
+            return
+        payload = _pack(dump_thread_page(posts_obj, comments))
+        now = time.time()
+        # 最后一页仍在增长；首页携带总页数等帖子元数据，调用方据此决定获取范围。两者都只短期缓存
+        ttl = self.tail_ttl_seconds if page_num == 1 or page_num >= posts_obj.page.total_page else self.ttl_seconds
+        self._execute("INSERT OR REPLACE INTO thread_pages (tid, page_num, payload, size, expires_at, accessed_at) VALUES (?, ?, ?, ?, ?, ?)", (tid, page_num, payload, len(payload), now + ttl, now))
+        self._execute("DELETE FROM thread_pages WHERE expires_at < ?", (now,))
+        self._evict_to_size("thread_pages", self.max_bytes)
+
+    def invalidate(self, tid: int, page_num: typing.Optional[int] = None):
+        if page_num is None:
+            self._execute("DELETE FROM thread_pages WHERE tid = ?", (tid,))
+        else:
+            self._execute("DELETE FROM thread_pages WHERE tid = ? AND page_num = ?", (tid, page_num))
+
+    def clear(self):
+        self._execute("DELETE FROM thread_pages")
+
+class ChunkSummaryStore(SqliteStore):
+    # 持久化最近一次分析的各分块摘要（按块序号排列），plan_hash 包含分析 Prompt 指纹与分块预算；fingerprint 为该块格式化文本的哈希
+    # 每个分块完成即写入，同时记录所属分析任务的进度，中断后再次分析同一帖子时从这些检查点继续
+    MIGRATIONS = (
+        # 1: 按页码范围存储的旧表被按块序号存储的 analysis_chunks 取代
+        "DROP TABLE IF EXISTS chunk_summaries",
+        # 2: 记录任务开始时间，用于区分本次任务写入的分块
+        "ALTER TABLE analysis_jobs ADD COLUMN started_at REAL NOT NULL DEFAULT 0",
+        # 3: 记录发起分析时帖子的回复标记，继续分析时以此作为结果缓存的键
+        "ALTER TABLE analysis_jobs ADD COLUMN reply_marker TEXT NOT NULL DEFAULT ''",
+    )
+    SCHEMA = """
+    CREATE TABLE IF NOT EXISTS analysis_chunks (
+        tid INTEGER NOT NULL,
+        model TEXT NOT NULL,
+        plan_hash TEXT NOT NULL,
+        chunk_index INTEGER NOT NULL,
+        page_start INTEGER NOT NULL,
+        page_end INTEGER NOT NULL,
+        starts_at_page_start INTEGER NOT NULL,
+        ends_at_page_end INTEGER NOT NULL,
+        complete INTEGER NOT NULL,
+        fingerprint TEXT NOT NULL,
+        summary TEXT NOT NULL,
+        size INTEGER NOT NULL,
+        accessed_at REAL NOT NULL,
+        PRIMARY KEY (tid, model, plan_hash, chunk_index)
+    );
+    CREATE INDEX IF NOT EXISTS analysis_chunks_fingerprint ON analysis_chunks (tid, model, plan_hash, fingerprint);
+    CREATE TABLE IF NOT EXISTS analysis_jobs (
+        tid INTEGER NOT NULL,
+        model TEXT NOT NULL,
+        plan_hash TEXT NOT NULL,
+        title TEXT NOT NULL,
+        total_pages INTEGER NOT NULL,
+        status TEXT NOT NULL,
+        chunks_done INTEGER NOT NULL,
+        last_page INTEGER NOT NULL,
+        error TEXT,
+        updated_at REAL NOT NULL,
+        PRIMARY KEY (tid, model, plan_hash)
+    );
+    """
+    COLUMNS = ("chunk_index", "page_start", "page_end", "starts_at_page_start", "ends_at_page_end", "complete", "fingerprint", "summary")
+    # 分析任务只保留未完成的记录：进行中 (running，进程退出后仍为此状态) 或因错误中断 (interrupted)；成功完成后删除
+    JOB_COLUMNS = ("tid", "model", "plan_hash", "title", "total_pages", "status", "chunks_done", "last_page", "error", "updated_at", "reply_marker")
+
+    def __init__(self, path: str, max_bytes: int = 50 * 1024 * 1024):
+        super().__init__(path)
+        self.max_bytes = max_bytes
+
+    def _row_to_chunk(self, row: tuple) -> dict:
+        chunk = dict(zip(self.COLUMNS, row))
+        for flag in ("starts_at_page_start", "ends_at_page_end", "complete"):
+            chunk[flag] = bool(chunk[flag])
+        return chunk
+
+    def find_by_fingerprint(self, tid: int, model: str, plan_hash: str, fingerprint: str) -> typing.Optional[dict]:
+        rows = self._execute(f"SELECT {', '.join(self.COLUMNS)} FROM analysis_chunks WHERE tid = ? AND model = ? AND plan_hash = ? AND fingerprint = ? LIMIT 1", (tid, model, plan_hash, fingerprint))
+        return self._row_to_chunk(rows[0]) if rows else None
+
+    def put(self, tid: int, model: str, plan_hash: str, chunk: dict):
+        values = tuple(int(chunk[c]) if isinstance(chunk[c], bool) else chunk[c] for c in self.COLUMNS)
+        now = time.time()
+        with self._lock:
+            # 本次任务已写入过的分块序号（如恢复阶段重新写入）不重复计入进度；写入时间早于任务开始的是上次分析留下的分块
+            written = self._conn.execute("SELECT 1 FROM analysis_chunks AS c JOIN analysis_jobs AS j USING (tid, model, plan_hash) WHERE c.tid = ? AND c.model = ? AND c.plan_hash = ? AND c.chunk_index = ? AND c.accessed_at >= j.started_at",
+                                         (tid, model, plan_hash, chunk["chunk_index"])).fetchone()
+            self._conn.execute(f"INSERT OR REPLACE INTO analysis_chunks (tid, model, plan_hash, {', '.join(self.COLUMNS)}, size, accessed_at) VALUES (?, ?, ?, {', '.join('?' * len(self.COLUMNS))}, ?, ?)", (tid, model, plan_hash, *values, len(chunk["summary"].encode("utf-8")), now))
+            self._conn.execute("UPDATE analysis_jobs SET chunks_done = chunks_done + ?, last_page = MAX(last_page, ?), updated_at = ? WHERE tid = ? AND model = ? AND plan_hash = ?", (0 if written else 1, chunk["page_end"], now, tid, model, plan_hash))
+        self._evict_to_size("analysis_chunks", self.max_bytes)
+
+    def prune(self, tid: int, model: str, plan_hash: str, chunk_count: int):
+        self._execute("DELETE FROM analysis_chunks WHERE tid = ? AND model = ? AND plan_hash = ? AND chunk_index > ?", (tid, model, plan_hash, chunk_count))
+
+    def invalidate(self, tid: int):
+        self._execute("DELETE FROM analysis_chunks WHERE tid = ?", (tid,))
+        self._execute("DELETE FROM analysis_jobs WHERE tid = ?", (tid,))
+
+    def start_job(self, tid: int, model: str, plan_hash: str, title: str, total_pages: int, chunks_done: int, last_page: int, reply_marker: str = ""):
+        now = time.time()
+        self._execute("INSERT OR REPLACE INTO analysis_jobs (tid, model, plan_hash, title, total_pages, status, chunks_done, last_page, error, updated_at, started_at, reply_marker) VALUES (?, ?, ?, ?, ?, 'running', ?, ?, NULL, ?, ?, ?)",
+                      (tid, model, plan_hash, title, total_pages, chunks_done, last_page, now, now, reply_marker))
+
+    def finish_job(self, tid: int, model: str, plan_hash: str, error: typing.Optional[str] = None):
+        if error is None:
+            self._execute("DELETE FROM analysis_jobs WHERE tid = ? AND model = ? AND plan_hash = ?", (tid, model, plan_hash))
+        else:
+            self._execute("UPDATE analysis_jobs SET status = 'interrupted', error = ?, updated_at = ? WHERE tid = ? AND model = ? AND plan_hash = ?", (error, time.time(), tid, model, plan_hash))
+
+    def get_job(self, tid: int, model: str, plan_hash: str) -> typing.Optional[dict]:
+        rows = self._execute(f"SELECT {', '.join(self.JOB_COLUMNS)} FROM analysis_jobs WHERE tid = ? AND model = ? AND plan_hash = ?", (tid, model, plan_hash))
+        return dict(zip(self.JOB_COLUMNS, rows[0])) if rows else None
+
+    def unfinished_jobs(self, limit: int = 50) -> list[dict]:
+        rows = self._execute(f"SELECT {', '.join(self.JOB_COLUMNS)} FROM analysis_jobs ORDER BY updated_at DESC LIMIT ?", (limit,))
+        return [dict(zip(self.JOB_COLUMNS, row)) for row in rows]
+
+    def discard_job(self, tid: int, model: str, plan_hash: str):
+        self._execute("DELETE FROM analysis_jobs WHERE tid = ? AND model = ? AND plan_hash = ?", (tid, model, plan_hash))
+        self._execute("DELETE FROM analysis_chunks WHERE tid = ? AND model = ? AND plan_hash = ?", (tid, model, plan_hash))
+
+class AnalysisResultStore(SqliteStore):
+    # 最终分析结果存储：键包含帖子最后回复标记、分析模型与 Prompt 指纹，帖子更新或 Prompt 修改后旧结果自然失效；按最近访问时间保留 max_entries 条
+    SCHEMA = """
+    CREATE TABLE IF NOT EXISTS analysis_results (
+        tid INTEGER NOT NULL,
+        marker TEXT NOT NULL,
+        model TEXT NOT NULL,
+        prompt_hash TEXT NOT NULL,
+        result TEXT NOT NULL,
+        accessed_at REAL NOT NULL,
+        PRIMARY KEY (tid, marker, model, prompt_hash)
+    );
+    """
+
+    def __init__(self, path: str, max_entries: int = 500):
+        super().__init__(path)
+        self.max_entries = max_entries
+
+    def get(self, tid: int, marker: str, model: str, prompt_hash: str) -> typing.Optional[dict]:
+        key = (tid, marker, model, prompt_hash)
+        rows = self._execute("SELECT result FROM analysis_results WHERE tid = ? AND marker = ? AND model = ? AND prompt_hash = ?", key)
+        if not rows:
+            return None
+        self._execute("UPDATE analysis_results SET accessed_at = ? WHERE tid = ? AND marker = ? AND model = ? AND prompt_hash = ?", (time.time(), *key))
+        return json.loads(rows[0][0])
+
+    def put(self, tid: int, marker: str, model: str, prompt_hash: str, result: dict):
+        # 同一帖子同一模型与 Prompt 只保留最新标记下的结果
+        self._execute("DELETE FROM analysis_results WHERE tid = ? AND model = ? AND prompt_hash = ? AND marker != ?", (tid, model, prompt_hash, marker))
+        self._execute("INSERT OR REPLACE INTO analysis_results (tid, marker, model, prompt_hash, result, accessed_at) VALUES (?, ?, ?, ?, ?, ?)", (tid, marker, model, prompt_hash, json.dumps(result, ensure_ascii=False), time.time()))
+        self._execute("DELETE FROM analysis_results WHERE rowid NOT IN (SELECT rowid FROM analysis_results ORDER BY accessed_at DESC LIMIT ?)", (self.max_entries,))
+
+    def invalidate(self, tid: int):
+        self._execute("DELETE FROM analysis_results WHERE tid = ?", (tid,))
+
+class ResponseCache(SqliteStore):
+    # Gemini 响应缓存：以 (模型, 生成配置, Prompt) 的哈希为键保存响应文本，总体积超限时按最近访问时间淘汰
+    SCHEMA = """
+    CREATE TABLE IF NOT EXISTS llm_responses (
+        key TEXT PRIMARY KEY,
+        model TEXT NOT NULL,
+        payload BLOB NOT NULL,
+        size INTEGER NOT NULL,
+        created_at REAL NOT NULL,
+        accessed_at REAL NOT NULL
+    );
+    """
+
+    def __init__(self, path: str, max_bytes: int = 100 * 1024 * 1024):
+        super().__init__(path)
+        self.max_bytes = max_bytes
+
+    def get(self, key: str) -> typing.Optional[str]:
+        rows = self._execute("SELECT payload FROM llm_responses WHERE key = ?", (key,))
+        if not rows:
+            return None
+        self._execute("UPDATE llm_responses SET accessed_at = ? WHERE key = ?", (time.time(), key))
+        return _unpack(rows[0][0])
+
+    def put(self, key: str, model: str, text: str):
+        payload = _pack(text)
+        now = time.time()
+        self._execute("INSERT OR REPLACE INTO llm_responses (key, model, payload, size, created_at, accessed_at) VALUES (?, ?, ?, ?, ?, ?)", (key, model, payload, len(payload), now, now))
+        self._evict_to_size("llm_responses", self.max_bytes)
+
+    def clear(self):
+        self._execute("DELETE FROM llm_responses")
@@ -1,8 +1,12 @@
 import asyncio
+import collections
+import contextlib
+import hashlib
 import os
 import re
 import json
 import sys
+import time
 import typing
 import shutil
 import aiotieba as tb
@@ -11,9 +15,20 @@ from aiotieba import ThreadSortType
 from aiotieba import typing as tb_typing
 from google import genai
 from google.genai import types
+from cache_store import AnalysisResultStore, ChunkSummaryStore, ResponseCache, ThreadPageCache
+from perf_metrics import PERF
+from resilience import ResilientBackend
 
 VERSION = "1.5.6"
 POSTS_PER_PAGE = 30
+DEFAULT_FETCH_CONCURRENCY = 6
+DEFAULT_ANALYSIS_CONCURRENCY = 3
+DEFAULT_COMMENT_CONCURRENCY = 8
+EMBEDDED_COMMENTS_PER_POST = 4
+DEFAULT_REDUCE_FAN_IN = 8
+DEFAULT_CHUNK_CHAR_BUDGET = 30000
+DEFAULT_REDUCE_MAX_DEPTH = 3
+DEFAULT_REPLY_FANOUT_CONCURRENCY = 3
 DEFAULT_PROMPTS_FILENAME = "prompts.default.json"
 README_FILE = "README.md"
 CODE_URL = "https://github.com/LaplaceDemon29/TiebaGPT"
@@ -23,11 +38,15 @@ PLATFORM = os.getenv("FLET_PLATFORM") or "windows"
 SETTINGS_FILE = os.path.join(APP_DATA_PATH, "settings.json")
 PROMPTS_FILE = os.path.join(APP_DATA_PATH, "prompts.json")
 DEFAULT_PROMPTS_FILE = os.path.join(APP_DATA_PATH, DEFAULT_PROMPTS_FILENAME)
+PAGE_CACHE_FILE = os.path.join(APP_DATA_PATH, "thread_cache.sqlite3")
+ANALYSIS_STORE_FILE = os.path.join(APP_DATA_PATH, "analysis_store.sqlite3")
+LOG_FILE = os.path.join(APP_DATA_PATH, "tiebagpt.log.jsonl")
+RESPONSE_CACHE_FILE = os.path.join(APP_DATA_PATH, "response_cache.sqlite3")
 README_URL = RAW_URL + README_FILE
 DEFAULT_PROMPTS_URL = RAW_URL + DEFAULT_PROMPTS_FILENAME
 
 def load_settings() -> dict:
-    default_settings = {"api_key": "","analyzer_model": "gemini-1.5-flash-latest","generator_model": "gemini-1.5-flash-latest","available_models": [],"color_scheme_seed": "blue","pages_per_api_call": 4}
+    default_settings = {"api_key": "","analyzer_model": "gemini-1.5-flash-latest","generator_model": "gemini-1.5-flash-latest","available_models": [],"color_scheme_seed": "blue","chunk_char_budget": DEFAULT_CHUNK_CHAR_BUDGET,"fetch_concurrency": DEFAULT_FETCH_CONCURRENCY,"analysis_concurrency": DEFAULT_ANALYSIS_CONCURRENCY,"comment_concurrency": DEFAULT_COMMENT_CONCURRENCY,"reduce_fan_in": DEFAULT_REDUCE_FAN_IN,"reduce_max_depth": DEFAULT_REDUCE_MAX_DEPTH,"reply_fanout_concurrency": DEFAULT_REPLY_FANOUT_CONCURRENCY,"page_cache_ttl_seconds": 3600,"page_cache_max_mb": 200,"response_cache_enabled": False,"response_cache_max_mb": 100,"log_to_file": False}
     try:
         with open(SETTINGS_FILE, 'r', encoding='utf-8') as f:
             user_settings = json.load(f)
@@ -134,13 +153,20 @@ def merge_default_prompts(prefer_user: bool = False) -> tuple[bool, str]:
 
     return True, message
 
+def prompts_fingerprint(*sections: str) -> str:
+    payload = json.dumps([PROMPTS.get(section) for section in sections], sort_keys=True, ensure_ascii=False)
+    return hashlib.sha1(payload.encode("utf-8")).hexdigest()
+
+def text_fingerprint(text: str) -> str:
+    return hashlib.sha1(text.encode("utf-8")).hexdigest()
+
 def build_stance_analyzer_prompt(discussion_text: str) -> str:
     prompt_config = PROMPTS['stance_analyzer']
     tasks_text = "\n".join([f"- {task}" for task in prompt_config['tasks']])
     prompt_parts = [
         prompt_config['system_prompt'],
         "\n[分析任务]\n" + tasks_text,
-        f"\n[帖子和讨论的结构化文本]\n{discussion_text[:30000]}",
+        f"\n[帖子和讨论的结构化文本]\n{discussion_text}",
         f"\n[输出要求]\n{prompt_config['output_format_instruction']}"
     ]
     return "\n".join(prompt_parts)
@@ -160,7 +186,20 @@ def build_analysis_summarizer_prompt(chunk_summaries: list[dict]) -> str:
     ]
     return "\n".join(prompt_parts)
 
-def build_reply_generator_prompt(discussion_text: str, analysis_summary: str, mode_id: str, custom_input: typing.Optional[str] = None) -> str:
+def _reply_rules_text() -> str:
+    rules_config = PROMPTS['reply_generator']['common_rules']
+    return rules_config['title'] + "\n" + "\n".join([f"- {rule}" for rule in rules_config['rules']])
+
+def build_reply_context(discussion_text: str, analysis_summary: str, include_rules: bool) -> str:
+    # 同一帖子各回复模式共用的上下文，用于注册显式上下文缓存
+    parts = [f"[讨论状况摘要]\n{analysis_summary}", f"[讨论背景原文]\n{discussion_text[:15000]}"]
+    if include_rules:
+        parts.append(_reply_rules_text())
+    return "\n---\n".join(parts)
+
+CACHED_CONTEXT_NOTE = "（见前文已提供的内容）"
+
+def build_reply_generator_prompt(discussion_text: str, analysis_summary: str, mode_id: str, custom_input: typing.Optional[str] = None, context_cached: bool = False) -> str:
     gen_config = PROMPTS['reply_generator']
     mode_config = gen_config['modes'].get(mode_id)
     if not mode_config:
@@ -175,9 +214,16 @@ def build_reply_generator_prompt(discussion_text: str, analysis_summary: str, mo
             raise ValueError(f"使用模式 '{mode_name}' 时，必须提供自定义输入。")
         task_description = task_description.format(user_custom_input=custom_input)
 
-    rules_config = gen_config['common_rules']
-    rules_text = rules_config['title'] + "\n" + "\n".join([f"- {rule}" for rule in rules_config['rules']])
-    
+    if context_cached:
+        return f"""{role_prompt}
+
+[你的任务]
+{task_description}
+
+---
+[讨论状况摘要]、[讨论背景原文]与回复规则{CACHED_CONTEXT_NOTE}
+""".strip()
+
     return f"""{role_prompt}
 
 [你的任务]
@@ -190,10 +236,10 @@ def build_reply_generator_prompt(discussion_text: str, analysis_summary: str, mo
 [讨论背景原文]
 {discussion_text[:15000]}
 ---
-{rules_text}
+{_reply_rules_text()}
 """.strip()
 
-def build_reply_optimizer_prompt(discussion_text: str, analysis_summary: str, mode_id: str, reply_draft: str, custom_input: typing.Optional[str] = None) -> str:
+def build_reply_optimizer_prompt(discussion_text: str, analysis_summary: str, mode_id: str, reply_draft: str, custom_input: typing.Optional[str] = None, context_cached: bool = False) -> str:
     optimizer_template = PROMPTS.get('reply_optimizer', {}).get('system_prompt')
     if not optimizer_template:
         raise ValueError("未找到 'reply_optimizer' 的 prompt 模板配置。")
@@ -213,8 +259,8 @@ def build_reply_optimizer_prompt(discussion_text: str, analysis_summary: str, mo
     return optimizer_template.format(
         role_prompt=role_prompt,
         task_prompt=task_prompt,
-        discussion_text=discussion_text[:15000],
-        analysis_summary=analysis_summary,
+        discussion_text=CACHED_CONTEXT_NOTE if context_cached else discussion_text[:15000],
+        analysis_summary=CACHED_CONTEXT_NOTE if context_cached else analysis_summary,
         reply_draft=reply_draft
     )
 
@@ -238,15 +284,163 @@ def build_mode_optimizer_prompt(mode_name: str, mode_description: str, existing_
         existing_task=existing_task
     )
 
+def _gemini_usage(response) -> dict:
+    usage = getattr(response, 'usage_metadata', None)
+    if not usage:
+        return {}
+    fields = {"prompt_tokens": "prompt_token_count", "response_tokens": "candidates_token_count", "total_tokens": "total_token_count", "cached_tokens": "cached_content_token_count"}
+    return {name: getattr(usage, attr) for name, attr in fields.items() if isinstance(getattr(usage, attr, None), int)}
+
+RESPONSE_CACHE: typing.Optional[ResponseCache] = None
+# 每个后端共用一组重试策略与熔断器：持续故障时所有调用方一起暂停，而不是各自反复重试
+TIEBA_GUARD = ResilientBackend("tieba")
+GEMINI_GUARD = ResilientBackend("gemini")
+
+def _tieba_error(result) -> typing.Optional[BaseException]:
+    # aiotieba 不抛出异常，而是在返回对象的 err 属性上记录错误
+    return getattr(result, 'err', None)
+
+class CachedResponse:
+    # 缓存命中时代替 SDK 响应对象，只提供调用方用到的字段
+    def __init__(self, text: str):
+        self.text = text
+        self.prompt_feedback = None
+        self.usage_metadata = None
+
+def response_cache_key(model_name: str, config: dict, prompt: str) -> str:
+    return hashlib.sha256(json.dumps([model_name, config, prompt], ensure_ascii=False, sort_keys=True).encode("utf-8")).hexdigest()
+
+async def _timed_generate_content(client: genai.Client, stage: str, model_name: str, contents: list, config: dict, prompt_chars: int, cache_prompt: typing.Optional[str] = None, log_callback: typing.Optional[typing.Callable] = None):
+    # 提供 cache_prompt 且已启用响应缓存时，相同模型、配置与 Prompt 的请求直接返回缓存的文本
+    cache = RESPONSE_CACHE if cache_prompt is not None else None
+    if cache is not None:
+        cache_key = response_cache_key(model_name, config, cache_prompt)
+        with PERF.span("cache.response_get", caller=stage) as span:
+            text = await asyncio.to_thread(cache.get, cache_key)
+            span["hits"] = int(text is not None)
+        if text is not None:
+            return CachedResponse(text)
+
+    async def _call():
+        with PERF.span(stage, model=model_name, prompt_chars=prompt_chars) as span:
+            response = await client.aio.models.generate_content(model=model_name, contents=contents, config=config)
+            span["response_chars"] = len(getattr(response, 'text', None) or "")
+            span.update(_gemini_usage(response))
+        return response
+
+    response = await GEMINI_GUARD.run(_call, log_callback, description="Gemini 调用")
+    if cache is not None and getattr(response, 'text', None):
+        await asyncio.to_thread(cache.put, cache_key, model_name, response.text)
+    return response
+
+async def _timed_stream(client: genai.Client, stage: str, model_name: str, contents: list, config: dict, prompt_chars: int, log_callback: typing.Optional[typing.Callable] = None) -> typing.AsyncGenerator[str, None]:
+    # 流式调用记录首字延迟、片段数与用量（用量通常随最后一个片段返回）；调用方关闭生成器或取消任务时底层请求随之中止
+    # 只有建立流的请求会重试，已输出片段后中断的流直接报错，避免重复输出
+    started = time.perf_counter()
+    attrs = {"model": model_name, "prompt_chars": prompt_chars, "chunks": 0, "response_chars": 0}
+    stream = None
+    try:
+        stream = await GEMINI_GUARD.run(lambda: client.aio.models.generate_content_stream(model=model_name, contents=contents, config=config), log_callback, description="Gemini 流式调用")
+        async for chunk in stream:
+            attrs.update(_gemini_usage(chunk))
+            text = getattr(chunk, 'text', None)
+            if text:
+                if "ttft_seconds" not in attrs:
+                    attrs["ttft_seconds"] = time.perf_counter() - started
+                attrs["chunks"] += 1
+                attrs["response_chars"] += len(text)
+                yield text
+    except (GeneratorExit, asyncio.CancelledError):
+        attrs["cancelled"] = 1
+        raise
+    except BaseException as e:
+        attrs["error"] = type(e).__name__
+        raise
+    finally:
+        PERF.record(stage, time.perf_counter() - started, **attrs)
+        # 立即关闭 SDK 的流以释放底层 HTTP 连接，而不是等待垃圾回收
+        if stream is not None and hasattr(stream, 'aclose'):
+            await stream.aclose()
+
+class GeminiContextCache:
+    # 显式上下文缓存：同一模型下相同的共享上下文只注册一次，之后的请求只发送模式相关的部分。
+    # 过期时间在本地记录，临近过期时重新注册；上下文过短、模型不支持或注册失败时返回 None，调用方回退为完整 Prompt
+    def __init__(self, client: genai.Client, ttl_seconds: float = 900, refresh_margin_seconds: float = 60, min_chars: int = 2048, max_entries: int = 8):
+        self.client = client
+        self.ttl_seconds = ttl_seconds
+        self.refresh_margin_seconds = refresh_margin_seconds
+        self.min_chars = min_chars
+        self.max_entries = max_entries
+        self._entries: collections.OrderedDict[tuple[str, str], tuple[str, float]] = collections.OrderedDict()
+        self._pending: dict[tuple[str, str], asyncio.Task] = {}
+        self._unsupported_until: dict[str, float] = {}
+
+    async def acquire(self, model_name: str, context_text: str) -> typing.Optional[str]:
+        now = time.monotonic()
+        if len(context_text) < self.min_chars or self._unsupported_until.get(model_name, 0) > now:
+            return None
+        key = (model_name, hashlib.sha256(context_text.encode("utf-8")).hexdigest())
+        entry = self._entries.get(key)
+        if entry is not None and entry[1] - self.refresh_margin_seconds > now:
+            self._entries.move_to_end(key)
+            PERF.record("context_cache.acquire", 0.0, hits=1)
+            return entry[0]
+        task = self._pending.get(key)
+        if task is None:
+            task = self._pending[key] = asyncio.create_task(self._register(key, context_text))
+            task.add_done_callback(lambda _: self._pending.pop(key, None))
+        return await asyncio.shield(task)
+
+    async def _register(self, key: tuple[str, str], context_text: str) -> typing.Optional[str]:
+        model_name = key[0]
+        config = {"contents": [types.Content(role="user", parts=[types.Part.from_text(text=context_text)])], "ttl": f"{int(self.ttl_seconds)}s", "display_name": "tiebagpt-reply-context"}
+        try:
+            with PERF.span("gemini.context_cache_create", model=model_name, prompt_chars=len(context_text)):
+                cached = await self.client.aio.caches.create(model=model_name, config=config)
+        except Exception:
+            # 多为上下文低于模型的最小缓存长度或模型不支持，暂停一个 TTL 周期内对该模型的尝试
+            self._unsupported_until[model_name] = time.monotonic() + self.ttl_seconds
+            return None
+        stale = self._entries.pop(key, None)
+        self._entries[key] = (cached.name, time.monotonic() + self.ttl_seconds)
+        evicted = [stale[0]] if stale else []
+        while len(self._entries) > self.max_entries:
+            evicted.append(self._entries.popitem(last=False)[1][0])
+        for name in evicted:
+            asyncio.create_task(self._delete(name))
+        return cached.name
+
+    async def _delete(self, name: str):
+        try:
+            await self.client.aio.caches.delete(name=name)
+        except Exception:
+            pass
+
+    def invalidate(self, name: str):
+        for key, (entry_name, _) in list(self._entries.items()):
+            if entry_name == name:
+                del self._entries[key]
+
+    async def close(self):
+        names = [name for name, _ in self._entries.values()]
+        self._entries.clear()
+        await asyncio.gather(*[self._delete(name) for name in names])
+
+async def _reply_context_name(context_cache: typing.Optional[GeminiContextCache], model_name: str, discussion_text: str, analysis_summary: str, include_rules: bool, log_callback: typing.Callable) -> typing.Optional[str]:
+    if context_cache is None:
+        return None
+    name = await context_cache.acquire(model_name, build_reply_context(discussion_text, analysis_summary, include_rules))
+    if name:
+        log_callback("已复用讨论上下文缓存，本次仅发送模式相关内容。")
+    return name
+
 async def _call_gemini_for_json_mode(
     client: genai.Client, model_name: str, prompt: str, log_callback: typing.Callable
 ) -> typing.Tuple[bool, typing.Union[dict, str]]:
     generation_config = {"response_mime_type": "application/json"}
     contents = [types.Content(role="user", parts=[types.Part.from_text(text=prompt)])]
     try:
-        response = await asyncio.to_thread(
-            client.models.generate_content, model=model_name, contents=contents, config=generation_config
-        )
+        response = await _timed_generate_content(client, "gemini.json_mode", model_name, contents, generation_config, len(prompt), cache_prompt=prompt, log_callback=log_callback)
         if response.text:
             result = json.loads(response.text)
             if "role" in result and "task" in result:
@@ -295,56 +489,381 @@ async def optimize_mode_prompts(
 async def fetch_gemini_models(api_key: str) -> typing.Tuple[bool, typing.Union[list[str], str]]:
     if not api_key: return False, "API Key 不能为空。"
     try:
-        temp_client = genai.Client(api_key=api_key); model_list = await asyncio.to_thread(temp_client.models.list)
-        return True, sorted([m.name for m in model_list])
+        temp_client = genai.Client(api_key=api_key)
+        return True, sorted([m.name async for m in await temp_client.aio.models.list()])
     except Exception as e: return False, f"获取模型列表失败: {e}"
 
-async def fetch_threads_by_page(client: tb.Client, tieba_name: str, page_num: int, sort_type: ThreadSortType, log_callback: typing.Callable) -> list[tb_typing.Thread]:
+class TiebaClientManager:
+    # 在应用生命周期内持有一个 aiotieba 客户端，复用其连接池；连续失败时换用新客户端，
+    # 旧客户端在最后一个使用它的会话结束后才关闭，不会中断仍在进行的请求
+    def __init__(self, log_callback: typing.Optional[typing.Callable] = None, max_failures: int = 3, **client_kwargs):
+        self._log_callback = log_callback or (lambda message: None)
+        self._client_kwargs = client_kwargs
+        self._client: typing.Optional[tb.Client] = None
+        self._lock: typing.Optional[asyncio.Lock] = None
+        self._leases: dict[tb.Client, int] = {}
+        self._retired: set[tb.Client] = set()
+        self._consecutive_failures = 0
+        self.max_failures = max_failures
+
+    @property
+    def is_connected(self) -> bool:
+        return self._client is not None
+
+    def is_healthy(self) -> bool:
+        return self._client is not None and self._consecutive_failures < self.max_failures
+
+    def report_success(self, client: typing.Optional[tb.Client] = None):
+        if client is None or client is self._client:
+            self._consecutive_failures = 0
+
+    def report_failure(self, client: typing.Optional[tb.Client] = None):
+        # 已被替换的旧客户端上的失败不计入当前客户端
+        if client is None or client is self._client:
+            self._consecutive_failures += 1
+
+    def report_result(self, client: tb.Client, result):
+        # 贴吧接口的失败多以返回值表示：结果为 None 或带有 err 时计为一次失败
+        if result is None or _tieba_error(result) is not None:
+            self.report_failure(client)
+        else:
+            self.report_success(client)
+        return result
+
+    async def get_client(self) -> tb.Client:
+        if self._lock is None:
+            self._lock = asyncio.Lock()
+        async with self._lock:
+            if self._client is not None and not self.is_healthy():
+                self._log_callback(f"贴吧客户端连续失败 {self._consecutive_failures} 次，正在重新连接...")
+                await self._retire_client()
+            if self._client is None:
+                client = tb.Client(**self._client_kwargs)
+                await client.__aenter__()
+                self._client = client
+                self._consecutive_failures = 0
+            return self._client
+
+    @contextlib.asynccontextmanager
+    async def session(self) -> typing.AsyncIterator[tb.Client]:
+        client = await self.get_client()
+        self._leases[client] = self._leases.get(client, 0) + 1
+        try:
+            yield client
+        except Exception:
+            self.report_failure(client)
+            raise
+        finally:
+            remaining = self._leases.get(client, 1) - 1
+            if remaining:
+                self._leases[client] = remaining
+            else:
+                self._leases.pop(client, None)
+                if client in self._retired:
+                    self._retired.discard(client)
+                    await self._close(client)
+
+    async def reconnect(self) -> tb.Client:
+        if self._lock is None:
+            self._lock = asyncio.Lock()
+        async with self._lock:
+            await self._retire_client()
+        return await self.get_client()
+
+    async def _retire_client(self):
+        client, self._client = self._client, None
+        if client is None:
+            return
+        if self._leases.get(client):
+            self._retired.add(client)
+        else:
+            await self._close(client)
+
+    async def _close(self, client: tb.Client):
+        try:
+            await client.__aexit__(None, None, None)
+        except Exception as e:
+            self._log_callback(f"关闭贴吧客户端时出错: {e}")
+
+    async def close(self):
+        # 应用退出时关闭所有客户端，包括仍被会话占用的旧客户端
+        clients = [self._client, *self._retired] if self._client is not None else list(self._retired)
+        self._client = None
+        self._retired.clear()
+        self._leases.clear()
+        for client in clients:
+            await self._close(client)
+
+async def fetch_threads_by_page(client: tb.Client, tieba_name: str, page_num: int, sort_type: ThreadSortType, log_callback: typing.Callable) -> typing.Optional[list[tb_typing.Thread]]:
     try:
         sort_map = {ThreadSortType.REPLY: "回复时间", ThreadSortType.CREATE: "发布时间", ThreadSortType.HOT: "热门"}
         log_callback(f"正在获取“{tieba_name}”吧第 {page_num} 页的帖子 (排序: {sort_map.get(sort_type, '默认')})...")
-        return await client.get_threads(tieba_name, pn=page_num, sort=sort_type)
-    except Exception as e: log_callback(f"获取第 {page_num} 页帖子失败: {e}"); return []
+        return await TIEBA_GUARD.run(lambda: client.get_threads(tieba_name, pn=page_num, sort=sort_type), log_callback, _tieba_error, "获取帖子列表")
+    except Exception as e: log_callback(f"获取第 {page_num} 页帖子失败: {e}"); return None
 
-async def search_threads_by_page(client: tb.Client, tieba_name: str, query: str, page_num: int, log_callback: typing.Callable) -> list[tb_typing.Thread]:
+async def search_threads_by_page(client: tb.Client, tieba_name: str, query: str, page_num: int, log_callback: typing.Callable) -> typing.Optional[list[tb_typing.Thread]]:
     try:
         log_callback(f"正在“{tieba_name}”吧中搜索关键词“{query}”的第 {page_num} 页...")
-        return await client.search_exact(tieba_name, query, pn=page_num, only_thread=True)
-    except Exception as e: log_callback(f"搜索关键词“{query}”失败: {e}"); return []
+        return await TIEBA_GUARD.run(lambda: client.search_exact(tieba_name, query, pn=page_num, only_thread=True), log_callback, _tieba_error, "搜索")
+    except Exception as e: log_callback(f"搜索关键词“{query}”失败: {e}"); return None
+
+def create_page_cache(settings: dict) -> ThreadPageCache:
+    return ThreadPageCache(PAGE_CACHE_FILE, ttl_seconds=settings.get("page_cache_ttl_seconds", 3600), max_bytes=int(settings.get("page_cache_max_mb", 200)) * 1024 * 1024)
+
+def create_chunk_store() -> ChunkSummaryStore:
+    return ChunkSummaryStore(ANALYSIS_STORE_FILE)
+
+def create_result_store() -> AnalysisResultStore:
+    return AnalysisResultStore(ANALYSIS_STORE_FILE)
+
+def create_response_cache(settings: dict) -> ResponseCache:
+    return ResponseCache(RESPONSE_CACHE_FILE, max_bytes=int(settings.get("response_cache_max_mb", 100)) * 1024 * 1024)
+
+def configure_response_cache(settings: dict, log_callback: typing.Callable):
+    # 按设置打开或关闭 Gemini 响应缓存（RESPONSE_CACHE 为 None 时所有调用直接请求 API）
+    global RESPONSE_CACHE
+    if not settings.get("response_cache_enabled"):
+        if RESPONSE_CACHE is not None:
+            RESPONSE_CACHE.close(); RESPONSE_CACHE = None
+        return
+    if RESPONSE_CACHE is None:
+        try:
+            RESPONSE_CACHE = create_response_cache(settings)
+        except Exception as e:
+            log_callback(f"无法打开AI响应缓存，将直接调用API: {e}")
+            return
+    RESPONSE_CACHE.max_bytes = int(settings.get("response_cache_max_mb", 100)) * 1024 * 1024
+
+def thread_reply_marker(thread) -> str:
+    return f"{getattr(thread, 'reply_num', 0)}:{getattr(thread, 'last_time', 0)}"
+
+def analysis_prompts_fingerprint() -> str:
+    return prompts_fingerprint('stance_analyzer', 'analysis_summarizer')
+
+def analysis_plan_hash(chunk_char_budget: int) -> str:
+    # 分块摘要与分析任务的复用条件：分析 Prompt 与分块预算都不变
+    return f"{prompts_fingerprint('stance_analyzer')}:{chunk_char_budget}"
+
+async def fetch_full_thread_data(client: tb.Client, tid: int, log_callback: typing.Callable, page_num: int = 1, page_cache: typing.Optional[ThreadPageCache] = None, comment_concurrency: int = DEFAULT_COMMENT_CONCURRENCY) -> tuple[typing.Optional[tb_typing.Thread], typing.Optional[tb_typing.Posts], dict[int, list[tb_typing.Comment]]]:
+    thread_obj, posts_obj, all_comments, _ = await _fetch_page_data(client, tid, log_callback, page_num, page_cache, comment_concurrency)
+    return thread_obj, posts_obj, all_comments
+
+async def _fetch_page_data(client: tb.Client, tid: int, log_callback: typing.Callable, page_num: int, page_cache: typing.Optional[ThreadPageCache], comment_concurrency: int) -> tuple[typing.Optional[tb_typing.Thread], typing.Optional[tb_typing.Posts], dict[int, list[tb_typing.Comment]], list[int]]:
+    # 额外返回楼中楼获取失败的楼层号，供调用方判断页面是否完整
+    if page_cache is not None:
+        with PERF.span("cache.page_get", page=page_num) as span:
+            cached = await asyncio.to_thread(page_cache.get, tid, page_num)
+            span["hits"] = int(bool(cached))
+        if cached:
+            log_callback(f"从本地缓存读取帖子 {tid} 第 {page_num} 页的数据。")
+            return (*cached, [])
 
-async def fetch_full_thread_data(client: tb.Client, tid: int, log_callback: typing.Callable, page_num: int = 1) -> tuple[typing.Optional[tb_typing.Thread], typing.Optional[tb_typing.Posts], dict[int, list[tb_typing.Comment]]]:
     log_callback(f"正在获取帖子 {tid} 第 {page_num} 页的数据...")
     
-    posts_obj: tb_typing.Posts = await client.get_posts(tid, pn=page_num, rn=POSTS_PER_PAGE)
-    
+    async def _get_posts():
+        with PERF.span("tieba.get_posts", page=page_num) as span:
+            # 随楼层返回的楼中楼默认按点赞数排序，这里改为按时间顺序，才能与 get_comments 的结果互换
+            posts_obj: tb_typing.Posts = await client.get_posts(tid, pn=page_num, rn=POSTS_PER_PAGE, with_comments=True, comment_rn=EMBEDDED_COMMENTS_PER_POST, comment_sort_by_agree=False)
+            span["floors"] = len(posts_obj.objs) if posts_obj else 0
+        return posts_obj
+
+    try:
+        posts_obj = await TIEBA_GUARD.run(_get_posts, log_callback, _tieba_error, f"获取帖子 {tid} 第 {page_num} 页")
+    except Exception as e:
+        log_callback(f"获取帖子 {tid} 第 {page_num} 页失败: {e}")
+        return None, None, {}, []
     if not posts_obj:
-        return None, None, {}
+        return None, None, {}, []
     
     thread_obj = posts_obj.thread
     all_comments: dict[int, list[tb_typing.Comment]] = {}
     
-    post_list = posts_obj.objs
-    
-    results = await asyncio.gather(*[client.get_comments(tid, post.pid) for post in post_list], return_exceptions=True)
-    for post, comments_or_exc in zip(post_list, results):
+    # 没有楼中楼的楼层不请求；随楼层一起返回的楼中楼已完整时直接复用，只为剩余楼层单独请求
+    posts_to_fetch = []
+    for post in posts_obj.objs:
+        reply_num = getattr(post, 'reply_num', None)
+        embedded_comments = list(getattr(post, 'comments', None) or [])
+        if reply_num == 0:
+            continue
+        if embedded_comments and reply_num is not None and len(embedded_comments) >= reply_num:
+            all_comments[post.pid] = embedded_comments
+        else:
+            posts_to_fetch.append(post)
+
+    with PERF.span("tieba.comments", page=page_num, requests=len(posts_to_fetch), embedded=len(all_comments)) as span:
+        failed_floors = await _fetch_post_comments(client, tid, page_num, posts_to_fetch, all_comments, comment_concurrency)
+        span["failed"] = len(failed_floors)
+    if failed_floors:
+        log_callback(f"警告：帖子 {tid} 第 {page_num} 页有 {len(failed_floors)} 个楼层的楼中楼获取失败: {', '.join(map(str, failed_floors))}楼")
+    else:
+        await _put_page_cache(page_cache, tid, page_num, posts_obj, all_comments, log_callback)
+    return thread_obj, posts_obj, all_comments, failed_floors
+
+async def _fetch_post_comments(client: tb.Client, tid: int, page_num: int, posts: list, all_comments: dict[int, list[tb_typing.Comment]], comment_concurrency: int) -> list[int]:
+    # 获取的楼中楼写入 all_comments，返回获取失败的楼层号
+    semaphore = asyncio.Semaphore(max(1, int(comment_concurrency)))
+
+    async def _get_comments(post):
+        with PERF.span("tieba.get_comments", page=page_num):
+            return await client.get_comments(tid, post.pid)
+
+    async def _fetch_comments(post):
+        async with semaphore:
+            return await TIEBA_GUARD.run(lambda: _get_comments(post), check_result=_tieba_error)
+
+    results = await asyncio.gather(*[_fetch_comments(post) for post in posts], return_exceptions=True)
+    failed_floors = []
+    for post, comments_or_exc in zip(posts, results):
         if isinstance(comments_or_exc, Exception):
-            pass
+            failed_floors.append(post.floor)
         elif comments_or_exc:
             all_comments[post.pid] = comments_or_exc
-            
-    return thread_obj, posts_obj, all_comments
+    return failed_floors
+
+async def _put_page_cache(page_cache: typing.Optional[ThreadPageCache], tid: int, page_num: int, posts_obj: tb_typing.Posts, all_comments: dict[int, list[tb_typing.Comment]], log_callback: typing.Callable):
+    # 只有楼中楼完整的页面才写入缓存
+    if page_cache is None:
+        return
+    try:
+        with PERF.span("cache.page_put", page=page_num):
+            await asyncio.to_thread(page_cache.put, tid, page_num, posts_obj, all_comments)
+    except Exception as e:
+        log_callback(f"写入页面缓存失败: {e}")
+
+async def refetch_failed_comments(client: tb.Client, tid: int, page_num: int, posts_obj: tb_typing.Posts, all_comments: dict[int, list[tb_typing.Comment]], failed_floors: list[int], log_callback: typing.Callable, page_cache: typing.Optional[ThreadPageCache] = None, comment_concurrency: int = DEFAULT_COMMENT_CONCURRENCY) -> list[int]:
+    # 只为上次失败的楼层重新获取楼中楼并补入 all_comments，返回仍然失败的楼层号；补全后写入页面缓存
+    floors = set(failed_floors)
+    posts = [post for post in posts_obj.objs if post.floor in floors]
+    log_callback(f"重新获取帖子 {tid} 第 {page_num} 页 {len(posts)} 个楼层的楼中楼...")
+    with PERF.span("tieba.comments", page=page_num, requests=len(posts), embedded=0) as span:
+        still_failed = await _fetch_post_comments(client, tid, page_num, posts, all_comments, comment_concurrency)
+        span["failed"] = len(still_failed)
+    if not still_failed:
+        await _put_page_cache(page_cache, tid, page_num, posts_obj, all_comments, log_callback)
+    return still_failed
+
+class _PageFlight:
+    __slots__ = ("task", "waiters")
+
+    def __init__(self, task: asyncio.Task):
+        self.task = task
+        self.waiters = 0
+
+class ThreadPageRepository:
+    # 帖子页面数据的统一入口：同一页面的并发请求只发起一次 (single-flight)，已完成的页面在内存中按 LRU 保留一段时间，
+    # 同时照常写入页面缓存；所有等待方都取消时才取消底层请求
+    def __init__(self, tieba_clients: TiebaClientManager, page_cache: typing.Optional[ThreadPageCache] = None, comment_concurrency: int = DEFAULT_COMMENT_CONCURRENCY, max_pages: int = 64, ttl_seconds: float = 600, tail_ttl_seconds: float = 120):
+        self.tieba_clients = tieba_clients
+        self.page_cache = page_cache
+        self.comment_concurrency = comment_concurrency
+        self.max_pages = max_pages
+        self.ttl_seconds = ttl_seconds
+        self.tail_ttl_seconds = tail_ttl_seconds
+        self._pages: collections.OrderedDict[tuple[int, int], tuple[float, tuple]] = collections.OrderedDict()
+        self._inflight: dict[tuple[int, int], _PageFlight] = {}
+
+    def peek(self, tid: int, page_num: int) -> typing.Optional[tuple]:
+        entry = self._pages.get((tid, page_num))
+        if entry is None:
+            return None
+        expires_at, result = entry
+        if expires_at < time.monotonic():
+            del self._pages[(tid, page_num)]
+            return None
+        self._pages.move_to_end((tid, page_num))
+        return result
+
+    async def get_page(self, tid: int, page_num: int, log_callback: typing.Callable) -> tuple[typing.Optional[tb_typing.Thread], typing.Optional[tb_typing.Posts], dict[int, list[tb_typing.Comment]], list[int]]:
+        # 第四项为楼中楼获取失败的楼层号，非空时页面不完整，可通过 retry_failed_comments 补全
+        key = (tid, page_num)
+        result = self.peek(tid, page_num)
+        if result is not None:
+            PERF.record("repository.page", 0.0, hits=1)
+            return result
+        flight = self._inflight.get(key)
+        if flight is None:
+            flight = self._inflight[key] = _PageFlight(asyncio.create_task(self._load(tid, page_num, log_callback)))
+            flight.task.add_done_callback(lambda task: self._on_loaded(key, task))
+        else:
+            PERF.record("repository.page", 0.0, joined=1)
+        flight.waiters += 1
+        try:
+            return await asyncio.shield(flight.task)
+        finally:
+            flight.waiters -= 1
+            if flight.waiters == 0 and not flight.task.done():
+                flight.task.cancel()
+
+    async def get_first_page(self, tid: int, log_callback: typing.Callable, known_thread=None) -> tuple[typing.Optional[tb_typing.Thread], typing.Optional[tb_typing.Posts], dict[int, list[tb_typing.Comment]], list[int]]:
+        # 首页决定总页数：调用方已知的帖子（如帖子列表中的对象）比缓存的首页回复更多时，说明缓存已过时，丢弃后重新获取
+        result = await self.get_page(tid, 1, log_callback)
+        cached_thread = result[0]
+        if cached_thread is not None and known_thread is not None and getattr(cached_thread, 'reply_num', 0) < getattr(known_thread, 'reply_num', 0):
+            log_callback(f"帖子 {tid} 已有新回复，重新获取首页。")
+            await self.invalidate(tid, 1)
+            result = await self.get_page(tid, 1, log_callback)
+        return result
+
+    async def invalidate(self, tid: int, page_num: int):
+        self._pages.pop((tid, page_num), None)
+        if self.page_cache is not None:
+            await asyncio.to_thread(self.page_cache.invalidate, tid, page_num)
+
+    async def retry_failed_comments(self, tid: int, page_num: int, posts_obj: tb_typing.Posts, all_comments: dict[int, list[tb_typing.Comment]], failed_floors: list[int], log_callback: typing.Callable) -> list[int]:
+        async with self.tieba_clients.session() as client:
+            still_failed = await refetch_failed_comments(client, tid, page_num, posts_obj, all_comments, failed_floors, log_callback, self.page_cache, self.comment_concurrency)
+        if not still_failed:
+            self._remember((tid, page_num), (posts_obj.thread, posts_obj, all_comments, []))
+        return still_failed
+
+    async def _load(self, tid: int, page_num: int, log_callback: typing.Callable) -> tuple:
+        async with self.tieba_clients.session() as client:
+            result = await _fetch_page_data(client, tid, log_callback, page_num, self.page_cache, self.comment_concurrency)
+            self.tieba_clients.report_result(client, result[1])
+            return result
+
+    def _on_loaded(self, key: tuple[int, int], task: asyncio.Task):
+        if self._inflight.get(key) is not None and self._inflight[key].task is task:
+            del self._inflight[key]
+        if task.cancelled() or task.exception() is not None:
+            return
+        result = task.result()
+        # 楼中楼不完整的页面不在内存中保留，下次请求时重新获取
+        if result[1] and not result[3]:
+            self._remember(key, result)
+
+    def _remember(self, key: tuple[int, int], result: tuple):
+        posts_obj = result[1]
+        # 与页面缓存一致：首页与最后一页只短期保留
+        is_short_lived = key[1] == 1 or key[1] >= getattr(posts_obj.page, 'total_page', key[1])
+        self._pages[key] = (time.monotonic() + (self.tail_ttl_seconds if is_short_lived else self.ttl_seconds), result)
+        self._pages.move_to_end(key)
+        while len(self._pages) > self.max_pages:
+            self._pages.popitem(last=False)
+
+# 片段格式化表：按类型名注册，首次遇到某个片段类时解析一次并按类对象缓存，未注册的类型忽略
+_FRAG_FORMATTERS_BY_NAME: dict[str, typing.Callable] = {
+    'FragText': lambda frag: frag.text,
+    'FragEmoji': lambda frag: f"[表情:{frag.desc}]",
+    'FragImage_p': lambda frag: "[图片]", 'FragImage_c': lambda frag: "[图片]", 'FragImage_t': lambda frag: "[图片]",
+    'FragAt': lambda frag: frag.text,
+    'FragLink': lambda frag: f"[链接:{frag.text}]",
+    'FragVoice_p': lambda frag: "[语音]", 'FragVoice_c': lambda frag: "[语音]",
+}
+_FRAG_FORMATTERS: dict[type, typing.Optional[typing.Callable]] = {}
 
 def format_contents(contents: tb_typing.contents) -> str:
     if not contents or not contents.objs: return ""
+    formatters = _FRAG_FORMATTERS
     parts = []
     for frag in contents.objs:
-        type_name = type(frag).__name__
-        if type_name == 'FragText': parts.append(frag.text)
-        elif type_name == 'FragEmoji': parts.append(f"[表情:{frag.desc}]")
-        elif type_name in ['FragImage_p', 'FragImage_c', 'FragImage_t']: parts.append("[图片]")
-        elif type_name == 'FragAt': parts.append(frag.text)
-        elif type_name == 'FragLink': parts.append(f"[链接:{frag.text}]")
-        elif type_name in ['FragVoice_p', 'FragVoice_c']: parts.append("[语音]")
+        frag_cls = type(frag)
+        try:
+            formatter = formatters[frag_cls]
+        except KeyError:
+            formatter = formatters[frag_cls] = _FRAG_FORMATTERS_BY_NAME.get(frag_cls.__name__)
+        if formatter is not None:
+            parts.append(formatter(frag))
     return " ".join(parts).strip()
 
 def _format_user_info(user, lz_user_name: str = "") -> str:
@@ -374,6 +893,37 @@ def _format_user_info(user, lz_user_name: str = "") -> str:
     
     return f"({', '.join(parts)})"
 
+class UserInfoMemo:
+    # 单个帖子内的用户信息字符串缓存：同一用户对象直接命中；跨页的不同对象按用户字段命中
+    def __init__(self, lz_user_name: str):
+        self.lz_user_name = lz_user_name
+        self._by_fields: dict[tuple, str] = {}
+
+    def formatter(self) -> typing.Callable:
+        # 按对象 id 的缓存只在一次格式化调用内有效，同时持有对象引用以保证 id 不被复用
+        by_object: dict[int, tuple] = {}
+        by_fields = self._by_fields
+        lz_user_name = self.lz_user_name
+
+        def _format(user) -> str:
+            entry = by_object.get(id(user))
+            if entry is not None:
+                return entry[1]
+            if not user:
+                return "(用户: 未知用户)"
+            try:
+                key = (getattr(user, 'user_name', '未知用户'), getattr(user, 'nick_name', '无昵称'), bool(getattr(user, 'is_bawu', False)), getattr(user, 'level', None), getattr(user, 'ip', None))
+                text = by_fields.get(key)
+            except TypeError:
+                key, text = None, None
+            if text is None:
+                text = _format_user_info(user, lz_user_name)
+                if key is not None:
+                    by_fields[key] = text
+            by_object[id(user)] = (user, text)
+            return text
+        return _format
+
 def format_main_post_text(thread: tb_typing.Thread) -> str:
     if not thread:
         return ""
@@ -382,43 +932,127 @@ def format_main_post_text(thread: tb_typing.Thread) -> str:
     content_text = format_contents(thread.contents)
     return f"[帖子标题]: {thread.title}\n[主楼] {lz_info_str}\n{content_text}"
 
-def format_discussion_text(thread: tb_typing.Thread, posts: list[tb_typing.Post], all_comments: dict[int, list[tb_typing.Comment]]) -> str:
-    formatted_list = []
-
-    lz_user_name = getattr(thread.user, 'user_name', '未知用户')
-    if posts:
-        formatted_list.append("---")
-        formatted_list.append("[讨论区]")
+def format_post_blocks(thread: tb_typing.Thread, posts: list[tb_typing.Post], all_comments: dict[int, list[tb_typing.Comment]], user_info_memo: typing.Optional[UserInfoMemo] = None) -> list[str]:
+    if user_info_memo is None:
+        user_info_memo = UserInfoMemo(getattr(thread.user, 'user_name', '未知用户'))
+    user_info = user_info_memo.formatter()
+    blocks = []
 
     for post in posts:
-        if post.floor == 1:
+        floor = post.floor
+        if floor == 1:
             continue
         
-        post_text = format_contents(post.contents).strip()
+        post_text = format_contents(post.contents)
         if not post_text:
             continue
-            
-        user_info_str = _format_user_info(post.user, lz_user_name)
-        formatted_list.append(f"\n[回复 {post.floor}楼] {user_info_str}")
-        formatted_list.append(post_text)
-        
-        if post.pid in all_comments:
-            for j, comment in enumerate(all_comments[post.pid]):
-                comment_text = format_contents(comment.contents).strip()
+
+        # 每个楼层块写入同一个缓冲列表，最后一次性拼接
+        buffer = ["\n[回复 ", str(floor), "楼] ", user_info(post.user), "\n", post_text]
+        comments = all_comments.get(post.pid)
+        if comments:
+            comment_prefix = f"\n  [楼中楼 to {floor}楼, #"
+            for j, comment in enumerate(comments, 1):
+                comment_text = format_contents(comment.contents)
                 if not comment_text:
                     continue
-                comment_user_info_str = _format_user_info(comment.user, lz_user_name)
-                formatted_list.append(f"  [楼中楼 to {post.floor}楼, #{j+1}] {comment_user_info_str}")
-                formatted_list.append(f"  > {comment_text}")
+                buffer += (comment_prefix, str(j), "] ", user_info(comment.user), "\n  > ", comment_text)
+        blocks.append("".join(buffer))
                 
-    return "\n".join(formatted_list)
+    return blocks
+
+DISCUSSION_HEADER = "---\n[讨论区]"
+
+def format_discussion_text(thread: tb_typing.Thread, posts: list[tb_typing.Post], all_comments: dict[int, list[tb_typing.Comment]]) -> str:
+    blocks = format_post_blocks(thread, posts, all_comments)
+    if posts:
+        blocks.insert(0, DISCUSSION_HEADER)
+    return "\n".join(blocks)
+
+def _split_oversized_block(block: str, capacity: int) -> list[str]:
+    pieces, current, current_len = [], [], 0
+    for line in block.split("\n"):
+        while len(line) > capacity:
+            if current:
+                pieces.append("\n".join(current)); current, current_len = [], 0
+            pieces.append(line[:capacity]); line = line[capacity:]
+        if current and current_len + len(line) + 1 > capacity:
+            pieces.append("\n".join(current)); current, current_len = [], 0
+        current.append(line); current_len += len(line) + 1
+    if current:
+        pieces.append("\n".join(current))
+    return pieces
+
+class ChunkPlanner:
+    # 按字符预算把逐页格式化的楼层块装箱成分析块：小页合并，超大页按楼层拆分，超大楼层按行拆分，保证不丢弃内容
+    def __init__(self, char_budget: int, fixed_overhead: int = 0):
+        self.capacity = max(1000, int(char_budget) - fixed_overhead)
+        self._blocks: list[str] = []
+        self._size = 0
+        self._page_start = 0
+        self._page_end = 0
+        self._starts_at_page_start = True
+        self._has_gap = False
+        # 下一个分块的起始位置：起始页，以及是否从该页开头开始
+        self._open_page: typing.Optional[int] = None
+        self._open_at_page_start = True
+
+    def _emit(self, ends_at_page_end: bool) -> typing.Optional[dict]:
+        if not self._blocks:
+            return None
+        chunk = {"page_start": self._page_start, "page_end": self._page_end, "blocks": self._blocks, "size": self._size,
+                 "starts_at_page_start": self._starts_at_page_start, "ends_at_page_end": ends_at_page_end, "has_gap": self._has_gap}
+        self._blocks, self._size, self._has_gap = [], 0, False
+        return chunk
+
+    def _open(self, page_num: int):
+        if self._open_page is None:
+            self._open_page, self._open_at_page_start = page_num, True
+
+    def add_page(self, page_num: int, blocks: list[str]) -> list[dict]:
+        ready = []
+        self._open(page_num)
+        # 优先在页边界切分：整页放不下时先结束当前块，只有单页本身超出预算时才在页内切分
+        page_size = sum(len(block) + 1 for block in blocks)
+        if self._blocks and self._size + page_size > self.capacity:
+            ready.append(self._emit(ends_at_page_end=True))
+            self._open_page, self._open_at_page_start = page_num, True
+        for block in blocks:
+            for piece in (_split_oversized_block(block, self.capacity) if len(block) > self.capacity else [block]):
+                if self._blocks and self._size + len(piece) + 1 > self.capacity:
+                    ready.append(self._emit(ends_at_page_end=False))
+                    self._open_page, self._open_at_page_start = page_num, False
+                if not self._blocks:
+                    self._page_start, self._starts_at_page_start = self._open_page, self._open_at_page_start
+                self._blocks.append(piece)
+                self._size += len(piece) + 1
+                self._page_end = page_num
+        if self._blocks:
+            self._page_end = page_num
+        return ready
+
+    def mark_gap(self, page_num: int):
+        # 页面获取失败：所在分块内容不完整，不能作为“完整块”在下次分析中复用
+        self._open(page_num)
+        self._has_gap = True
+        if self._blocks:
+            self._page_end = page_num
+
+    def flush(self) -> typing.Optional[dict]:
+        chunk = self._emit(ends_at_page_end=True)
+        self._open_page = None
+        return chunk
+
+def build_chunk_text(main_post_text: str, blocks: list[str]) -> str:
+    return "\n".join([main_post_text, DISCUSSION_HEADER, *blocks])
 
 async def _analyze_single_chunk(gemini_client: genai.Client, discussion_text: str, model_name: str, log_callback: typing.Callable) -> dict:
-    prompt = build_stance_analyzer_prompt(discussion_text)
+    with PERF.span("prompt.chunk"):
+        prompt = build_stance_analyzer_prompt(discussion_text)
     generation_config = {"response_mime_type": "text/plain"}
     contents = [types.Content(role="user", parts=[types.Part.from_text(text=prompt)])]
     try:
-        response = await asyncio.to_thread(gemini_client.models.generate_content, model=model_name, contents=contents, config=generation_config)
+        response = await _timed_generate_content(gemini_client, "gemini.chunk", model_name, contents, generation_config, len(prompt), cache_prompt=prompt, log_callback=log_callback)
         if response.text and response.text.strip():
             return {"summary": response.text.strip()}
         else:
@@ -429,12 +1063,13 @@ async def _analyze_single_chunk(gemini_client: genai.Client, discussion_text: st
 
 async def _summarize_analyses(gemini_client: genai.Client, chunk_summaries: list[dict], model_name: str, log_callback: typing.Callable) -> dict:
     log_callback(f"--- 使用模型 {model_name} 整合 {len(chunk_summaries)} 个摘要块 ---")
-    prompt = build_analysis_summarizer_prompt(chunk_summaries)
+    with PERF.span("prompt.summarize"):
+        prompt = build_analysis_summarizer_prompt(chunk_summaries)
     generation_config = {"response_mime_type": "text/plain"}
     contents = [types.Content(role="user", parts=[types.Part.from_text(text=prompt)])]
     try:
         log_callback("正在调用 Gemini API 进行最终整合...")
-        response = await asyncio.to_thread(gemini_client.models.generate_content, model=model_name, contents=contents, config=generation_config)
+        response = await _timed_generate_content(gemini_client, "gemini.summarize", model_name, contents, generation_config, len(prompt), cache_prompt=prompt, log_callback=log_callback)
         log_callback("Gemini API 整合调用成功。")
         if response.text and response.text.strip():
             return {"summary": response.text.strip()}
@@ -444,71 +1079,297 @@ async def _summarize_analyses(gemini_client: genai.Client, chunk_summaries: list
         log_callback(f"Gemini API 整合调用失败: {e}")
         return {"error": f"整合失败: {e}"}
 
-async def analyze_stance_by_page(tieba_client: tb.Client, gemini_client: genai.Client, tid: int, total_pages: int, model_name: str, log_callback: typing.Callable, progress_callback: typing.Callable, pages_per_call: int) -> dict:
-    log_callback(f"--- 开始对TID {tid} 进行分块分析，共 {total_pages} 页，每块 {pages_per_call} 页 ---")
-    chunk_results = []
+async def reduce_summaries_hierarchically(gemini_client: genai.Client, chunk_summaries: list[str], model_name: str, log_callback: typing.Callable, fan_in: int = DEFAULT_REDUCE_FAN_IN, max_depth: int = DEFAULT_REDUCE_MAX_DEPTH, max_concurrency: int = DEFAULT_ANALYSIS_CONCURRENCY) -> dict:
+    # 树状归约：摘要数超过 fan_in 时按 fan_in 分批并行整合，逐层收敛，最多 max_depth 层后做最终整合
+    fan_in = max(2, int(fan_in))
+    semaphore = asyncio.Semaphore(max(1, int(max_concurrency)))
+    summaries = list(chunk_summaries)
+    depth = 0
+
+    async def _reduce_batch(batch: list[str]) -> list[str]:
+        if len(batch) == 1:
+            return batch
+        async with semaphore:
+            result = await _summarize_analyses(gemini_client, batch, model_name, log_callback)
+        if "summary" in result:
+            return [result["summary"]]
+        # 该批整合失败时原样带入下一层，避免丢失内容
+        return batch
+
+    while len(summaries) > fan_in and depth < max_depth:
+        depth += 1
+        batches = [summaries[i:i + fan_in] for i in range(0, len(summaries), fan_in)]
+        log_callback(f"--- 第 {depth} 层整合: {len(summaries)} 个摘要分为 {len(batches)} 批 ---")
+        reduced = [summary for batch_result in await asyncio.gather(*[_reduce_batch(batch) for batch in batches]) for summary in batch_result]
+        if len(reduced) >= len(summaries):
+            log_callback(f"警告：第 {depth} 层整合未能减少摘要数量，直接进行最终整合。")
+            break
+        summaries = reduced
+
+    if len(summaries) == 1:
+        return {"summary": summaries[0]}
+    return await _summarize_analyses(gemini_client, summaries, model_name, log_callback)
+
+async def iter_thread_pages(client: tb.Client, tid: int, page_nums: typing.Iterable[int], log_callback: typing.Callable, max_concurrency: int = DEFAULT_FETCH_CONCURRENCY, page_cache: typing.Optional[ThreadPageCache] = None, comment_concurrency: int = DEFAULT_COMMENT_CONCURRENCY, repository: typing.Optional[ThreadPageRepository] = None) -> typing.AsyncGenerator[tuple[int, typing.Optional[tb_typing.Posts], dict[int, list[tb_typing.Comment]], list[int]], None]:
+    # 按页码顺序产出 (page_num, posts_obj, comments, failed_floors)；获取失败的页面产出 (page_num, None, {}, [])，不会中断迭代；
+    # failed_floors 为楼中楼获取失败的楼层号
+    # 提供 repository 时经由其获取页面（复用预览已加载的页面），此时 client 与 page_cache 不再使用
+    max_concurrency = max(1, int(max_concurrency))
+    semaphore = asyncio.Semaphore(max_concurrency)
+
+    async def _fetch_page(page_num: int):
+        async with semaphore:
+            try:
+                if repository is not None:
+                    _, posts_obj, comments, failed_floors = await repository.get_page(tid, page_num, log_callback)
+                else:
+                    _, posts_obj, comments, failed_floors = await _fetch_page_data(client, tid, log_callback, page_num, page_cache, comment_concurrency)
+                return page_num, posts_obj, comments, failed_floors
+            except Exception as e:
+                log_callback(f"获取第 {page_num} 页失败: {e}")
+                return page_num, None, {}, []
+
+    page_iter = iter(page_nums)
+    pending: collections.deque[asyncio.Task] = collections.deque()
+
+    def _schedule_next() -> None:
+        next_page = next(page_iter, None)
+        if next_page is not None:
+            pending.append(asyncio.create_task(_fetch_page(next_page)))
+
+    # 预取窗口为并发数的两倍，保证消费方处理当前页时仍有请求在途，同时限制驻留内存的页数
+    for _ in range(max_concurrency * 2):
+        _schedule_next()
+    try:
+        while pending:
+            result = await pending.popleft()
+            _schedule_next()
+            yield result
+    finally:
+        for task in pending:
+            task.cancel()
+        await asyncio.gather(*pending, return_exceptions=True)
+
+@PERF.timed("analysis.total")
+async def analyze_stance_by_page(tieba_client: tb.Client, gemini_client: genai.Client, tid: int, total_pages: int, model_name: str, log_callback: typing.Callable, progress_callback: typing.Callable, chunk_char_budget: int = DEFAULT_CHUNK_CHAR_BUDGET, fetch_concurrency: int = DEFAULT_FETCH_CONCURRENCY, analysis_concurrency: int = DEFAULT_ANALYSIS_CONCURRENCY, page_cache: typing.Optional[ThreadPageCache] = None, chunk_store: typing.Optional[ChunkSummaryStore] = None, reduce_fan_in: int = DEFAULT_REDUCE_FAN_IN, reduce_max_depth: int = DEFAULT_REDUCE_MAX_DEPTH, comment_concurrency: int = DEFAULT_COMMENT_CONCURRENCY, repository: typing.Optional[ThreadPageRepository] = None, reply_marker: str = "") -> dict:
+    log_callback(f"--- 开始对TID {tid} 进行分块分析，共 {total_pages} 页，每块约 {chunk_char_budget} 字符，并发获取 {fetch_concurrency} 页，并发分析 {analysis_concurrency} 块 ---")
+    failed_pages = []
+    partial_pages: dict[int, tuple] = {}
     
-    thread_obj, _, _ = await fetch_full_thread_data(tieba_client, tid, log_callback, page_num=1)
+    if repository is not None:
+        thread_obj, _, _, _ = await repository.get_page(tid, 1, log_callback)
+    else:
+        thread_obj, _, _ = await fetch_full_thread_data(tieba_client, tid, log_callback, page_num=1, page_cache=page_cache, comment_concurrency=comment_concurrency)
     if not thread_obj:
         return {"error": "无法获取帖子主楼信息，分析中止。"}
     
     main_post_text = format_main_post_text(thread_obj)
 
-    total_chunks = (total_pages + pages_per_call - 1) // pages_per_call
-    current_chunk = 0
+    # 增量分析：所有页面都重新获取（有页面缓存时代价很小），分块按内容指纹与已保存的摘要比对，只有新增或内容变化的分块才重新分析
+    plan_hash = analysis_plan_hash(chunk_char_budget)
 
-    for i in range(1, total_pages + 1, pages_per_call):
-        current_chunk += 1
-        page_start = i
-        page_end = min(i + pages_per_call - 1, total_pages)
-        
-        progress_callback(current_chunk, total_chunks, page_start, page_end)
-        
-        chunk_posts_list = []
-        chunk_comments = {}
-        for page_num in range(page_start, page_end + 1):
-            log_callback(f"  正在获取第 {page_num} 页内容...")
-            _, posts_obj, comments = await fetch_full_thread_data(tieba_client, tid, log_callback, page_num=page_num)
-            if posts_obj and posts_obj.objs:
-                chunk_posts_list.extend(posts_obj.objs)
-                chunk_comments.update(comments)
-        
-        if not chunk_posts_list:
-            log_callback(f"警告：块 {current_chunk} (页 {page_start}-{page_end}) 没有获取到内容，跳过。")
-            continue
-        
-        discussion_part_text = format_discussion_text(thread_obj, chunk_posts_list, chunk_comments)
-        full_discussion_text = f"{main_post_text}\n{discussion_part_text}"
+    async def _finish_job(error: typing.Optional[str] = None):
+        if chunk_store is None:
+            return
+        try:
+            await asyncio.to_thread(chunk_store.finish_job, tid, model_name, plan_hash, error)
+        except Exception as e:
+            log_callback(f"更新分析任务状态失败: {e}")
+
+    if chunk_store is not None:
+        try:
+            await asyncio.to_thread(chunk_store.start_job, tid, model_name, plan_hash, getattr(thread_obj, 'title', '') or '', total_pages, 0, 0, reply_marker)
+        except Exception as e:
+            log_callback(f"记录分析任务失败: {e}")
+
+    planner = ChunkPlanner(chunk_char_budget, len(main_post_text) + len(DISCUSSION_HEADER) + 2)
+    user_info_memo = UserInfoMemo(getattr(thread_obj.user, 'user_name', '未知用户'))
+    page_stream = iter_thread_pages(tieba_client, tid, range(1, total_pages + 1), log_callback, fetch_concurrency, page_cache, comment_concurrency, repository)
+    # 获取、格式化与分块分析流水线并行：最多 analysis_concurrency 个分析请求在途，结果按块顺序回收
+    analysis_slots = asyncio.Semaphore(max(1, int(analysis_concurrency)))
+    chunk_tasks: list[asyncio.Task] = []
+    recovery_tasks: list[asyncio.Task] = []
+    chunk_plans: dict[int, dict] = {}
+
+    async def _format_page(page_num: int, posts_obj, comments) -> list[str]:
+        with PERF.span("format.blocks", page=page_num) as span:
+            blocks = await asyncio.to_thread(format_post_blocks, thread_obj, posts_obj.objs, comments, user_info_memo) if posts_obj.objs else []
+            span["chars"] = sum(map(len, blocks))
+        return blocks
+
+    async def _analyze_chunk(chunk_index: int, planned: dict, persist: bool = True) -> dict:
+        page_start, page_end = planned["page_start"], planned["page_end"]
+        try:
+            full_discussion_text = build_chunk_text(main_post_text, planned["blocks"])
+            fingerprint = text_fingerprint(full_discussion_text)
+            stored = None
+            if chunk_store is not None:
+                try:
+                    stored = await asyncio.to_thread(chunk_store.find_by_fingerprint, tid, model_name, plan_hash, fingerprint)
+                except Exception as e:
+                    log_callback(f"查询已保存的分块摘要失败，将重新分析: {e}")
+            if stored:
+                log_callback(f"块 {chunk_index} (页 {page_start}-{page_end}) 内容未变化，复用已有摘要。")
+                chunk_result = {"summary": stored["summary"], "reused": True}
+            else:
+                chunk_result = await _analyze_single_chunk(gemini_client, full_discussion_text, model_name, log_callback)
+        finally:
+            analysis_slots.release()
+        if persist and chunk_store is not None and "summary" in chunk_result:
+            record = {"chunk_index": chunk_index, "page_start": page_start, "page_end": page_end, "starts_at_page_start": planned["starts_at_page_start"], "ends_at_page_end": planned["ends_at_page_end"],
+                      "complete": page_end < total_pages and not planned["has_gap"], "fingerprint": fingerprint, "summary": chunk_result["summary"]}
+            try:
+                await asyncio.to_thread(chunk_store.put, tid, model_name, plan_hash, record)
+            except Exception as e:
+                log_callback(f"保存分块摘要失败: {e}")
+        return {"analysis_failed": "summary" not in chunk_result, "chunk": chunk_index, "page_start": page_start, **chunk_result}
+
+    async def _dispatch(planned: typing.Optional[dict]):
+        if not planned:
+            return
+        chunk_index = len(chunk_tasks) + 1
+        chunk_plans[chunk_index] = planned
+        progress_callback(planned["page_end"], total_pages, planned["page_start"], planned["page_end"])
+        await analysis_slots.acquire()
+        chunk_tasks.append(asyncio.create_task(_analyze_chunk(chunk_index, planned)))
+
+    async def _retry_partial_page(page_num: int) -> tuple:
+        posts_obj, comments, failed_floors = partial_pages[page_num]
+        try:
+            if repository is not None:
+                failed_floors = await repository.retry_failed_comments(tid, page_num, posts_obj, comments, failed_floors, log_callback)
+            else:
+                failed_floors = await refetch_failed_comments(tieba_client, tid, page_num, posts_obj, comments, failed_floors, log_callback, page_cache, comment_concurrency)
+        except Exception as e:
+            log_callback(f"重新获取第 {page_num} 页的楼中楼失败: {e}")
+        return posts_obj, comments, failed_floors
 
-        chunk_result = await _analyze_single_chunk(gemini_client, full_discussion_text, model_name, log_callback)
-        chunk_results.append({"analysis_failed": True, "chunk": current_chunk, **chunk_result})
+    async def _dispatch_recovery(planned: typing.Optional[dict], chunk_index: int, persist: bool):
+        if not planned:
+            return
+        await analysis_slots.acquire()
+        recovery_tasks.append(asyncio.create_task(_analyze_chunk(chunk_index, planned, persist)))
+
+    try:
+        async for page_num, posts_obj, comments, failed_floors in page_stream:
+            if posts_obj is None or failed_floors:
+                # 楼中楼不完整的页面与获取失败的页面一样留空，恢复阶段只重新获取失败楼层的楼中楼
+                if failed_floors:
+                    partial_pages[page_num] = (posts_obj, comments, failed_floors)
+                failed_pages.append(page_num)
+                planner.mark_gap(page_num)
+                continue
+            for planned in planner.add_page(page_num, await _format_page(page_num, posts_obj, comments)):
+                await _dispatch(planned)
+        await _dispatch(planner.flush())
+        chunk_results = list(await asyncio.gather(*chunk_tasks))
+        main_chunk_count = len(chunk_results)
+
+        # 部分失败恢复：只重新分析失败的分块、只重新获取失败的页面，其余结果保持不变
+        failed_chunks = [r["chunk"] for r in chunk_results if r["analysis_failed"] and r["chunk"] in chunk_plans]
+        if failed_chunks:
+            log_callback(f"重新分析 {len(failed_chunks)} 个失败的分块: {', '.join(map(str, failed_chunks))}")
+            await GEMINI_GUARD.wait_until_available(log_callback)
+            for chunk_index in failed_chunks:
+                await _dispatch_recovery(chunk_plans[chunk_index], chunk_index, persist=True)
+        recovered_pages = []
+        if failed_pages:
+            log_callback(f"重新获取 {len(failed_pages)} 个失败的页面: {', '.join(map(str, failed_pages))}")
+            await TIEBA_GUARD.wait_until_available(log_callback)
+            # 补回的页面单独成块，不写入分块存储，避免打乱已保存分块的序号
+            recovery_planner = ChunkPlanner(chunk_char_budget, len(main_post_text) + len(DISCUSSION_HEADER) + 2)
+            missing_pages = [page_num for page_num in failed_pages if page_num not in partial_pages]
+            retry_stream = iter_thread_pages(tieba_client, tid, missing_pages, log_callback, fetch_concurrency, page_cache, comment_concurrency, repository)
+            try:
+                retried_partial = dict(zip(partial_pages, await asyncio.gather(*[_retry_partial_page(page_num) for page_num in partial_pages])))
+                for page_num in failed_pages:
+                    if page_num in retried_partial:
+                        posts_obj, comments, failed_floors = retried_partial[page_num]
+                    else:
+                        _, posts_obj, comments, failed_floors = await retry_stream.__anext__()
+                    if posts_obj is None or failed_floors:
+                        continue
+                    # 不相邻的页面不合并到同一块
+                    if recovered_pages and page_num != recovered_pages[-1] + 1:
+                        await _dispatch_recovery(recovery_planner.flush(), main_chunk_count + len(recovery_tasks) + 1, persist=False)
+                    recovered_pages.append(page_num)
+                    for planned in recovery_planner.add_page(page_num, await _format_page(page_num, posts_obj, comments)):
+                        await _dispatch_recovery(planned, main_chunk_count + len(recovery_tasks) + 1, persist=False)
+                await _dispatch_recovery(recovery_planner.flush(), main_chunk_count + len(recovery_tasks) + 1, persist=False)
+            finally:
+                await retry_stream.aclose()
+        recovery_results = await asyncio.gather(*recovery_tasks)
+    except BaseException as e:
+        for task in chunk_tasks + recovery_tasks:
+            task.cancel()
+        # 等待在途的分块请求真正结束，保证返回时不再有请求占用配额
+        await asyncio.gather(*chunk_tasks, *recovery_tasks, return_exceptions=True)
+        await _finish_job("分析已取消" if isinstance(e, asyncio.CancelledError) else str(e) or type(e).__name__)
+        raise
+    finally:
+        await page_stream.aclose()
+
+    retried = {r["chunk"]: r for r in recovery_results if r["chunk"] <= main_chunk_count}
+    chunk_results = [retried.get(r["chunk"], r) for r in chunk_results]
+    if chunk_store is not None and chunk_results and all("summary" in r for r in chunk_results):
+        try:
+            await asyncio.to_thread(chunk_store.prune, tid, model_name, plan_hash, main_chunk_count)
+        except Exception as e:
+            log_callback(f"清理过期分块摘要失败: {e}")
+    chunk_results += [r for r in recovery_results if r["chunk"] > main_chunk_count]
+    chunk_results.sort(key=lambda r: (r["page_start"], r["chunk"]))
+
+    failed_pages = [page_num for page_num in failed_pages if page_num not in recovered_pages]
+    failed_chunks = sum(1 for r in chunk_results if r["analysis_failed"])
+    if recovered_pages:
+        log_callback(f"已补回 {len(recovered_pages)} 个页面: {', '.join(map(str, recovered_pages))}")
+    if failed_pages:
+        log_callback(f"警告：共有 {len(failed_pages)} 页获取失败: {', '.join(map(str, failed_pages))}")
+    if failed_chunks:
+        log_callback(f"警告：重试后仍有 {failed_chunks} 个分块分析失败，摘要将缺少这部分内容。")
+    reused_chunks = sum(1 for r in chunk_results if r.get("reused"))
+    if reused_chunks:
+        log_callback(f"本次分析共复用 {reused_chunks}/{len(chunk_results)} 个分块摘要。")
+    recovery_info = {"failed_pages": failed_pages, "recovered_pages": recovered_pages, "failed_chunks": failed_chunks}
             
+    # 有页面或分块缺失时保留任务记录，之后可从已保存的分块继续
+    incomplete_error = f"{len(failed_pages)} 页获取失败，{failed_chunks} 个分块分析失败" if failed_pages or failed_chunks else None
     successful_summaries = [r['summary'] for r in chunk_results if 'summary' in r]
     if not successful_summaries:
         first_error = next((r['error'] for r in chunk_results if 'error' in r), "所有分析块均失败，无法生成最终报告。")
-        return {"error": first_error}
+        await _finish_job(first_error)
+        return {"error": first_error, **recovery_info}
     
     if len(successful_summaries) == 1:
         log_callback("只有一个分析块成功，直接返回该块摘要。")
-        return {"summary": successful_summaries[0]}
+        await _finish_job(incomplete_error)
+        return {"summary": successful_summaries[0], "reused_chunks": reused_chunks, **recovery_info}
         
-    final_analysis_result = await _summarize_analyses(gemini_client, successful_summaries, model_name, log_callback)
+    with PERF.span("analysis.reduce", summaries=len(successful_summaries)):
+        final_analysis_result = await reduce_summaries_hierarchically(gemini_client, successful_summaries, model_name, log_callback, reduce_fan_in, reduce_max_depth, analysis_concurrency)
+    final_analysis_result.update(recovery_info, reused_chunks=reused_chunks)
+    await _finish_job(final_analysis_result.get("error") or incomplete_error)
     return final_analysis_result
 
-async def generate_reply(client: genai.Client, discussion_text: str, analysis_summary: str, mode_id: str, model_name: str, log_callback: typing.Callable, custom_input: typing.Optional[str] = None) -> str:
+async def generate_reply(client: genai.Client, discussion_text: str, analysis_summary: str, mode_id: str, model_name: str, log_callback: typing.Callable, custom_input: typing.Optional[str] = None, use_cache: bool = False, context_cache: typing.Optional[GeminiContextCache] = None) -> str:
     modes = PROMPTS.get('reply_generator', {}).get('modes', {})
     mode_name = modes.get(mode_id, {}).get("name", "未知模式")
     log_callback(f"--- 使用模型 {model_name} 和 “{mode_name}”模式生成回复 ---")
+    context_name = await _reply_context_name(context_cache, model_name, discussion_text, analysis_summary, True, log_callback)
     try:
-        prompt = build_reply_generator_prompt(discussion_text, analysis_summary, mode_id, custom_input)
+        with PERF.span("prompt.reply"):
+            prompt = build_reply_generator_prompt(discussion_text, analysis_summary, mode_id, custom_input, context_cached=context_name is not None)
     except Exception as e:
         return f"构建Prompt失败: {e}"
 
     generation_config = {"response_mime_type": "text/plain"}
+    if context_name:
+        generation_config["cached_content"] = context_name
     contents = [types.Content(role="user", parts=[types.Part.from_text(text=prompt)])]
     try:
         log_callback("正在调用 Gemini API 生成回复...")
-        response = await asyncio.to_thread(client.models.generate_content, model=model_name, contents=contents, config=generation_config)
+        # 回复默认绕过响应缓存，重复点击可得到新的变体
+        response = await _timed_generate_content(client, "gemini.reply", model_name, contents, generation_config, len(prompt), cache_prompt=prompt if use_cache else None, log_callback=log_callback)
         if response.text and response.text.strip():
             log_callback("Gemini API 回复生成成功。")
             return response.text.strip()
@@ -519,22 +1380,27 @@ async def generate_reply(client: genai.Client, discussion_text: str, analysis_su
             log_callback(f"Gemini API 未返回有效文本。可能原因：内容安全策略触发。反馈: {feedback_info}")
             return f"生成回复失败：AI未能生成内容。\n\n这通常是由于安全设置或内容审查策略导致的。\n\n(API反馈: {feedback_info})"
     except Exception as e:
+        # 缓存可能已在服务端失效，下次请求重新注册
+        if context_name: context_cache.invalidate(context_name)
         log_callback(f"Gemini API 回复生成失败: {e}"); return f"生成回复失败: {e}"
 
-async def optimize_reply(client: genai.Client, discussion_text: str, analysis_summary: str, mode_id: str, model_name: str, log_callback: typing.Callable, reply_draft: str, custom_input: typing.Optional[str] = None) -> str:
+async def optimize_reply(client: genai.Client, discussion_text: str, analysis_summary: str, mode_id: str, model_name: str, log_callback: typing.Callable, reply_draft: str, custom_input: typing.Optional[str] = None, use_cache: bool = False, context_cache: typing.Optional[GeminiContextCache] = None) -> str:
     modes = PROMPTS.get('reply_generator', {}).get('modes', {})
     mode_name = modes.get(mode_id, {}).get("name", "未知模式")
     log_callback(f"--- 使用模型 {model_name} 和 “{mode_name}”模式优化已有回复 ---")
-    
+    context_name = await _reply_context_name(context_cache, model_name, discussion_text, analysis_summary, False, log_callback)
     try:
-        prompt = build_reply_optimizer_prompt(discussion_text, analysis_summary, mode_id, reply_draft, custom_input)
+        with PERF.span("prompt.optimize"):
+            prompt = build_reply_optimizer_prompt(discussion_text, analysis_summary, mode_id, reply_draft, custom_input, context_cached=context_name is not None)
     except Exception as e:
         return f"构建优化Prompt失败: {e}"
     generation_config = {"response_mime_type": "text/plain"}
+    if context_name:
+        generation_config["cached_content"] = context_name
     contents = [types.Content(role="user", parts=[types.Part.from_text(text=prompt)])]
     try:
         log_callback("正在调用 Gemini API 优化回复...")
-        response = await asyncio.to_thread(client.models.generate_content, model=model_name, contents=contents, config=generation_config)
+        response = await _timed_generate_content(client, "gemini.optimize", model_name, contents, generation_config, len(prompt), cache_prompt=prompt if use_cache else None, log_callback=log_callback)
         if response.text and response.text.strip():
             log_callback("Gemini API 回复优化成功。")
             return response.text.strip()
@@ -544,56 +1410,83 @@ async def optimize_reply(client: genai.Client, discussion_text: str, analysis_su
                 feedback_info = str(response.prompt_feedback)
             return f"优化回复失败：AI未能生成内容。\n\n(API反馈: {feedback_info})"
     except Exception as e:
+        if context_name: context_cache.invalidate(context_name)
         log_callback(f"Gemini API 回复优化失败: {e}")
         return f"优化回复失败: {e}"
 
-def generate_reply_stream(client: genai.Client, discussion_text: str, analysis_summary: str, mode_id: str, model_name: str, log_callback: typing.Callable, custom_input: typing.Optional[str] = None) -> typing.Generator[str, None, None]:
+async def generate_reply_stream(client: genai.Client, discussion_text: str, analysis_summary: str, mode_id: str, model_name: str, log_callback: typing.Callable, custom_input: typing.Optional[str] = None, context_cache: typing.Optional[GeminiContextCache] = None) -> typing.AsyncGenerator[str, None]:
     modes = PROMPTS.get('reply_generator', {}).get('modes', {})
     mode_name = modes.get(mode_id, {}).get("name", "未知模式")
     log_callback(f"--- 使用模型 {model_name} 和 “{mode_name}”模式生成回复 ---")
+    context_name = await _reply_context_name(context_cache, model_name, discussion_text, analysis_summary, True, log_callback)
     try:
-        prompt = build_reply_generator_prompt(discussion_text, analysis_summary, mode_id, custom_input)
+        with PERF.span("prompt.reply"):
+            prompt = build_reply_generator_prompt(discussion_text, analysis_summary, mode_id, custom_input, context_cached=context_name is not None)
     except Exception as e:
-        return f"构建Prompt失败: {e}"
+        yield f"构建Prompt失败: {e}"
+        return
 
     generation_config = {"response_mime_type": "text/plain"}
+    if context_name:
+        generation_config["cached_content"] = context_name
     contents = [types.Content(role="user", parts=[types.Part.from_text(text=prompt)])]
     
     try:
         log_callback("正在调用 Gemini API 生成回复...")
-        response_stream = client.models.generate_content_stream(model=model_name, contents=contents, config=generation_config)
-        for chunk in response_stream:
-            if hasattr(chunk, 'text') and chunk.text:
-                yield chunk.text
+        async for text in _timed_stream(client, "gemini.reply_stream", model_name, contents, generation_config, len(prompt), log_callback):
+            yield text
         log_callback("Gemini API 回复生成成功。")
     except Exception as e:
+        if context_name: context_cache.invalidate(context_name)
         log_callback(f"Gemini API 回复生成失败: {e}")
         yield f"生成回复失败: {e}"
 
-def optimize_reply_stream(client: genai.Client, discussion_text: str, analysis_summary: str, mode_id: str, model_name: str, log_callback: typing.Callable, reply_draft: str, custom_input: typing.Optional[str] = None) -> typing.Generator[str, None, None]:
+async def optimize_reply_stream(client: genai.Client, discussion_text: str, analysis_summary: str, mode_id: str, model_name: str, log_callback: typing.Callable, reply_draft: str, custom_input: typing.Optional[str] = None, context_cache: typing.Optional[GeminiContextCache] = None) -> typing.AsyncGenerator[str, None]:
     modes = PROMPTS.get('reply_generator', {}).get('modes', {})
     mode_name = modes.get(mode_id, {}).get("name", "未知模式")
     log_callback(f"--- 使用模型 {model_name} 和 “{mode_name}”模式优化已有回复 ---")
+    context_name = await _reply_context_name(context_cache, model_name, discussion_text, analysis_summary, False, log_callback)
     try:
-        prompt = build_reply_optimizer_prompt(discussion_text, analysis_summary, mode_id, reply_draft, custom_input)
+        with PERF.span("prompt.optimize"):
+            prompt = build_reply_optimizer_prompt(discussion_text, analysis_summary, mode_id, reply_draft, custom_input, context_cached=context_name is not None)
     except Exception as e:
         yield f"构建优化Prompt失败: {e}"
         return
 
     generation_config = {"response_mime_type": "text/plain"}
+    if context_name:
+        generation_config["cached_content"] = context_name
     contents = [types.Content(role="user", parts=[types.Part.from_text(text=prompt)])]
 
     try:
         log_callback("正在调用 Gemini API 优化回复...")
-        response_stream = client.models.generate_content_stream(model=model_name, contents=contents, config=generation_config)
-        for chunk in response_stream:
-            if hasattr(chunk, 'text') and chunk.text:
-                yield chunk.text
+        async for text in _timed_stream(client, "gemini.optimize_stream", model_name, contents, generation_config, len(prompt), log_callback):
+            yield text
         log_callback("Gemini API 回复优化成功。")
     except Exception as e:
+        if context_name: context_cache.invalidate(context_name)
         log_callback(f"Gemini API 回复优化失败: {e}")
         yield f"优化回复失败: {e}"
 
+async def generate_reply_streams(client: genai.Client, discussion_text: str, analysis_summary: str, mode_ids: list[str], model_name: str, log_callback: typing.Callable, on_chunk: typing.Callable[[str, str], None], on_done: typing.Optional[typing.Callable[[str], None]] = None, custom_input: typing.Optional[str] = None, max_concurrency: int = DEFAULT_REPLY_FANOUT_CONCURRENCY, context_cache: typing.Optional[GeminiContextCache] = None) -> dict[str, str]:
+    # 为多个回复模式并行生成流式回复，同时进行的请求不超过 max_concurrency 个；片段以 on_chunk(mode_id, text) 交付，
+    # 每个模式结束（含失败或取消）时调用 on_done(mode_id)。返回各模式的完整回复
+    semaphore = asyncio.Semaphore(max(1, int(max_concurrency)))
+    parts: dict[str, list[str]] = {mode_id: [] for mode_id in mode_ids}
+
+    async def _generate(mode_id: str):
+        try:
+            async with semaphore:
+                async for text in generate_reply_stream(client, discussion_text, analysis_summary, mode_id, model_name, log_callback, custom_input, context_cache=context_cache):
+                    parts[mode_id].append(text)
+                    on_chunk(mode_id, text)
+        finally:
+            if on_done: on_done(mode_id)
+
+    with PERF.span("reply.fan_out", modes=len(mode_ids)):
+        await asyncio.gather(*[_generate(mode_id) for mode_id in mode_ids])
+    return {mode_id: "".join(texts) for mode_id, texts in parts.items()}
+
 _DEFAULT_MODE_IDS = None
 
 def get_default_mode_ids() -> set:
@@ -3,10 +3,13 @@ import asyncio
 import os
 import json
 import uuid
+import collections
+import time
 from google import genai
+import typing
 from enum import Enum, auto
 import core_logic as core
-import aiotieba as tb
+from log_sink import LogSink
 from aiotieba import ThreadSortType
 from aiotieba import typing as tb_typing
 
@@ -15,6 +18,61 @@ class LogLevel(Enum):
     WARNING = auto()
     ERROR = auto()
 
+class ReplyStreamRenderer:
+    # 流式回复渲染：生产者只向缓冲追加片段，事件循环每隔 interval 秒或积累 max_pending_chars 个字符时合并刷新一次，且只更新目标控件
+    def __init__(self, control: ft.Control, interval: float = 0.05, max_pending_chars: int = 400, cursor: str = " ▌"):
+        self.control = control
+        self.interval = interval
+        self.max_pending_chars = max_pending_chars
+        self.cursor = cursor
+        self.text = ""
+        self.received_any = False
+        self._parts: list[str] = []
+        self._pending_chars = 0
+        self._wake = asyncio.Event()
+
+    def feed(self, chunk: str):
+        self._parts.append(chunk)
+        self._pending_chars += len(chunk)
+        if self._pending_chars >= self.max_pending_chars:
+            self._wake.set()
+
+    async def consume(self, stream: typing.AsyncIterable[str]):
+        async for chunk in stream:
+            self.feed(chunk)
+
+    def _drain(self) -> bool:
+        if not self._pending_chars:
+            return False
+        self.text = "".join(self._parts)
+        self._parts = [self.text]; self._pending_chars = 0
+        self.received_any = True
+        return True
+
+    def _render(self, value: str):
+        self.control.value = value
+        if self.control.page: self.control.update()
+
+    async def run(self, producer: asyncio.Future, on_first_chunk: typing.Optional[typing.Callable] = None):
+        try:
+            while not producer.done():
+                waiter = asyncio.ensure_future(self._wake.wait())
+                try: await asyncio.wait({producer, waiter}, timeout=self.interval, return_when=asyncio.FIRST_COMPLETED)
+                finally: waiter.cancel()
+                self._wake.clear()
+                had_text = self.received_any
+                if self._drain():
+                    if not had_text and on_first_chunk: on_first_chunk()
+                    self._render(self.text + self.cursor)
+        except asyncio.CancelledError:
+            # 渲染被取消时一并取消生产者（关闭其 Gemini 流），并保留已收到的内容
+            producer.cancel(); await asyncio.wait({producer})
+            self._drain()
+            raise
+        had_text = self.received_any
+        if self._drain() and not had_text and on_first_chunk: on_first_chunk()
+        self._render(self.text)
+
 class TiebaGPTApp:
 
     LOG_LEVEL_COLOR_MAP = {
@@ -29,6 +87,21 @@ class TiebaGPTApp:
         LogLevel.ERROR: ft.Icons.ERROR_OUTLINE,
     }
 
+    # 流式回复刷新节奏：最多每 50 毫秒或每 400 个字符刷新一次回复控件
+    STREAM_FLUSH_INTERVAL = 0.05
+    STREAM_FLUSH_CHARS = 400
+    # 状态日志每 200 毫秒批量刷新一次，界面最多保留 100 条
+    LOG_FLUSH_INTERVAL = 0.2
+    LOG_VISIBLE_ENTRIES = 100
+    # 帖子预览：首屏同步渲染的楼层数、后续每批楼层数；楼中楼超过阈值时折叠，只显示前几条；缓存最近几页的控件以便翻页复用
+    PREVIEW_FIRST_BATCH = 8
+    PREVIEW_BATCH = 15
+    PREVIEW_COMMENT_COLLAPSE_THRESHOLD = 5
+    PREVIEW_COMMENTS_VISIBLE = 3
+    PREVIEW_CACHED_PAGES = 5
+    # 阅读当前页时在后台预取下一页（以及上一页），翻页时直接使用预取结果
+    PREFETCH_PREVIOUS_PAGE = True
+
     def __init__(self, page: ft.Page):
         self.page = page
         self.page.title = "贴吧智能回复助手"
@@ -40,16 +113,30 @@ class TiebaGPTApp:
         self.app_version = core.VERSION
 
         # --- 状态变量 ---
-        self.settings = {}; self.gemini_client = None; self.threads = []; self.selected_thread = None
+        self.settings = {}; self.gemini_client = None; self.context_cache = None; self.threads = []; self.selected_thread = None
         self.discussion_text = ""; self.analysis_result = None; self.current_mode_id = None
         self.custom_input = None; self.current_page_num = 1; self.thread_list_scroll_offset = 0.0
-        self.analysis_cache = {}
+        self.result_store = None
+        self.selected_thread_marker = ""
         self.current_analysis_tid = None
         self.current_search_query = None
         self.current_post_page = 1
         self.total_post_pages = 1
         self.blinking_cursor_task = None
         self.is_ai_generating = False
+        self.log_sink = LogSink(pending_capacity=self.LOG_VISIBLE_ENTRIES)
+        self.log_flush_task = None
+        self.preview_render_task = None
+        self.prefetch_tasks: dict[tuple, asyncio.Task] = {}
+        self.preview_widget_cache: collections.OrderedDict[tuple, list] = collections.OrderedDict()
+        self.tieba_clients = core.TiebaClientManager(log_callback=self.log_message)
+        self.page_cache = None
+        self.chunk_store = None
+        self.thread_repository = None
+        self.unfinished_jobs: list[dict] = []
+        self.analyzing_tid = None
+        self.analysis_task = None
+        self.reply_task = None
 
         # --- UI 控件 ---
         # -- 导航 --
@@ -70,8 +157,9 @@ class TiebaGPTApp:
         )
         
         # -- 通用 --
-        self.status_log = ft.ListView(expand=True, spacing=5)
+        self.status_log = ft.ListView(expand=True, spacing=5, auto_scroll=True)
         self.copy_log_button = ft.IconButton(icon=ft.Icons.COPY_ALL, on_click=self.copy_log_click, tooltip="复制所有日志")
+        self.perf_button = ft.IconButton(icon=ft.Icons.SPEED, on_click=self.open_perf_dialog, tooltip="性能统计")
         self.progress_ring = ft.ProgressRing(visible=False)
         
         # -- 主页 --
@@ -87,6 +175,7 @@ class TiebaGPTApp:
             value=ThreadSortType.REPLY,
         )
         self.search_button = ft.ElevatedButton("获取帖子", on_click=self.search_tieba, icon=ft.Icons.FIND_IN_PAGE)
+        self.resume_jobs_button = ft.IconButton(icon=ft.Icons.RESTORE, tooltip="未完成的分析", on_click=self.open_resume_jobs_dialog, visible=False)
         self.thread_list_view = ft.ListView(expand=1, spacing=10, auto_scroll=False)
         self.prev_page_button = ft.IconButton(icon=ft.Icons.KEYBOARD_ARROW_LEFT, on_click=self.load_prev_page, tooltip="上一页", disabled=True)
         self.next_page_button = ft.IconButton(icon=ft.Icons.KEYBOARD_ARROW_RIGHT, on_click=self.load_next_page, tooltip="下一页", disabled=True)
@@ -98,14 +187,17 @@ class TiebaGPTApp:
         self.analysis_display = ft.Markdown(selectable=True, code_theme="atom-one-dark")
         self.reply_display = ft.Markdown(selectable=True, code_theme="atom-one-light")
         self.analyze_button = ft.ElevatedButton("分析整个帖子", icon=ft.Icons.INSIGHTS_ROUNDED, on_click=self.analyze_thread_click, tooltip="对整个帖子进行分批AI分析", disabled=True)
+        self.stop_analysis_button = ft.OutlinedButton("停止分析", icon=ft.Icons.STOP, on_click=self.stop_analysis_click, tooltip="停止后已完成的分块会保留，可稍后继续", visible=False)
         self.analysis_progress_bar = ft.ProgressBar(visible=False)
         self.mode_selector = ft.Dropdown(label="回复模式", on_change=self.on_mode_change, disabled=True)
         self.custom_view_input = ft.TextField(label="请输入此模式所需的自定义内容", multiline=True, max_lines=3, visible=False)
         self.generate_button = ft.ElevatedButton("生成回复", on_click=self.generate_reply_click, icon=ft.Icons.AUTO_AWESOME, disabled=True)
         self.generate_reply_ring = ft.ProgressRing(visible=False, width=16, height=16)
+        self.stop_reply_button = ft.IconButton(icon=ft.Icons.STOP_CIRCLE_OUTLINED, tooltip="停止生成", on_click=self.stop_reply_click, visible=False)
         self.copy_button = ft.IconButton(icon=ft.Icons.CONTENT_COPY_ROUNDED, tooltip="复制回复内容", on_click=self.copy_reply_click, disabled=True)
         self.reply_draft_input = ft.TextField(label="或在此处输入您的回复草稿进行优化",multiline=True,min_lines=3, max_lines=5, on_change=self.on_draft_input_change)
         self.optimize_button = ft.ElevatedButton("优化回复", on_click=self.optimize_reply_click,icon=ft.Icons.AUTO_FIX_HIGH, disabled=True)
+        self.compare_modes_button = ft.IconButton(icon=ft.Icons.COMPARE_ARROWS, tooltip="多模式对比生成", on_click=self.open_compare_modes_dialog, disabled=True)
         self.prev_post_page_button = ft.IconButton(icon=ft.Icons.KEYBOARD_ARROW_LEFT, on_click=self.load_prev_post_page, tooltip="上一页", disabled=True)
         self.next_post_page_button = ft.IconButton(icon=ft.Icons.KEYBOARD_ARROW_RIGHT, on_click=self.load_next_post_page, tooltip="下一页", disabled=True)
         self.post_page_display = ft.Text("第 1 / 1 页", weight=ft.FontWeight.BOLD)
@@ -113,13 +205,22 @@ class TiebaGPTApp:
         # -- 设置页控件 ---
         self.api_key_input = ft.TextField(label="Gemini API Key", password=True, can_reveal_password=True, on_change=self.validate_settings)
         self.save_api_key_switch = ft.Switch(label="在配置文件中保存API Key (有安全风险)",value=False,on_change=self.validate_settings)
+        self.log_to_file_switch = ft.Switch(label="将日志写入文件 (JSON Lines)",value=False,on_change=self.validate_settings)
+        self.response_cache_switch = ft.Switch(label="缓存AI分析响应",value=False,on_change=self.validate_settings)
+        self.clear_response_cache_button = ft.TextButton("清空AI响应缓存", icon=ft.Icons.DELETE_SWEEP, on_click=self.clear_response_cache_click)
         self.analyzer_model_dd = ft.Dropdown(label="分析模型", hint_text="选择一个分析模型", on_change=self.validate_settings, expand=True)
         self.generator_model_dd = ft.Dropdown(label="生成模型", hint_text="选择一个生成模型", on_change=self.validate_settings, expand=True)
         self.model_selection_row = ft.Row(controls=[self.analyzer_model_dd, self.generator_model_dd], spacing=20)
         self.fetch_models_button = ft.ElevatedButton("测试Key并获取模型", on_click=self.fetch_models_click, icon=ft.Icons.CLOUD_DOWNLOAD)
         self.fetch_models_ring = ft.ProgressRing(visible=False, width=16, height=16)
         self.color_seed_input = ft.TextField(label="主题种子颜色 (Material You)",hint_text="输入颜色名 (如 blue) 或HEX值 (#6750A4)",on_change=self.validate_settings)
-        self.pages_per_call_slider = ft.Slider(min=1, max=10, divisions=9,label="每次分析的页数: {value}",on_change=self.validate_settings)
+        self.chunk_budget_slider = ft.Slider(min=10000, max=100000, divisions=18,label="每块字符预算: {value}",on_change=self.validate_settings)
+        self.fetch_concurrency_slider = ft.Slider(min=1, max=16, divisions=15,label="并发获取页数: {value}",on_change=self.validate_settings)
+        self.comment_concurrency_slider = ft.Slider(min=1, max=16, divisions=15,label="并发获取楼中楼: {value}",on_change=self.validate_settings)
+        self.analysis_concurrency_slider = ft.Slider(min=1, max=8, divisions=7,label="并发分析块数: {value}",on_change=self.validate_settings)
+        self.fanout_concurrency_slider = ft.Slider(min=1, max=8, divisions=7,label="并行生成模式数: {value}",on_change=self.validate_settings)
+        self.reduce_fan_in_slider = ft.Slider(min=2, max=16, divisions=14,label="每批整合摘要数: {value}",on_change=self.validate_settings)
+        self.reduce_max_depth_slider = ft.Slider(min=1, max=5, divisions=4,label="最大整合层数: {value}",on_change=self.validate_settings)
         self.save_settings_button = ft.ElevatedButton("保存设置", on_click=self.save_settings_click, icon=ft.Icons.SAVE, disabled=True)
         self.prompt_text_fields = {}
         self.save_prompts_button = ft.ElevatedButton("保存 Prompts", on_click=self.save_prompts_click, icon=ft.Icons.SAVE_ALT, disabled=True)
@@ -150,7 +251,7 @@ class TiebaGPTApp:
         
     # --- 视图构建方法 ---
     def build_main_view(self):
-        input_row = ft.Row([self.tieba_name_input, self.search_query_input, self.sort_type_dropdown, self.search_button], alignment=ft.MainAxisAlignment.CENTER, spacing=10)
+        input_row = ft.Row([self.tieba_name_input, self.search_query_input, self.sort_type_dropdown, self.search_button, self.resume_jobs_button], alignment=ft.MainAxisAlignment.CENTER, spacing=10)
         app_info_row = ft.Row([ft.Text(f"v{self.app_version}", color="primary"), ft.Icon(ft.Icons.CIRCLE, size=8, color=ft.Colors.GREY_400), ft.TextButton(text="GitHub", icon=ft.Icons.CODE, url=core.CODE_URL, tooltip="查看项目源代码")], alignment=ft.MainAxisAlignment.CENTER, spacing=8)
         
         return ft.Column([
@@ -197,7 +298,7 @@ class TiebaGPTApp:
                 ft.Text("讨论状况分析", style=ft.TextThemeStyle.TITLE_MEDIUM),
                 ft.Container(
                     content=ft.Column(
-                        controls=[self.analyze_button, self.analysis_progress_bar, ft.Container(content=ft.Column([self.analysis_display], scroll=ft.ScrollMode.ADAPTIVE), bgcolor=ft.Colors.with_opacity(0.08, "tertiary"), border_radius=ft.border_radius.all(5), padding=ft.padding.all(10), expand=True)],
+                        controls=[self.analyze_button, self.stop_analysis_button, self.analysis_progress_bar, ft.Container(content=ft.Column([self.analysis_display], scroll=ft.ScrollMode.ADAPTIVE), bgcolor=ft.Colors.with_opacity(0.08, "tertiary"), border_radius=ft.border_radius.all(5), padding=ft.padding.all(10), expand=True)],
                         spacing=10, horizontal_alignment=ft.CrossAxisAlignment.STRETCH
                     ), border=ft.border.all(1, ft.Colors.OUTLINE),border_radius=5,padding=10,expand=True
                 ),
@@ -208,7 +309,7 @@ class TiebaGPTApp:
             controls=[
                 ft.Text("生成回复", style=ft.TextThemeStyle.TITLE_MEDIUM),
                 self.mode_selector, self.custom_view_input, ft.Divider(height=15), self.reply_draft_input, 
-                ft.Row([self.generate_button, self.optimize_button, self.copy_button, self.generate_reply_ring], alignment=ft.MainAxisAlignment.CENTER), 
+                ft.Row([self.generate_button, self.optimize_button, self.compare_modes_button, self.copy_button, self.generate_reply_ring, self.stop_reply_button], alignment=ft.MainAxisAlignment.CENTER), 
                 ft.Divider(height=15), 
                 ft.Container(
                     content=ft.Column([self.reply_display], scroll=ft.ScrollMode.ADAPTIVE, expand=True, horizontal_alignment=ft.CrossAxisAlignment.STRETCH),
@@ -287,11 +388,28 @@ class TiebaGPTApp:
                                 self.model_selection_row,
                                 ft.Divider(), 
                                 ft.Container(content=ft.Text("分析设置", style=ft.TextThemeStyle.TITLE_MEDIUM), margin=ft.margin.only(top=10)),
-                                ft.Text("调整每次调用AI进行分析时读取的帖子页数。", size=12, color=ft.Colors.GREY_700),
-                                self.pages_per_call_slider,
+                                ft.Text("调整每次调用AI进行分析时发送的最大字符数，帖子内容将按此预算自动分块。", size=12, color=ft.Colors.GREY_700),
+                                self.chunk_budget_slider,
+                                ft.Text("调整分析时同时获取的帖子页数，过高可能触发贴吧限流。", size=12, color=ft.Colors.GREY_700),
+                                self.fetch_concurrency_slider,
+                                ft.Text("调整每页同时请求楼中楼的楼层数量，过高可能触发贴吧限流。", size=12, color=ft.Colors.GREY_700),
+                                self.comment_concurrency_slider,
+                                ft.Text("调整同时发送给AI分析的分块数量，过高可能触发API速率限制。", size=12, color=ft.Colors.GREY_700),
+                                self.analysis_concurrency_slider,
+                                ft.Text("调整多模式对比时同时生成回复的模式数量，过高可能触发API速率限制。", size=12, color=ft.Colors.GREY_700),
+                                self.fanout_concurrency_slider,
+                                ft.Text("超长帖子的分块摘要将按批逐层整合，调整每批的摘要数量与最大层数。", size=12, color=ft.Colors.GREY_700),
+                                self.reduce_fan_in_slider,
+                                self.reduce_max_depth_slider,
+                                ft.Text("开启后，相同模型与Prompt的分块分析、摘要整合及模式生成请求将直接复用本地保存的结果；生成回复始终请求新的内容。", size=12, color=ft.Colors.GREY_700),
+                                ft.Row([self.response_cache_switch, self.clear_response_cache_button], vertical_alignment=ft.CrossAxisAlignment.CENTER),
                                 ft.Divider(),
                                 ft.Container(content=ft.Text("样式设置", style=ft.TextThemeStyle.TITLE_MEDIUM), margin=ft.margin.only(top=10)),
-                                self.color_seed_input
+                                self.color_seed_input,
+                                ft.Divider(),
+                                ft.Container(content=ft.Text("日志设置", style=ft.TextThemeStyle.TITLE_MEDIUM), margin=ft.margin.only(top=10)),
+                                ft.Text(f"开启后状态日志将同时追加写入 {os.path.basename(core.LOG_FILE)}，便于排查问题。", size=12, color=ft.Colors.GREY_700),
+                                self.log_to_file_switch
                             ], spacing=15
                         )
                     )
@@ -392,7 +510,7 @@ class TiebaGPTApp:
         log_container = ft.Container(self.status_log,border=ft.border.all(1, ft.Colors.OUTLINE),border_radius=5,padding=10)
         if expand: log_container.expand = True
         elif height is not None: log_container.height = height
-        return ft.Column(controls=[ft.Row([ft.Text("状态日志:", style=ft.TextThemeStyle.TITLE_MEDIUM),self.copy_log_button],alignment=ft.MainAxisAlignment.SPACE_BETWEEN,vertical_alignment=ft.CrossAxisAlignment.CENTER),log_container],expand=expand)
+        return ft.Column(controls=[ft.Row([ft.Text("状态日志:", style=ft.TextThemeStyle.TITLE_MEDIUM),ft.Row([self.perf_button,self.copy_log_button],spacing=0)],alignment=ft.MainAxisAlignment.SPACE_BETWEEN,vertical_alignment=ft.CrossAxisAlignment.CENTER),log_container],expand=expand)
 
     def build_about_view(self):
         info_card = ft.Card(
@@ -525,10 +643,10 @@ class TiebaGPTApp:
         try:
             while True:
                 self.reply_display.value = "▌"
-                if self.page: self.page.update()
+                if self.reply_display.page: self.reply_display.update()
                 await asyncio.sleep(0.5)
                 self.reply_display.value = ""
-                if self.page: self.page.update()
+                if self.reply_display.page: self.reply_display.update()
                 await asyncio.sleep(0.5)
         except asyncio.CancelledError:
             pass
@@ -538,6 +656,18 @@ class TiebaGPTApp:
         success, msg = core.ensure_default_prompts_exist_sync()
         self.log_message(msg, LogLevel.INFO if success else LogLevel.ERROR)
         self.settings = core.load_settings()
+        self.log_sink.set_file(core.LOG_FILE if self.settings.get("log_to_file") else None)
+        self.log_flush_task = self.page.run_task(self._flush_logs_periodically)
+        try:
+            self.page_cache = core.create_page_cache(self.settings)
+        except Exception as e:
+            self.page_cache = None; self.log_message(f"无法打开本地页面缓存，将直接从网络获取: {e}", LogLevel.WARNING)
+        core.configure_response_cache(self.settings, self.log_message)
+        self.thread_repository = core.ThreadPageRepository(self.tieba_clients, self.page_cache, self.settings.get("comment_concurrency", core.DEFAULT_COMMENT_CONCURRENCY))
+        try:
+            self.chunk_store = core.create_chunk_store()
+        except Exception as e:
+            self.chunk_store = None; self.log_message(f"无法打开分块摘要存储，每次将完整分析: {e}", LogLevel.WARNING)
         seed_color = self.settings.get("color_scheme_seed"); 
         if seed_color: self.page.theme = ft.Theme(color_scheme_seed=seed_color)
         success, msg = core.load_prompts(); self.log_message(msg, LogLevel.INFO if success else LogLevel.ERROR)
@@ -555,18 +685,52 @@ class TiebaGPTApp:
                 self.log_message(f"使用已配置的Key初始化失败: {e}，请前往设置更新。", LogLevel.ERROR); self.search_button.disabled = True
         else:
             self.log_message("未找到API Key，请前往设置页面配置。", LogLevel.WARNING); self.search_button.disabled = True
+        self.context_cache = core.GeminiContextCache(self.gemini_client) if self.gemini_client else None
         
         self.main_view_content_area.content = self._build_main_view_content()
         self.page.update()
+        self.page.run_task(self._refresh_unfinished_jobs)
+
+    async def shutdown(self, e=None):
+        await self._cancel_thread_work()
+        if self.log_flush_task: self.log_flush_task.cancel()
+        if self.log_sink.has_file_pending: await asyncio.to_thread(self.log_sink.write_file)
+        if self.context_cache: await self.context_cache.close()
+        await self.tieba_clients.close()
+        # 关闭本地存储，使 SQLite 在退出前完成 WAL 检查点
+        for store in (self.page_cache, self.chunk_store, self.result_store, core.RESPONSE_CACHE):
+            if store is None: continue
+            try: await asyncio.to_thread(store.close)
+            except Exception as ex: self.log_message(f"关闭本地存储时出错: {ex}", LogLevel.WARNING)
+        self.page_cache = self.chunk_store = self.result_store = core.RESPONSE_CACHE = None
 
     def log_message(self, message: str, level: LogLevel = LogLevel.INFO):
+        # 可在任意线程调用：只写入日志缓冲，由 _flush_logs_periodically 批量刷新到界面
         if not message: return
+        self.log_sink.emit(level.name, message)
+
+    def _create_log_entry(self, level: LogLevel, text: str) -> ft.Control:
         log_color = self.LOG_LEVEL_COLOR_MAP.get(level, "on_surface_variant"); log_icon = self.LOG_LEVEL_ICON_MAP.get(level, ft.Icons.INFO_OUTLINE)
-        log_entry = ft.Row(controls=[ft.Icon(name=log_icon, color=log_color, size=14), ft.Text(f"[{level.name}] {message}", size=11, selectable=True, color=log_color, expand=True, no_wrap=False)], spacing=5, vertical_alignment=ft.CrossAxisAlignment.START)
-        self.status_log.controls.append(log_entry)
-        if len(self.status_log.controls) > 100: self.status_log.controls.pop(0)
-        if self.status_log.page: self.status_log.update(); self.status_log.scroll_to(offset=-1, duration=300)
-        if self.page: self.page.update()
+        return ft.Row(controls=[ft.Icon(name=log_icon, color=log_color, size=14), ft.Text(text, size=11, selectable=True, color=log_color, expand=True, no_wrap=False)], spacing=5, vertical_alignment=ft.CrossAxisAlignment.START)
+
+    async def _flush_logs(self):
+        batch, dropped = self.log_sink.drain()
+        if batch:
+            entries = [self._create_log_entry(LogLevel[level], f"[{level}] {message}") for _, level, message in batch]
+            if dropped: entries.insert(0, self._create_log_entry(LogLevel.WARNING, f"[WARNING] 日志过多，已省略 {dropped} 条较早的日志 (可通过复制日志查看)。"))
+            self.status_log.controls.extend(entries)
+            del self.status_log.controls[:-self.LOG_VISIBLE_ENTRIES]
+            if self.status_log.page: self.status_log.update()
+        if self.log_sink.has_file_pending:
+            try:
+                await asyncio.to_thread(self.log_sink.write_file)
+            except OSError as e:
+                self.log_sink.set_file(None); self.log_message(f"写入日志文件失败，已停止写入: {e}", LogLevel.WARNING)
+
+    async def _flush_logs_periodically(self):
+        while True:
+            await asyncio.sleep(self.LOG_FLUSH_INTERVAL)
+            await self._flush_logs()
 
     async def navigate(self, e):
         idx = self.navigation_rail.selected_index if e is None else e.control.selected_index
@@ -596,7 +760,15 @@ class TiebaGPTApp:
         else:
             self.api_key_input.hint_text = "请输入您的 API Key"; self.save_api_key_switch.value = False
         self.color_seed_input.value = self.settings.get("color_scheme_seed", "blue")
-        self.pages_per_call_slider.value = self.settings.get("pages_per_api_call", 4)
+        self.chunk_budget_slider.value = self.settings.get("chunk_char_budget", core.DEFAULT_CHUNK_CHAR_BUDGET)
+        self.fetch_concurrency_slider.value = self.settings.get("fetch_concurrency", core.DEFAULT_FETCH_CONCURRENCY)
+        self.comment_concurrency_slider.value = self.settings.get("comment_concurrency", core.DEFAULT_COMMENT_CONCURRENCY)
+        self.analysis_concurrency_slider.value = self.settings.get("analysis_concurrency", core.DEFAULT_ANALYSIS_CONCURRENCY)
+        self.fanout_concurrency_slider.value = self.settings.get("reply_fanout_concurrency", core.DEFAULT_REPLY_FANOUT_CONCURRENCY)
+        self.reduce_fan_in_slider.value = self.settings.get("reduce_fan_in", core.DEFAULT_REDUCE_FAN_IN)
+        self.reduce_max_depth_slider.value = self.settings.get("reduce_max_depth", core.DEFAULT_REDUCE_MAX_DEPTH)
+        self.log_to_file_switch.value = bool(self.settings.get("log_to_file", False))
+        self.response_cache_switch.value = bool(self.settings.get("response_cache_enabled", False))
         self._rebuild_model_dropdowns(self.settings.get("available_models"))
         self.save_prompts_button.disabled = True; self.validate_settings(None); self.page.update()
 
@@ -672,7 +844,15 @@ class TiebaGPTApp:
         else:
             self.settings["api_key"] = ""
         self.settings["analyzer_model"] = self.analyzer_model_dd.value; self.settings["generator_model"] = self.generator_model_dd.value
-        self.settings["pages_per_api_call"] = int(self.pages_per_call_slider.value)
+        self.settings["chunk_char_budget"] = int(self.chunk_budget_slider.value)
+        self.settings["fetch_concurrency"] = int(self.fetch_concurrency_slider.value)
+        self.settings["comment_concurrency"] = int(self.comment_concurrency_slider.value); self.thread_repository.comment_concurrency = self.settings["comment_concurrency"]
+        self.settings["analysis_concurrency"] = int(self.analysis_concurrency_slider.value)
+        self.settings["reply_fanout_concurrency"] = int(self.fanout_concurrency_slider.value)
+        self.settings["reduce_fan_in"] = int(self.reduce_fan_in_slider.value)
+        self.settings["reduce_max_depth"] = int(self.reduce_max_depth_slider.value)
+        self.settings["log_to_file"] = bool(self.log_to_file_switch.value); self.log_sink.set_file(core.LOG_FILE if self.settings["log_to_file"] else None)
+        self.settings["response_cache_enabled"] = bool(self.response_cache_switch.value); core.configure_response_cache(self.settings, self.log_message)
         new_seed_color = self.color_seed_input.value.strip(); current_seed_color = self.settings.get("color_scheme_seed", "blue")
         if new_seed_color != current_seed_color:
             try:
@@ -691,15 +871,33 @@ class TiebaGPTApp:
                 self.gemini_client = None; self.log_message(f"提供的 Key 无效: {ex}", LogLevel.ERROR); self.search_button.disabled = True
         else:
             self.gemini_client = None; self.search_button.disabled = True
+        # 上下文缓存绑定到具体的 API Key，更换客户端时删除旧缓存
+        if self.context_cache: self.page.run_task(self.context_cache.close)
+        self.context_cache = core.GeminiContextCache(self.gemini_client) if self.gemini_client else None
         self._show_snackbar("设置已保存并应用!", color_role="primary"); self.save_settings_button.disabled = True; self.page.update()
 
     def validate_settings(self, e):
         is_valid = (self.api_key_input.value and self.analyzer_model_dd.value and self.generator_model_dd.value)
         self.save_settings_button.disabled = not is_valid; self.page.update()
 
+    async def clear_response_cache_click(self, e):
+        try:
+            if core.RESPONSE_CACHE is not None: await asyncio.to_thread(core.RESPONSE_CACHE.clear)
+            elif os.path.exists(core.RESPONSE_CACHE_FILE):
+                cache = core.create_response_cache(self.settings); await asyncio.to_thread(cache.clear); cache.close()
+            self._show_snackbar("AI响应缓存已清空。", "primary")
+        except Exception as ex: self.log_message(f"清空AI响应缓存失败: {ex}", LogLevel.ERROR)
+        self.page.update()
+
     async def select_thread(self, e):
         self.thread_list_scroll_offset = self.page.scroll.get(self.thread_list_view.uid, ft.ScrollMetrics(0,0,0)).offset if self.page.scroll else 0.0
-        self.selected_thread = e.control.data
+        await self._open_thread(e.control.data)
+
+    async def _open_thread(self, thread, reply_marker: typing.Optional[str] = None):
+        await self._cancel_thread_work()
+        self.selected_thread = thread
+        # 帖子列表中的对象带有最后回复时间，帖子页面中的对象没有；继续分析时沿用发起分析时记录的标记，保证结果缓存的键一致
+        self.selected_thread_marker = reply_marker or core.thread_reply_marker(self.selected_thread)
         self.current_post_page = 1
         self.total_post_pages = 1
         self.current_analysis_tid = None
@@ -711,17 +909,24 @@ class TiebaGPTApp:
         self.preview_display.controls.clear()
         self.preview_display.controls.append(ft.Row([ft.ProgressRing(), ft.Text("正在初始化帖子视图...")], alignment=ft.MainAxisAlignment.CENTER))
         self.page.update()
-        if self.selected_thread.tid in self.analysis_cache:
+        cached_result = await self._load_stored_analysis(self.selected_thread.tid)
+        if cached_result is not None:
+            self._set_analyze_button_job(None)
             self.log_message(f"从缓存加载TID {self.selected_thread.tid}的完整分析结果。")
-            cached_result = self.analysis_cache[self.selected_thread.tid]
             if "summary" in cached_result:
+                self.analysis_result = cached_result
                 self.analysis_display.value = f"## 讨论状况摘要 (缓存)\n\n{cached_result['summary']}"
                 self.current_analysis_tid = self.selected_thread.tid
             else:
                 self.analysis_display.value = "缓存数据格式有误，请重新分析。"
                 self.log_message(f"警告: 缓存的TID {self.selected_thread.tid} 数据缺少 'summary' 键。", LogLevel.WARNING)
         else:
-            self.analysis_display.value = "点击“分析整个帖子”按钮以开始"
+            job = await self._load_analysis_job(self.selected_thread.tid)
+            if job:
+                self.analysis_display.value = f"上次分析未完成（已完成 {job['chunks_done']} 个分块，约至第 {job['last_page']}/{job['total_pages']} 页{'，原因: ' + job['error'] if job['error'] else ''}）。\n\n点击“继续分析”从检查点继续，已完成的分块不会重新分析。"
+            else:
+                self.analysis_display.value = "点击“分析整个帖子”按钮以开始"
+            self._set_analyze_button_job(job)
         
         self.mode_selector.disabled = False
         self.generate_button.disabled = not (self.current_analysis_tid == self.selected_thread.tid)
@@ -732,27 +937,159 @@ class TiebaGPTApp:
         self.progress_ring.visible = False
         self.page.update()
     
+    def _get_result_store(self):
+        if self.result_store is None:
+            try: self.result_store = core.create_result_store()
+            except Exception as e: self.log_message(f"无法打开分析结果存储: {e}", LogLevel.WARNING)
+        return self.result_store
+
+    def _analysis_store_key(self, tid: int) -> tuple:
+        return (tid, self.selected_thread_marker, self.settings.get("analyzer_model", ""), core.analysis_prompts_fingerprint())
+
+    async def _load_stored_analysis(self, tid: int):
+        store = self._get_result_store()
+        if store is None: return None
+        try: return await asyncio.to_thread(store.get, *self._analysis_store_key(tid))
+        except Exception as e: self.log_message(f"读取分析结果缓存失败: {e}", LogLevel.WARNING); return None
+
+    async def _save_stored_analysis(self, store_key: tuple, result: dict):
+        store = self._get_result_store()
+        if store is None: return
+        try: await asyncio.to_thread(store.put, *store_key, result)
+        except Exception as e: self.log_message(f"保存分析结果缓存失败: {e}", LogLevel.WARNING)
+
+    def _analysis_job_key(self, tid: int) -> tuple:
+        return (tid, self.settings.get("analyzer_model", ""), core.analysis_plan_hash(self.settings.get("chunk_char_budget", core.DEFAULT_CHUNK_CHAR_BUDGET)))
+
+    async def _load_analysis_job(self, tid: int) -> typing.Optional[dict]:
+        if self.chunk_store is None: return None
+        try: return await asyncio.to_thread(self.chunk_store.get_job, *self._analysis_job_key(tid))
+        except Exception as e: self.log_message(f"读取分析任务失败: {e}", LogLevel.WARNING); return None
+
+    def _set_analyze_button_job(self, job: typing.Optional[dict]):
+        self.analyze_button.text = f"继续分析 (已完成 {job['chunks_done']} 块)" if job else "分析整个帖子"
+        self.analyze_button.icon = ft.Icons.PLAY_ARROW if job else ft.Icons.INSIGHTS_ROUNDED
+
+    async def _refresh_unfinished_jobs(self):
+        # 只列出按当前分析模型与分块设置可以继续的任务（其余任务的分块无法复用）
+        jobs = []
+        if self.chunk_store is not None:
+            try: jobs = await asyncio.to_thread(self.chunk_store.unfinished_jobs)
+            except Exception as e: self.log_message(f"读取未完成的分析任务失败: {e}", LogLevel.WARNING)
+        self.unfinished_jobs = [job for job in jobs if self._analysis_job_key(job["tid"])[1:] == (job["model"], job["plan_hash"]) and job["tid"] != self.analyzing_tid]
+        self.resume_jobs_button.visible = bool(self.unfinished_jobs)
+        self.resume_jobs_button.tooltip = f"未完成的分析 ({len(self.unfinished_jobs)})"
+        self.page.update()
+
+    def open_resume_jobs_dialog(self, e):
+        job_list = ft.ListView(spacing=5, width=720, height=400)
+        def close_dialog(ev=None): self.page.close(jobs_dialog)
+        async def resume(ev):
+            close_dialog(); await self._resume_analysis_job(ev.control.data)
+        async def discard(ev):
+            job = ev.control.data
+            try: await asyncio.to_thread(self.chunk_store.discard_job, job["tid"], job["model"], job["plan_hash"])
+            except Exception as ex: self.log_message(f"删除分析任务失败: {ex}", LogLevel.WARNING)
+            await self._refresh_unfinished_jobs(); render()
+        def render():
+            job_list.controls = [ft.ListTile(
+                leading=ft.Icon(ft.Icons.PAUSE_CIRCLE_OUTLINE if job["status"] == "running" else ft.Icons.ERROR_OUTLINE),
+                title=ft.Text(job["title"] or f"TID {job['tid']}", max_lines=1, overflow=ft.TextOverflow.ELLIPSIS),
+                subtitle=ft.Text(f"TID {job['tid']} | 已完成 {job['chunks_done']} 块，约至第 {job['last_page']}/{job['total_pages']} 页 | {time.strftime('%m-%d %H:%M', time.localtime(job['updated_at']))}" + (f"\n{job['error']}" if job["error"] else "")),
+                trailing=ft.Row([ft.IconButton(icon=ft.Icons.PLAY_ARROW, tooltip="继续分析", on_click=resume, data=job), ft.IconButton(icon=ft.Icons.DELETE_OUTLINE, tooltip="放弃并删除已保存的分块", on_click=discard, data=job)], tight=True)
+            ) for job in self.unfinished_jobs] or [ft.Text("没有未完成的分析。")]
+            self.page.update()
+        jobs_dialog = ft.AlertDialog(modal=True, title=ft.Text("未完成的分析"), content=job_list, actions=[ft.TextButton("关闭", on_click=close_dialog)], actions_alignment=ft.MainAxisAlignment.END)
+        render(); self.page.open(jobs_dialog); self.page.update()
+
+    async def _resume_analysis_job(self, job: dict):
+        try:
+            thread_obj, posts_obj, _, _ = await self.thread_repository.get_page(job["tid"], 1, self.log_message)
+        except Exception as e:
+            self.log_message(f"获取帖子 {job['tid']} 时出错: {e}", LogLevel.ERROR); return
+        if not thread_obj or not posts_obj:
+            self.log_message(f"无法获取帖子 {job['tid']}，可能已被删除。", LogLevel.ERROR); return
+        await self._open_thread(thread_obj, job.get("reply_marker"))
+        if self.current_analysis_tid != job["tid"]: await self.analyze_thread_click(None)
+
+    async def _run_cancellable(self, attr: str, coro):
+        # 耗时操作作为独立任务运行，停止按钮或离开帖子时取消：取消沿调用链中止在途的 HTTP 请求、关闭 Gemini 流并释放并发槽位
+        task = asyncio.create_task(coro); setattr(self, attr, task)
+        try: await asyncio.wait({task})
+        finally:
+            if not task.done(): task.cancel()
+            if getattr(self, attr) is task: setattr(self, attr, None)
+        if not task.cancelled(): task.result()
+
+    async def _cancel_task(self, attr: str):
+        task = getattr(self, attr)
+        if task and not task.done():
+            task.cancel(); await asyncio.wait({task})
+
+    async def _cancel_thread_work(self):
+        # 等待被取消的任务完成清理后再返回，避免旧帖子的任务在切换后继续更新共享控件
+        self._cancel_prefetch(); self._cancel_preview_render()
+        await self._cancel_task("reply_task"); await self._cancel_task("analysis_task")
+
+    async def stop_analysis_click(self, e): await self._cancel_task("analysis_task")
+    async def stop_reply_click(self, e): await self._cancel_task("reply_task")
+
+    def _cancel_prefetch(self, keep: typing.Iterable[tuple] = ()):
+        keep = set(keep)
+        for key in [key for key in self.prefetch_tasks if key not in keep]:
+            self.prefetch_tasks.pop(key).cancel()
+
+    def _schedule_prefetch(self):
+        tid = self.selected_thread.tid
+        neighbours = [self.current_post_page + 1] + ([self.current_post_page - 1] if self.PREFETCH_PREVIOUS_PAGE else [])
+        targets = [(tid, page_num) for page_num in neighbours if 1 <= page_num <= self.total_post_pages]
+        self._cancel_prefetch(keep=targets)
+        for key in targets:
+            if key not in self.prefetch_tasks: self.prefetch_tasks[key] = asyncio.create_task(self._prefetch_page(*key))
+
+    async def _prefetch_page(self, tid: int, page_num: int):
+        # 预取结果保留在共享的页面仓库中（分析时可直接复用）；失败时静默返回 None，翻页时会重新获取
+        try:
+            return await self.thread_repository.get_page(tid, page_num, lambda message: None)
+        except Exception:
+            return None
+
     async def _load_and_display_post_page(self, init: bool = False):
+        self._cancel_preview_render()
         if init: self.current_post_page = 1
-        else:
+        prefetched = self.prefetch_tasks.pop((self.selected_thread.tid, self.current_post_page), None)
+        self._cancel_prefetch()
+        if not init:
             self.prev_post_page_button.disabled = True; self.next_post_page_button.disabled = True; self.preview_display.controls.clear()
             self.preview_display.controls.append(ft.Row([ft.ProgressRing(), ft.Text(f"加载第 {self.current_post_page} 页...")]))
             self.page.update()
-        async with tb.Client() as tieba_client:
-            thread_obj, posts_obj, all_comments = await core.fetch_full_thread_data(tieba_client, self.selected_thread.tid, self.log_message, page_num=self.current_post_page)
+        try:
+            result = await prefetched if prefetched is not None else None
+            if result and result[1]:
+                thread_obj, posts_obj, all_comments, _ = result
+            elif init:
+                thread_obj, posts_obj, all_comments, _ = await self.thread_repository.get_first_page(self.selected_thread.tid, self.log_message, known_thread=self.selected_thread)
+            else:
+                thread_obj, posts_obj, all_comments, _ = await self.thread_repository.get_page(self.selected_thread.tid, self.current_post_page, self.log_message)
+        except Exception as e:
+            self.log_message(f"加载TID {self.selected_thread.tid} 的第 {self.current_post_page} 页时出错: {e}", LogLevel.ERROR)
+            thread_obj = posts_obj = None
         self.preview_display.controls.clear()
         if not thread_obj or not posts_obj:
             self.log_message(f"错误：无法加载TID {self.selected_thread.tid} 的第 {self.current_post_page} 页。", LogLevel.ERROR)
-            self.preview_display.controls.append(ft.Text(f"加载第 {self.current_post_page} 页失败。")); return
+            self.preview_display.controls.append(ft.Text(f"加载第 {self.current_post_page} 页失败。"))
+            self.prev_post_page_button.disabled = self.current_post_page <= 1; self.next_post_page_button.disabled = self.current_post_page >= self.total_post_pages
+            self.page.update(); return
         if init: 
             self.total_post_pages = posts_obj.page.total_page
             if not isinstance(self.selected_thread, tb_typing.Thread) or not self.selected_thread.contents: self.selected_thread = thread_obj
-        self._build_rich_preview(self.selected_thread, posts_obj.objs, all_comments)
+        self._build_rich_preview(self.selected_thread, posts_obj.objs, all_comments, cache_key=(self.selected_thread.tid, self.current_post_page))
         main_post_text = core.format_main_post_text(self.selected_thread); discussion_part_text = core.format_discussion_text(self.selected_thread, posts_obj.objs, all_comments)
         self.discussion_text = f"{main_post_text}\n{discussion_part_text}"
         self.post_page_display.value = f"第 {self.current_post_page} / {self.total_post_pages} 页"
         self.prev_post_page_button.disabled = self.current_post_page <= 1; self.next_post_page_button.disabled = self.current_post_page >= self.total_post_pages
         self.page.update()
+        self._schedule_prefetch()
         if self.preview_display.uid in (self.page.scroll or {}): self.page.scroll[self.preview_display.uid].scroll_to(offset=0, duration=100)
 
     async def load_prev_post_page(self, e):
@@ -760,77 +1097,128 @@ class TiebaGPTApp:
     async def load_next_post_page(self, e):
         if self.current_post_page < self.total_post_pages: self.current_post_page += 1; await self._load_and_display_post_page()
 
-    def _build_rich_preview(self, thread: tb_typing.Thread, posts: list[tb_typing.Post], all_comments: dict[int, list[tb_typing.Comment]]):
-        lz_user_name = getattr(thread.user, 'user_name', '未知用户'); self.preview_display.controls.clear()
-        for post in posts:
-            post_content = core.format_contents(post.contents).strip() or "(无正文)"; post_floor = post.floor
-            self.preview_display.controls.append(self._create_post_widget_by_user(post.user, post_content, "主楼" if post_floor == 1 else f"{post_floor}楼", lz_user_name))
-            if post.pid in all_comments:
-                comment_container = ft.Column(spacing=5)
-                for comment in all_comments[post.pid]:
-                    comment_content = core.format_contents(comment.contents).strip()
-                    if not comment_content: continue
-                    comment_container.controls.append(self._create_post_widget_by_user(comment.user, comment_content, "回复", lz_user_name, is_comment=True))
-                self.preview_display.controls.append(ft.Container(content=comment_container, padding=ft.padding.only(left=20, top=5, bottom=10)))
-        self.page.update()
+    def _cancel_preview_render(self):
+        if self.preview_render_task and not self.preview_render_task.done():
+            self.preview_render_task.cancel()
+        self.preview_render_task = None
+
+    def _create_comment_toggle(self, comment_container: ft.Column, comment_items: list[tuple], lz_user_name: str) -> ft.Control:
+        # 折叠的楼中楼在首次展开时才创建控件
+        visible_count = self.PREVIEW_COMMENTS_VISIBLE; hidden_count = len(comment_items) - visible_count; hidden_widgets = []
+        toggle = ft.TextButton(f"展开剩余 {hidden_count} 条回复", icon=ft.Icons.EXPAND_MORE, data=False)
+        def on_toggle(e):
+            expanded = not toggle.data
+            if expanded and not hidden_widgets:
+                hidden_widgets.extend(self._create_post_widget_by_user(user, content, "回复", lz_user_name, is_comment=True) for user, content in comment_items[visible_count:])
+            comment_container.controls = comment_container.controls[:visible_count] + (hidden_widgets if expanded else []) + [toggle]
+            toggle.data = expanded; toggle.text = "收起回复" if expanded else f"展开剩余 {hidden_count} 条回复"; toggle.icon = ft.Icons.EXPAND_LESS if expanded else ft.Icons.EXPAND_MORE
+            if comment_container.page: comment_container.update()
+        toggle.on_click = on_toggle
+        return toggle
+
+    def _build_floor_widgets(self, post: tb_typing.Post, all_comments: dict[int, list[tb_typing.Comment]], lz_user_name: str) -> list[ft.Control]:
+        post_content = core.format_contents(post.contents).strip() or "(无正文)"; post_floor = post.floor
+        widgets = [self._create_post_widget_by_user(post.user, post_content, "主楼" if post_floor == 1 else f"{post_floor}楼", lz_user_name)]
+        if post.pid in all_comments:
+            comment_items = [(comment.user, content) for comment in all_comments[post.pid] if (content := core.format_contents(comment.contents).strip())]
+            comment_container = ft.Column(spacing=5)
+            if len(comment_items) > self.PREVIEW_COMMENT_COLLAPSE_THRESHOLD:
+                comment_container.controls = [self._create_post_widget_by_user(user, content, "回复", lz_user_name, is_comment=True) for user, content in comment_items[:self.PREVIEW_COMMENTS_VISIBLE]]
+                comment_container.controls.append(self._create_comment_toggle(comment_container, comment_items, lz_user_name))
+            else:
+                comment_container.controls = [self._create_post_widget_by_user(user, content, "回复", lz_user_name, is_comment=True) for user, content in comment_items]
+            widgets.append(ft.Container(content=comment_container, padding=ft.padding.only(left=20, top=5, bottom=10)))
+        return widgets
+
+    def _cache_preview_widgets(self, cache_key: typing.Optional[tuple], widgets: list):
+        if cache_key is None: return
+        self.preview_widget_cache[cache_key] = widgets; self.preview_widget_cache.move_to_end(cache_key)
+        while len(self.preview_widget_cache) > self.PREVIEW_CACHED_PAGES: self.preview_widget_cache.popitem(last=False)
+
+    def _build_rich_preview(self, thread: tb_typing.Thread, posts: list[tb_typing.Post], all_comments: dict[int, list[tb_typing.Comment]], cache_key: typing.Optional[tuple] = None):
+        # 先同步渲染首屏，其余楼层由后台任务分批追加；同一页内容未变化时直接复用之前创建的控件
+        self._cancel_preview_render()
+        if cache_key is not None:
+            cache_key = (*cache_key, tuple((post.pid, len(all_comments.get(post.pid, ()))) for post in posts))
+            cached_widgets = self.preview_widget_cache.get(cache_key)
+            if cached_widgets is not None:
+                self.preview_widget_cache.move_to_end(cache_key); self.preview_display.controls = list(cached_widgets); return
+        lz_user_name = getattr(thread.user, 'user_name', '未知用户')
+        widgets = [widget for post in posts[:self.PREVIEW_FIRST_BATCH] for widget in self._build_floor_widgets(post, all_comments, lz_user_name)]
+        self.preview_display.controls = list(widgets)
+        if len(posts) > self.PREVIEW_FIRST_BATCH:
+            self.preview_render_task = asyncio.create_task(self._render_remaining_preview(posts[self.PREVIEW_FIRST_BATCH:], all_comments, lz_user_name, widgets, cache_key))
+        else:
+            self._cache_preview_widgets(cache_key, widgets)
 
-    def _update_analysis_progress(self, current_chunk, total_chunks, page_start, page_end):
-        self.analysis_progress_bar.value = current_chunk / total_chunks
-        self.log_message(f"分析进度: {current_chunk}/{total_chunks} (正在处理第 {page_start}-{page_end} 页)"); self.page.update()
+    async def _render_remaining_preview(self, posts: list[tb_typing.Post], all_comments: dict[int, list[tb_typing.Comment]], lz_user_name: str, widgets: list, cache_key: typing.Optional[tuple]):
+        for start in range(0, len(posts), self.PREVIEW_BATCH):
+            await asyncio.sleep(0)
+            batch = [widget for post in posts[start:start + self.PREVIEW_BATCH] for widget in self._build_floor_widgets(post, all_comments, lz_user_name)]
+            widgets.extend(batch); self.preview_display.controls.extend(batch)
+            if self.preview_display.page: self.preview_display.update()
+        self._cache_preview_widgets(cache_key, widgets)
 
-    async def analyze_thread_click(self, e):
-        current_tid = self.selected_thread.tid
-        self.analyze_button.disabled = True; self.generate_button.disabled = True; self.optimize_button.disabled = True
+    def _update_analysis_progress(self, pages_done, total_pages, page_start, page_end):
+        self.analysis_progress_bar.value = pages_done / total_pages if total_pages else 0
+        self.log_message(f"分析进度: {pages_done}/{total_pages} 页 (正在分析第 {page_start}-{page_end} 页的分块)"); self.page.update()
+
+    async def analyze_thread_click(self, e): await self._run_cancellable("analysis_task", self._analyze_thread())
+
+    async def _analyze_thread(self):
+        current_tid = self.selected_thread.tid; store_key = self._analysis_store_key(current_tid); self.analyzing_tid = current_tid
+        self.analyze_button.disabled = True; self.generate_button.disabled = True; self.optimize_button.disabled = True; self.compare_modes_button.disabled = True; self.stop_analysis_button.visible = True
         self.analysis_display.value = "⏳ 开始分批次分析，请稍候..."; self.analysis_progress_bar.visible = True; self.analysis_progress_bar.value = 0; self.page.update()
-        async with tb.Client() as tieba_client:
-            self.analysis_result = await core.analyze_stance_by_page(tieba_client, self.gemini_client, current_tid, self.total_post_pages, self.settings["analyzer_model"], self.log_message, self._update_analysis_progress, self.settings.get("pages_per_api_call", 4))
-        self.analysis_progress_bar.visible = False; self.analyze_button.disabled = False
+        try:
+            analysis_result = await core.analyze_stance_by_page(None, self.gemini_client, current_tid, self.total_post_pages, self.settings["analyzer_model"], self.log_message, self._update_analysis_progress, self.settings.get("chunk_char_budget", core.DEFAULT_CHUNK_CHAR_BUDGET), self.settings.get("fetch_concurrency", core.DEFAULT_FETCH_CONCURRENCY), self.settings.get("analysis_concurrency", core.DEFAULT_ANALYSIS_CONCURRENCY), self.page_cache, self.chunk_store, self.settings.get("reduce_fan_in", core.DEFAULT_REDUCE_FAN_IN), self.settings.get("reduce_max_depth", core.DEFAULT_REDUCE_MAX_DEPTH), self.settings.get("comment_concurrency", core.DEFAULT_COMMENT_CONCURRENCY), repository=self.thread_repository, reply_marker=store_key[1])
+        except asyncio.CancelledError:
+            self.analysis_display.value = "⏹ 分析已停止，已完成的分块均已保存，可点击“继续分析”从检查点继续。"; self.log_message(f"已停止TID {current_tid} 的分析。", LogLevel.WARNING)
+            raise
+        finally:
+            self.analysis_progress_bar.visible = False; self.analyze_button.disabled = False; self.stop_analysis_button.visible = False; self.analyzing_tid = None
+            self._set_analyze_button_job(await self._load_analysis_job(current_tid)); self.page.update()
+            await self._refresh_unfinished_jobs()
+        self.analysis_result = analysis_result
+        incomplete = bool(self.analysis_result.get("failed_pages") or self.analysis_result.get("failed_chunks"))
         if "summary" in self.analysis_result:
-            self.analysis_cache[current_tid] = self.analysis_result; self.current_analysis_tid = current_tid
-            self.analysis_display.value = f"## 讨论状况摘要\n\n{self.analysis_result['summary']}"; self.generate_button.disabled = False; self._update_optimize_button_state()
+            # 不完整的结果不写入结果缓存，以便之后继续分析补全
+            if not incomplete: await self._save_stored_analysis(store_key, self.analysis_result)
+            self.current_analysis_tid = current_tid
+            self.analysis_display.value = f"## 讨论状况摘要\n\n{self.analysis_result['summary']}" + ("\n\n> ⚠️ 部分页面或分块未能完成分析，摘要可能不完整，可点击“继续分析”补全。" if incomplete else "")
+            self.generate_button.disabled = False; self._update_optimize_button_state()
         else: self.analysis_display.value = f"❌ 分析失败:\n\n{self.analysis_result.get('error', '未知错误')}"
         self.page.update()
 
-    def _stream_and_update_worker(self, core_function, core_args: dict):
-        generated_reply = ""
-        is_first_chunk = True
-        try:
-            generated_chunks = core_function(**core_args)
-            for chunk in generated_chunks:
-                if is_first_chunk:
-                    if self.blinking_cursor_task and not self.blinking_cursor_task.done():
-                        self.blinking_cursor_task.cancel()
-                    generated_reply = ""
-                    is_first_chunk = False
-
-                generated_reply += chunk
-                self.reply_display.value = generated_reply + " ▌"
-                self.page.update()
-
-            if is_first_chunk and self.blinking_cursor_task and not self.blinking_cursor_task.done():
-                self.blinking_cursor_task.cancel()
-
-            self.reply_display.value = generated_reply
-            self.page.update()
+    def _stop_blinking_cursor(self):
+        if self.blinking_cursor_task and not self.blinking_cursor_task.done():
+            self.blinking_cursor_task.cancel()
 
+    async def _stream_and_update_reply(self, core_function, core_args: dict):
+        renderer = ReplyStreamRenderer(self.reply_display, interval=self.STREAM_FLUSH_INTERVAL, max_pending_chars=self.STREAM_FLUSH_CHARS)
+        try:
+            producer = asyncio.ensure_future(renderer.consume(core_function(**core_args)))
+            await renderer.run(producer, on_first_chunk=self._stop_blinking_cursor)
+            self._stop_blinking_cursor()
+            producer.result()
+        except asyncio.CancelledError:
+            self._stop_blinking_cursor()
+            self.reply_display.value = renderer.text + ("\n\n" if renderer.text else "") + "*(已停止生成)*"
+            raise
         except Exception as e:
             error_message = f"处理回复流时发生错误: {e}"
             self.log_message(error_message, LogLevel.ERROR)
+            self._stop_blinking_cursor()
             self.reply_display.value = error_message
-            if self.blinking_cursor_task and not self.blinking_cursor_task.done():
-                self.blinking_cursor_task.cancel()
-            self.page.update()
         finally:
-            self.generate_reply_ring.visible = False
+            self.generate_reply_ring.visible = False; self.stop_reply_button.visible = False
             self.generate_button.disabled = False
             self._update_optimize_button_state()
-            self.copy_button.disabled = not bool(generated_reply.strip())
+            self.copy_button.disabled = not bool(renderer.text.strip())
             if self.page:
                 self.page.update()
 
     async def _execute_ai_reply_action(self, core_function, action_name: str, **kwargs):
-        self.is_ai_generating = True
-        cached_analysis = self.analysis_cache.get(self.selected_thread.tid)
+        cached_analysis = self.analysis_result if self.current_analysis_tid == self.selected_thread.tid else None
         if not cached_analysis or "summary" not in cached_analysis:
             self.log_message(f"错误：未找到当前帖子的分析摘要，无法{action_name}回复。", LogLevel.ERROR); return
         self.current_mode_id = self.mode_selector.value
@@ -840,7 +1228,8 @@ class TiebaGPTApp:
         if selected_mode_config.get('is_custom', False):
             custom_input = self.custom_view_input.value.strip()
             if not custom_input: self.log_message("使用此自定义模型时，自定义内容不能为空！", LogLevel.WARNING); return
-        self.generate_reply_ring.visible = True; self.generate_button.disabled = True; self.optimize_button.disabled = True
+        self.is_ai_generating = True
+        self.generate_reply_ring.visible = True; self.stop_reply_button.visible = True; self.generate_button.disabled = True; self.optimize_button.disabled = True
         self.copy_button.disabled = True; self.reply_display.value = ""
         self.blinking_cursor_task = asyncio.create_task(self._blinking_cursor()); self.page.update()
         core_args = {
@@ -851,25 +1240,27 @@ class TiebaGPTApp:
             "model_name": self.settings["generator_model"],
             "log_callback": self.log_message,
             "custom_input": custom_input,
+            "context_cache": self.context_cache,
             **kwargs
         }
-        await asyncio.to_thread(self._stream_and_update_worker, core_function, core_args)
-        self.is_ai_generating = False
+        try: await self._stream_and_update_reply(core_function, core_args)
+        finally: self.is_ai_generating = False
 
-    async def generate_reply_click(self, e): await self._execute_ai_reply_action(core.generate_reply_stream, "生成")
+    async def generate_reply_click(self, e): await self._run_cancellable("reply_task", self._execute_ai_reply_action(core.generate_reply_stream, "生成"))
     async def optimize_reply_click(self, e):
         reply_draft = self.reply_draft_input.value.strip()
         if not reply_draft and self.reply_display.value:
             self.log_message("优化草稿为空，自动使用已有回复进行优化。"); reply_draft = self.reply_display.value.strip()
             self.reply_draft_input.value = reply_draft; self.page.update()
         if not reply_draft: self.log_message("错误：没有可供优化的内容。", LogLevel.ERROR); return
-        await self._execute_ai_reply_action(core.optimize_reply_stream, "优化", reply_draft=reply_draft)
+        await self._run_cancellable("reply_task", self._execute_ai_reply_action(core.optimize_reply_stream, "优化", reply_draft=reply_draft))
 
     def _update_optimize_button_state(self):
         has_draft = bool(self.reply_draft_input.value and self.reply_draft_input.value.strip())
         has_existing_reply = bool(self.reply_display.value and self.reply_display.value.strip() and "⏳" not in self.reply_display.value)
         has_valid_analysis = self.selected_thread is not None and self.current_analysis_tid == self.selected_thread.tid
         self.optimize_button.disabled = not ((has_draft or has_existing_reply) and has_valid_analysis)
+        self.compare_modes_button.disabled = not has_valid_analysis
         if self.page: self.page.update()
 
     def on_draft_input_change(self, e): 
@@ -889,12 +1280,13 @@ class TiebaGPTApp:
         if not tieba_name: self.log_message("错误：贴吧名称不能为空。", LogLevel.ERROR); return
         if not self.gemini_client: self.log_message("Gemini客户端未初始化，请先在设置中配置有效的API Key。", LogLevel.ERROR); return
         self.progress_ring.visible = True; self.search_button.disabled = True; self.prev_page_button.disabled = True; self.next_page_button.disabled = True; self.page.update()
-        async with tb.Client() as tieba_client:
-            if self.current_search_query: self.threads = await core.search_threads_by_page(tieba_client, tieba_name, self.current_search_query, self.current_page_num, self.log_message)
+        async with self.tieba_clients.session() as tieba_client:
+            if self.current_search_query: threads = await core.search_threads_by_page(tieba_client, tieba_name, self.current_search_query, self.current_page_num, self.log_message)
             else:
                 try: sort_type = ThreadSortType(int(self.sort_type_dropdown.value))
                 except (ValueError, TypeError): self.log_message(f"警告：无效的排序值。将使用默认排序。", LogLevel.WARNING); sort_type = ThreadSortType.REPLY
-                self.threads = await core.fetch_threads_by_page(tieba_client, tieba_name, self.current_page_num, sort_type, self.log_message)
+                threads = await core.fetch_threads_by_page(tieba_client, tieba_name, self.current_page_num, sort_type, self.log_message)
+            self.threads = self.tieba_clients.report_result(tieba_client, threads) or []
         self._update_thread_list_view(); self.progress_ring.visible = False; self.search_button.disabled = False
         self.page_num_display.value = f"第 {self.current_page_num} 页"
         self.prev_page_button.disabled = self.current_page_num <= 1; self.next_page_button.disabled = not self.threads
@@ -938,11 +1330,109 @@ class TiebaGPTApp:
 
     def copy_reply_click(self, e): self.page.set_clipboard(self.reply_display.value); self._show_snackbar("回复已复制到剪贴板!","tertiary"); self.page.update()
     def copy_log_click(self, e):
-        if not self.status_log.controls: self._show_snackbar("日志为空，无需复制。", "tertiary"); return
-        log_texts = [row.controls[1].value for row in self.status_log.controls if isinstance(row, ft.Row) and len(row.controls) > 1 and hasattr(row.controls[1], 'value')]
+        log_texts = self.log_sink.texts()
+        if not log_texts: self._show_snackbar("日志为空，无需复制。", "tertiary"); return
         self.page.set_clipboard("\n".join(log_texts)); self._show_snackbar("所有日志已成功复制到剪贴板！", "primary"); self.page.update()
 
+    def _build_perf_table(self) -> ft.Control:
+        summary = core.PERF.summary()
+        if not summary:
+            return ft.Text("暂无性能数据，进行一次分析或生成回复后再查看。")
+        def _extra(totals: dict) -> str:
+            labels = {"prompt_chars": "输入字符", "response_chars": "输出字符", "prompt_tokens": "输入tokens", "response_tokens": "输出tokens", "requests": "请求", "hits": "命中", "failed": "失败"}
+            parts = [f"{label} {int(totals[key])}" for key, label in labels.items() if key in totals]
+            if "ttft_seconds" in totals: parts.append(f"首字合计 {totals['ttft_seconds']:.2f}s")
+            return "，".join(parts)
+        rows = [ft.DataRow(cells=[ft.DataCell(ft.Text(stage)), ft.DataCell(ft.Text(str(stats["count"]))), ft.DataCell(ft.Text(f"{stats['total_seconds']:.2f}")),
+                                  ft.DataCell(ft.Text(f"{stats['avg_seconds'] * 1000:.1f}")), ft.DataCell(ft.Text(f"{stats['max_seconds'] * 1000:.1f}")),
+                                  ft.DataCell(ft.Text(str(stats["errors"]), color="error" if stats["errors"] else None)), ft.DataCell(ft.Text(_extra(stats["totals"]), size=11))])
+                for stage, stats in sorted(summary.items(), key=lambda item: item[1]["total_seconds"], reverse=True)]
+        columns = [ft.DataColumn(ft.Text(label), numeric=numeric) for label, numeric in (("阶段", False), ("次数", True), ("总耗时(s)", True), ("平均(ms)", True), ("最大(ms)", True), ("错误", True), ("附加信息", False))]
+        return ft.DataTable(columns=columns, rows=rows, column_spacing=20, data_row_min_height=32, heading_row_height=36)
+
+    def open_perf_dialog(self, e):
+        table_container = ft.Column([self._build_perf_table()], scroll=ft.ScrollMode.ADAPTIVE, width=900, height=450)
+        def copy_export(ev, fmt: str):
+            self.page.set_clipboard(core.PERF.export_json() if fmt == "json" else core.PERF.export_prometheus())
+            self._show_snackbar(f"性能数据已以 {'JSON' if fmt == 'json' else 'Prometheus'} 格式复制到剪贴板！", "primary"); self.page.update()
+        def refresh(ev):
+            table_container.controls = [self._build_perf_table()]; self.page.update()
+        def reset(ev):
+            core.PERF.reset(); refresh(ev)
+        perf_dialog = ft.AlertDialog(modal=True, title=ft.Text("性能统计"), content=table_container, actions_alignment=ft.MainAxisAlignment.END,
+            actions=[ft.TextButton("刷新", on_click=refresh), ft.TextButton("清空", on_click=reset), ft.TextButton("复制 JSON", on_click=lambda ev: copy_export(ev, "json")),
+                     ft.TextButton("复制 Prometheus", on_click=lambda ev: copy_export(ev, "prometheus")), ft.FilledButton("关闭", on_click=lambda _: self.page.close(perf_dialog))])
+        self.page.open(perf_dialog); self.page.update()
+
+    def open_compare_modes_dialog(self, e):
+        cached_analysis = self.analysis_result if self.current_analysis_tid == self.selected_thread.tid else None
+        if not cached_analysis or "summary" not in cached_analysis:
+            self.log_message("错误：未找到当前帖子的分析摘要，无法生成回复。", LogLevel.ERROR); return
+        custom_input = self.custom_view_input.value.strip() if self.custom_view_input.value else ""
+        mode_names = {}; checkboxes = []
+        for mode_id, config in core.get_sorted_reply_modes():
+            mode_names[mode_id] = config.get('name', '未命名')
+            needs_input = config.get('is_custom', False) and not custom_input
+            checkboxes.append(ft.Checkbox(label=mode_names[mode_id], data=mode_id, value=mode_id == self.current_mode_id and not needs_input, disabled=needs_input, tooltip="需先在“生成回复”中填写自定义内容" if needs_input else None))
+        panes = ft.Row(scroll=ft.ScrollMode.ADAPTIVE, vertical_alignment=ft.CrossAxisAlignment.START, expand=True)
+        state = {"task": None}
+
+        def copy_text(text: str):
+            self.page.set_clipboard(text); self._show_snackbar("回复已复制到剪贴板!", "tertiary"); self.page.update()
+        def adopt_text(text: str):
+            self.reply_display.value = text; self.copy_button.disabled = not text.strip(); close_dialog(None); self._update_optimize_button_state()
+        def close_dialog(ev):
+            if state["task"] and not state["task"].done(): state["task"].cancel()
+            self.page.close(compare_dialog)
+
+        def build_pane(mode_id: str, display: ft.Markdown, renderer: ReplyStreamRenderer) -> ft.Control:
+            header = ft.Row([
+                ft.Text(mode_names[mode_id], weight=ft.FontWeight.BOLD, expand=True),
+                ft.IconButton(icon=ft.Icons.CONTENT_COPY_ROUNDED, tooltip="复制", on_click=lambda _: copy_text(renderer.text)),
+                ft.IconButton(icon=ft.Icons.CHECK, tooltip="采用此回复", on_click=lambda _: adopt_text(renderer.text)),
+            ])
+            return ft.Container(content=ft.Column([header, ft.Column([display], scroll=ft.ScrollMode.ADAPTIVE, expand=True)], expand=True),
+                                width=360, border=ft.border.all(1, ft.Colors.OUTLINE), border_radius=5, padding=10, bgcolor=ft.Colors.with_opacity(0.12, "primary"))
+
+        async def start(ev):
+            mode_ids = [cb.data for cb in checkboxes if cb.value]
+            if not mode_ids: self._show_snackbar("请至少选择一个回复模式。", "tertiary"); self.page.update(); return
+            loop = asyncio.get_running_loop(); renderers = {}; finished = {}
+            panes.controls.clear()
+            for mode_id in mode_ids:
+                display = ft.Markdown(selectable=True, code_theme="atom-one-light")
+                renderers[mode_id] = ReplyStreamRenderer(display, interval=self.STREAM_FLUSH_INTERVAL, max_pending_chars=self.STREAM_FLUSH_CHARS)
+                finished[mode_id] = loop.create_future()
+                panes.controls.append(build_pane(mode_id, display, renderers[mode_id]))
+            start_button.disabled = True; compare_dialog.update()
+
+            def on_done(mode_id: str):
+                if not finished[mode_id].done(): finished[mode_id].set_result(None)
+            # 每个模式一个面板，各自按节奏刷新；同时进行的请求数由设置中的“并行生成模式数”限制
+            state["task"] = asyncio.ensure_future(core.generate_reply_streams(
+                self.gemini_client, self.discussion_text, cached_analysis["summary"], mode_ids, self.settings["generator_model"], self.log_message,
+                on_chunk=lambda mode_id, text: renderers[mode_id].feed(text), on_done=on_done, custom_input=custom_input or None,
+                max_concurrency=self.settings.get("reply_fanout_concurrency", core.DEFAULT_REPLY_FANOUT_CONCURRENCY), context_cache=self.context_cache))
+            try:
+                await asyncio.gather(*[renderers[mode_id].run(finished[mode_id]) for mode_id in mode_ids])
+                await state["task"]
+                self.log_message(f"多模式对比生成完成，共 {len(mode_ids)} 个模式。")
+            except asyncio.CancelledError:
+                self.log_message("多模式对比生成已取消。", LogLevel.WARNING)
+            except Exception as ex:
+                self.log_message(f"多模式对比生成时发生错误: {ex}", LogLevel.ERROR)
+            finally:
+                start_button.disabled = False
+                if compare_dialog.page: compare_dialog.update()
+
+        start_button = ft.FilledButton("开始生成", icon=ft.Icons.AUTO_AWESOME, on_click=start)
+        compare_dialog = ft.AlertDialog(modal=True, title=ft.Text("多模式对比生成"), actions_alignment=ft.MainAxisAlignment.END,
+            content=ft.Column([ft.Row(checkboxes, wrap=True), ft.Divider(), panes], width=1100, height=560),
+            actions=[start_button, ft.TextButton("关闭", on_click=close_dialog)])
+        self.page.open(compare_dialog); self.page.update()
+
     async def back_to_main_view(self, e):
+        await self._cancel_thread_work()
         self.navigation_rail.selected_index = 0
         await self.navigate(None)
         await asyncio.sleep(0.1)
@@ -1111,6 +1601,8 @@ def main(page: ft.Page):
         expand=True,
     )
     
+    page.on_disconnect = app.shutdown
+    page.on_close = app.shutdown
     page.add(main_layout)
     app.initialize_app()
 
@@ -0,0 +1,60 @@
+import collections
+import json
+import os
+import threading
+import time
+import typing
+
+# 日志汇集：任意线程以 O(1) 写入，界面按固定节奏批量取走；可选以 JSON Lines 格式写入日志文件
+class LogSink:
+    def __init__(self, capacity: int = 1000, pending_capacity: int = 100, file_path: typing.Optional[str] = None, max_file_bytes: int = 5 * 1024 * 1024):
+        self.history: collections.deque[tuple] = collections.deque(maxlen=capacity)
+        self._pending: collections.deque[tuple] = collections.deque(maxlen=pending_capacity)
+        self._file_pending: list[tuple] = []
+        self._dropped = 0
+        self._lock = threading.Lock()
+        self.file_path = file_path
+        self.max_file_bytes = max_file_bytes
+
+    def emit(self, level: str, message: str):
+        record = (time.time(), level, message)
+        with self._lock:
+            self.history.append(record)
+            if len(self._pending) == self._pending.maxlen:
+                self._dropped += 1
+            self._pending.append(record)
+            if self.file_path:
+                self._file_pending.append(record)
+
+    def drain(self) -> tuple[list[tuple], int]:
+        # 返回待显示的记录与因积压被丢弃的条数（丢弃的记录仍保留在 history 与日志文件中）
+        with self._lock:
+            batch = list(self._pending)
+            self._pending.clear()
+            dropped, self._dropped = self._dropped, 0
+        return batch, dropped
+
+    def set_file(self, file_path: typing.Optional[str]):
+        with self._lock:
+            self.file_path = file_path
+            if not file_path:
+                self._file_pending.clear()
+
+    @property
+    def has_file_pending(self) -> bool:
+        return bool(self._file_pending)
+
+    def write_file(self):
+        with self._lock:
+            records, self._file_pending = self._file_pending, []
+            file_path = self.file_path
+        if not records or not file_path:
+            return
+        if os.path.exists(file_path) and os.path.getsize(file_path) > self.max_file_bytes:
+            os.replace(file_path, file_path + ".1")
+        with open(file_path, 'a', encoding='utf-8') as f:
+            f.writelines(json.dumps({"time": round(ts, 3), "level": level, "message": message}, ensure_ascii=False) + "\n" for ts, level, message in records)
+
+    def texts(self) -> list[str]:
+        with self._lock:
+            return [f"[{level}] {message}" for _, level, message in self.history]
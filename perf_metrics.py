@@ -0,0 +1,98 @@
+import collections
+import contextlib
+import functools
+import json
+import threading
+import time
+import typing
+
+# 各阶段耗时与计数：span 明细保留在有界队列中，按阶段的聚合统计常驻，可导出为 JSON 或 Prometheus 文本
+
+class PerfRecorder:
+    # 标识类属性（页码等）只保留在明细中，不参与累加
+    LABEL_KEYS = frozenset({"tid", "page", "chunk", "depth"})
+
+    def __init__(self, max_spans: int = 5000):
+        self._spans: collections.deque[dict] = collections.deque(maxlen=max_spans)
+        self._stats: dict[str, dict] = {}
+        self._lock = threading.Lock()
+
+    @contextlib.contextmanager
+    def span(self, stage: str, **attrs) -> typing.Iterator[dict]:
+        started = time.perf_counter()
+        try:
+            yield attrs
+        except BaseException as e:
+            attrs["error"] = type(e).__name__
+            raise
+        finally:
+            self.record(stage, time.perf_counter() - started, **attrs)
+
+    def timed(self, stage: str) -> typing.Callable:
+        def decorator(func):
+            @functools.wraps(func)
+            async def wrapper(*args, **kwargs):
+                with self.span(stage):
+                    return await func(*args, **kwargs)
+            return wrapper
+        return decorator
+
+    def record(self, stage: str, duration: float, **attrs) -> None:
+        span = {"stage": stage, "start": round(time.time() - duration, 3), "duration": round(duration, 6), **attrs}
+        with self._lock:
+            self._spans.append(span)
+            stats = self._stats.get(stage)
+            if stats is None:
+                stats = self._stats[stage] = {"count": 0, "errors": 0, "total_seconds": 0.0, "max_seconds": 0.0, "totals": {}}
+            stats["count"] += 1
+            stats["total_seconds"] += duration
+            stats["max_seconds"] = max(stats["max_seconds"], duration)
+            if "error" in attrs:
+                stats["errors"] += 1
+            for key, value in attrs.items():
+                if key not in self.LABEL_KEYS and isinstance(value, (int, float)) and not isinstance(value, bool):
+                    stats["totals"][key] = stats["totals"].get(key, 0) + value
+
+    def spans(self, stage: typing.Optional[str] = None) -> list[dict]:
+        with self._lock:
+            return [dict(span) for span in self._spans if stage is None or span["stage"] == stage]
+
+    def summary(self) -> dict[str, dict]:
+        with self._lock:
+            result = {}
+            for stage, stats in sorted(self._stats.items()):
+                result[stage] = {
+                    "count": stats["count"], "errors": stats["errors"],
+                    "total_seconds": round(stats["total_seconds"], 6), "max_seconds": round(stats["max_seconds"], 6),
+                    "avg_seconds": round(stats["total_seconds"] / stats["count"], 6),
+                    "totals": dict(stats["totals"]),
+                }
+            return result
+
+    def reset(self) -> None:
+        with self._lock:
+            self._spans.clear()
+            self._stats.clear()
+
+    def export_json(self, include_spans: bool = True) -> str:
+        data = {"summary": self.summary()}
+        if include_spans:
+            data["spans"] = self.spans()
+        return json.dumps(data, ensure_ascii=False, indent=2)
+
+    def export_prometheus(self, prefix: str = "tiebagpt") -> str:
+        summary = self.summary()
+        lines = [f"# HELP {prefix}_stage_duration_seconds Time spent per pipeline stage.", f"# TYPE {prefix}_stage_duration_seconds summary"]
+        for stage, stats in summary.items():
+            lines.append(f'{prefix}_stage_duration_seconds_sum{{stage="{stage}"}} {stats["total_seconds"]}')
+            lines.append(f'{prefix}_stage_duration_seconds_count{{stage="{stage}"}} {stats["count"]}')
+        lines += [f"# HELP {prefix}_stage_duration_max_seconds Slowest single span per stage.", f"# TYPE {prefix}_stage_duration_max_seconds gauge"]
+        lines += [f'{prefix}_stage_duration_max_seconds{{stage="{stage}"}} {stats["max_seconds"]}' for stage, stats in summary.items()]
+        lines += [f"# HELP {prefix}_stage_errors_total Spans that ended with an exception.", f"# TYPE {prefix}_stage_errors_total counter"]
+        lines += [f'{prefix}_stage_errors_total{{stage="{stage}"}} {stats["errors"]}' for stage, stats in summary.items()]
+        lines += [f"# HELP {prefix}_stage_value_total Summed numeric span attributes (chars, tokens, requests).", f"# TYPE {prefix}_stage_value_total counter"]
+        for stage, stats in summary.items():
+            lines += [f'{prefix}_stage_value_total{{stage="{stage}",field="{key}"}} {value}' for key, value in sorted(stats["totals"].items())]
+        return "\n".join(lines) + "\n"
+
+PERF = PerfRecorder()
@@ -0,0 +1,202 @@
+import asyncio
+import email.utils
+import random
+import time
+import typing
+from dataclasses import dataclass
+
+from perf_metrics import PERF
+
+# 外部接口调用的容错层：指数退避 + 随机抖动重试，遵循限流响应给出的重试等待时间，并按后端熔断，熔断期间请求立即失败，避免持续故障时继续堆积请求
+
+RETRYABLE_STATUS = frozenset({408, 429, 500, 502, 503, 504})
+# 业务逻辑错误或程序错误，重试不会改变结果
+NON_RETRYABLE_TYPES = (ValueError, TypeError, KeyError, AttributeError, NotImplementedError)
+NON_RETRYABLE_NAMES = frozenset({"TiebaServerError", "TiebaValueError"})
+
+class CircuitOpenError(Exception):
+    def __init__(self, backend: str, retry_in: float):
+        super().__init__(f"{backend} 接口连续失败，已暂停请求 {retry_in:.1f} 秒" if retry_in > 0 else f"{backend} 接口连续失败，正在试探是否恢复")
+        self.backend = backend
+        self.retry_in = retry_in
+
+def status_code(exc: BaseException) -> typing.Optional[int]:
+    for source in (exc, getattr(exc, 'response', None)):
+        for attr in ("code", "status_code", "status"):
+            value = getattr(source, attr, None)
+            if isinstance(value, int) and 100 <= value < 600:
+                return value
+    return None
+
+def _find_retry_delay(details) -> typing.Optional[str]:
+    # Gemini 的限流错误在 details 中携带 google.rpc.RetryInfo，形如 {"retryDelay": "17s"}
+    if isinstance(details, dict):
+        if "retryDelay" in details:
+            return details["retryDelay"]
+        details = list(details.values())
+    if isinstance(details, list):
+        for item in details:
+            found = _find_retry_delay(item)
+            if found:
+                return found
+    return None
+
+def retry_after_seconds(exc: BaseException) -> typing.Optional[float]:
+    explicit = getattr(exc, 'retry_after', None)
+    if isinstance(explicit, (int, float)):
+        return float(explicit)
+    headers = getattr(getattr(exc, 'response', None), 'headers', None)
+    value = headers.get("retry-after") if headers is not None else None
+    if value:
+        try:
+            return max(0.0, float(value))
+        except ValueError:
+            try:
+                return max(0.0, email.utils.parsedate_to_datetime(value).timestamp() - time.time())
+            except (TypeError, ValueError):
+                pass
+    delay = _find_retry_delay(getattr(exc, 'details', None))
+    if isinstance(delay, str) and delay.endswith("s"):
+        try:
+            return float(delay[:-1])
+        except ValueError:
+            pass
+    return None
+
+def is_retryable(exc: BaseException) -> bool:
+    if isinstance(exc, CircuitOpenError):
+        return False
+    if type(exc).__name__ in NON_RETRYABLE_NAMES:
+        return False
+    code = status_code(exc)
+    if code is not None:
+        return code in RETRYABLE_STATUS
+    return not isinstance(exc, NON_RETRYABLE_TYPES)
+
+@dataclass
+class RetryPolicy:
+    max_attempts: int = 4
+    base_delay: float = 0.5
+    max_delay: float = 20.0
+    max_retry_after: float = 60.0
+
+    def backoff(self, attempt: int, retry_after: typing.Optional[float] = None) -> float:
+        # 等抖动：一半固定退避、一半随机，避免并发请求同时重试
+        delay = min(self.max_delay, self.base_delay * (2 ** (attempt - 1)))
+        delay = delay / 2 + random.uniform(0, delay / 2)
+        if retry_after is not None:
+            delay = max(delay, min(retry_after, self.max_retry_after))
+        return delay
+
+class CircuitBreaker:
+    # 连续 failure_threshold 次调用（每次调用含其全部重试）以可重试错误失败后熔断 reset_timeout 秒；
+    # 之后只放行一个请求试探，成功即恢复，失败则再次熔断；熔断与试探期间其余请求等待，而不是立即失败
+    def __init__(self, name: str, failure_threshold: int = 5, reset_timeout: float = 30.0):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self._failures = 0
+        self._open_until = 0.0
+        self._probing = False
+        self._probe_done: typing.Optional[asyncio.Event] = None
+
+    @property
+    def state(self) -> str:
+        if self._failures < self.failure_threshold:
+            return "closed"
+        return "open" if time.monotonic() < self._open_until else "half_open"
+
+    def remaining(self) -> float:
+        if self._failures < self.failure_threshold:
+            return 0.0
+        return max(0.0, self._open_until - time.monotonic())
+
+    async def acquire(self, max_wait: float) -> bool:
+        # 在 max_wait 秒内等待熔断结束或试探结果，等不到时抛出 CircuitOpenError；返回 True 表示本次调用是试探请求
+        deadline = time.monotonic() + max_wait
+        while self._failures >= self.failure_threshold:
+            remaining = self._open_until - time.monotonic()
+            if remaining <= 0 and not self._probing:
+                self._probing = True
+                self._probe_done = asyncio.Event()
+                return True
+            budget = deadline - time.monotonic()
+            if remaining > budget or budget <= 0:
+                raise CircuitOpenError(self.name, max(0.0, remaining))
+            if remaining > 0:
+                await asyncio.sleep(remaining)
+            else:
+                try:
+                    await asyncio.wait_for(self._probe_done.wait(), budget)
+                except asyncio.TimeoutError:
+                    raise CircuitOpenError(self.name, 0.0) from None
+        return False
+
+    def _end_probe(self):
+        self._probing = False
+        if self._probe_done is not None:
+            self._probe_done.set()
+            self._probe_done = None
+
+    def release_probe(self):
+        # 试探请求既未成功也未以可重试错误失败（如被取消）时交还试探机会
+        self._end_probe()
+
+    def record_success(self):
+        self._failures = 0
+        self._end_probe()
+
+    def record_failure(self, retry_after: typing.Optional[float] = None):
+        self._failures += 1
+        if self._failures >= self.failure_threshold:
+            self._open_until = time.monotonic() + max(self.reset_timeout, retry_after or 0.0)
+            PERF.record(f"circuit.{self.name}", 0.0, opened=1)
+        self._end_probe()
+
+class ResilientBackend:
+    def __init__(self, name: str, policy: typing.Optional[RetryPolicy] = None, breaker: typing.Optional[CircuitBreaker] = None):
+        self.name = name
+        self.policy = policy or RetryPolicy()
+        self.breaker = breaker or CircuitBreaker(name)
+
+    async def wait_until_available(self, log_callback: typing.Optional[typing.Callable] = None):
+        # 批量重试前调用：熔断中时等到可以试探为止（最多 max_retry_after 秒），避免重试在熔断期间全部立即失败
+        remaining = self.breaker.remaining()
+        if remaining <= 0:
+            return
+        if log_callback:
+            log_callback(f"{self.name} 接口暂时不可用，{min(remaining, self.policy.max_retry_after):.1f} 秒后重试...")
+        await asyncio.sleep(min(remaining, self.policy.max_retry_after))
+
+    async def run(self, operation: typing.Callable[[], typing.Awaitable], log_callback: typing.Optional[typing.Callable] = None,
+                  check_result: typing.Optional[typing.Callable[[typing.Any], typing.Optional[BaseException]]] = None, description: str = "请求"):
+        # operation 每次调用都应发起一次新的请求；check_result 用于识别以返回值表示的错误（如 aiotieba 结果对象上的 err）
+        # 熔断器只在调用开始前把关，并按整次调用计数；重试等待至少覆盖熔断的剩余时间
+        probe = await self.breaker.acquire(self.policy.max_retry_after)
+        attempt = 0
+        try:
+            while True:
+                attempt += 1
+                try:
+                    result = await operation()
+                    error = check_result(result) if check_result else None
+                    if error is not None:
+                        raise error
+                except Exception as e:
+                    retryable = is_retryable(e)
+                    retry_after = retry_after_seconds(e)
+                    if not retryable or attempt >= self.policy.max_attempts:
+                        if retryable:
+                            self.breaker.record_failure(retry_after)
+                        raise
+                    delay = min(max(self.policy.backoff(attempt, retry_after), self.breaker.remaining()), self.policy.max_retry_after)
+                    PERF.record(f"retry.{self.name}", delay, retries=1, throttled=int(retry_after is not None))
+                    if log_callback:
+                        log_callback(f"{description}失败 ({e})，{delay:.1f} 秒后进行第 {attempt + 1}/{self.policy.max_attempts} 次尝试...")
+                    await asyncio.sleep(delay)
+                else:
+                    self.breaker.record_success()
+                    return result
+        finally:
+            if probe:
+                self.breaker.release_probe()